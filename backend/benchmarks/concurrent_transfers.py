@@ -0,0 +1,196 @@
+"""
+Concurrent slow-download benchmark, WSGI against ASGI
+
+Serves the app under gunicorn with sync workers and then with uvicorn
+workers, using a throwaway database and media root. Opens a number of
+connections that download the same share-link file while reading slowly,
+and reports how many of them got their response within the timeout, the
+time to first byte and the bytes moved while all of them were connected.
+
+Requests ask for ``Range: bytes=1-`` so the transfer skips access
+accounting, which keeps SQLite writes out of the measurement.
+
+Usage: python benchmarks/concurrent_transfers.py [--clients 200] [--size-mb 32]
+       [--workers 2] [--hold 10] [--interfaces wsgi asgi]
+"""
+import os
+import sys
+import time
+import hashlib
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from base64 import b64encode
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SETTINGS_TEMPLATE = """
+from secure_files.settings import *
+
+DATABASES = {{'default': {{'ENGINE': 'django.db.backends.sqlite3', 'NAME': {db!r}, 'OPTIONS': {{'timeout': 30}}}}}}
+MEDIA_ROOT = {media!r}
+FILE_MASTER_KEY = {key!r}
+ALLOWED_HOSTS = ['*']
+DEBUG = False
+RATE_LIMIT_POLICIES = {{}}
+LOGGING = {{'version': 1, 'disable_existing_loggers': False}}
+"""
+
+SERVERS = {
+    'wsgi': ['secure_files.wsgi:application'],
+    'asgi': ['secure_files.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def prepare(workdir, size):
+    """Create the settings module, database and a shared file; returns the download path"""
+    with open(os.path.join(workdir, 'bench_settings.py'), 'w') as f:
+        f.write(SETTINGS_TEMPLATE.format(
+            db=os.path.join(workdir, 'db.sqlite3'),
+            media=os.path.join(workdir, 'media'),
+            key=b64encode(os.urandom(32)).decode('ascii')
+        ))
+    sys.path.insert(0, workdir)
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'bench_settings'
+
+    import django
+    django.setup()
+
+    from django.core.files.storage import default_storage
+    from django.core.management import call_command
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from secure_files.apps.files.models import File, ShareLink
+    from secure_files.apps.files.utils import StreamingContentFile
+
+    call_command('migrate', verbosity=0)
+    owner = User.objects.create(username='benchmark')
+    payload = os.urandom(size)
+    file_instance = File(
+        name='payload.bin',
+        owner=owner,
+        file_size=size,
+        checksum=hashlib.sha256(payload).hexdigest()
+    )
+    ciphertext = file_instance.encrypt_file_data(payload)
+    file_instance.file = default_storage.save('uploads/payload.bin', StreamingContentFile(ciphertext, 'payload.bin'))
+    file_instance.save()
+    share_link = ShareLink.objects.create(
+        file=file_instance,
+        created_by=owner,
+        expires_at=timezone.now() + timezone.timedelta(days=1)
+    )
+    return f'/api/files/download/{share_link.token}/'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(interface, workdir, port, workers):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([workdir, BACKEND_DIR]))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *SERVERS[interface],
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--timeout', '600', '--log-level', 'warning'],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{interface} server did not start")
+
+
+async def slow_client(port, path, args):
+    """Download while reading slowly; returns (time to first byte or None, bytes received)"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    # A small receive buffer makes the server feel the slow reader
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+    sock.setblocking(False)
+    start = time.perf_counter()
+    received = 0
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, ('127.0.0.1', port)), args.timeout)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: localhost\r\nRange: bytes=1-\r\n'
+            f'Connection: close\r\n\r\n'.encode('ascii')
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), args.timeout)
+        ttfb = time.perf_counter() - start if b' 206 ' in status_line else None
+
+        end = start + args.hold
+        while ttfb is not None and time.perf_counter() < end:
+            data = await asyncio.wait_for(reader.read(args.read_kb * 1024), end - time.perf_counter())
+            if not data:
+                break
+            received += len(data)
+            await asyncio.sleep(args.interval)
+        writer.close()
+        return ttfb, received
+    except (asyncio.TimeoutError, OSError):
+        sock.close()
+        return None, received
+
+
+async def run_clients(port, path, args):
+    return await asyncio.gather(*(slow_client(port, path, args) for _ in range(args.clients)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--read-kb', type=int, default=64, help='bytes read per interval')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between reads')
+    parser.add_argument('--hold', type=float, default=10, help='seconds each client stays connected')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds to wait for the response')
+    parser.add_argument('--interfaces', nargs='+', default=['wsgi', 'asgi'], choices=sorted(SERVERS))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='transfer-bench-')
+    path = prepare(workdir, args.size_mb * 1024 * 1024)
+    print(
+        f"{args.clients} clients, {args.size_mb} MB file, {args.workers} workers, "
+        f"reading {args.read_kb} KB every {args.interval}s for {args.hold}s, {os.cpu_count()} CPUs"
+    )
+    print(f"{'server':>7} {'served':>8} {'ttfb p50':>9} {'ttfb p95':>9} {'MB moved':>9}")
+
+    for interface in args.interfaces:
+        port = free_port()
+        process = start_server(interface, workdir, port, args.workers)
+        try:
+            results = asyncio.run(run_clients(port, path, args))
+        finally:
+            process.terminate()
+            process.wait()
+
+        ttfbs = [ttfb for ttfb, _ in results if ttfb is not None]
+        moved = sum(received for _, received in results) / (1024 * 1024)
+        p50 = f'{percentile(ttfbs, 0.5):.2f}s' if ttfbs else '-'
+        p95 = f'{percentile(ttfbs, 0.95):.2f}s' if ttfbs else '-'
+        print(f"{interface:>7} {len(ttfbs):>4}/{args.clients:<3} {p50:>9} {p95:>9} {moved:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Download rate limiter overhead benchmark
+
+Times the policy throttle for a route with a policy and one without,
+spread over a number of client addresses, and compares the GCRA limiter
+with the previous list-of-timestamps implementation at increasing limits.
+Pass --redis-url to include the shared Redis backend.
+
+Usage: python benchmarks/rate_limiter.py [--requests 20000] [--clients 1000] [--limits 2 100 1000]
+       [--redis-url redis://localhost:6379/15]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes'],
+    RATE_LIMIT_POLICIES={'file.download_shared_file': {'ip': '2/min', 'share_link': '30/min'}},
+    ALLOWED_HOSTS=['*'],
+)
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+
+from secure_files import ratelimit  # noqa: E402
+from secure_files.throttling import PolicyRateThrottle  # noqa: E402
+
+
+class View:
+    basename = 'file'
+
+    def __init__(self, action, kwargs):
+        self.action = action
+        self.kwargs = kwargs
+
+
+def legacy_check_rate_limit(ip, max_requests, window=60):
+    """The list-of-timestamps limiter used before GCRA"""
+    cache_key = f'ip_rate_limit_{ip}'
+    requests = cache.get(cache_key, [])
+    current_time = time.time()
+    requests = [req_time for req_time in requests if current_time - req_time < window]
+    if len(requests) >= max_requests:
+        return False
+    requests.append(current_time)
+    cache.set(cache_key, requests, window)
+    return True
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def run_throttle(backend, view, args):
+    ratelimit._limiter = backend
+    backend.reset()
+    throttle = PolicyRateThrottle()
+    factory = RequestFactory()
+    requests = [
+        Request(factory.get('/', REMOTE_ADDR=f'10.0.{i // 256 % 256}.{i % 256}'), authenticators=[])
+        for i in range(args.clients)
+    ]
+    for request in requests:
+        request.user  # Authenticate up front, DRF does so before throttling
+    return per_call(lambda i: throttle.allow_request(requests[i % args.clients], view), args.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--limits', type=int, nargs='+', default=[2, 100, 1000])
+    parser.add_argument('--redis-url')
+    args = parser.parse_args()
+
+    backends = {'local': ratelimit.LocalRateLimitBackend()}
+    if args.redis_url:
+        settings.RATE_LIMIT_REDIS_URL = args.redis_url
+        backends['redis'] = ratelimit.RedisRateLimitBackend()
+
+    routes = (
+        ('download', View('download_shared_file', {'token': 'token'})),
+        ('other', View('list', {})),
+    )
+    print(f"{args.requests} requests from {args.clients} addresses, us per throttle check")
+    print(f"{'backend':>8} {'route':>10} {'overhead':>10}")
+    for name, backend in backends.items():
+        for label, view in routes:
+            print(f"{name:>8} {label:>10} {run_throttle(backend, view, args):>8.2f}us")
+
+    print()
+    print("Single address, limit raised so every request is allowed, us per check")
+    print(f"{'limit':>8} {'legacy':>10} {'gcra':>10}")
+    for limit in args.limits:
+        cache.clear()
+        count = min(limit, args.requests)
+        legacy = per_call(lambda i: legacy_check_rate_limit('10.0.0.1', limit), count)
+        backend = backends['local']
+        backend.reset()
+        gcra = per_call(lambda i: backend.hit('download:ip:10.0.0.1', limit, 60), count)
+        print(f"{limit:>8} {legacy:>8.2f}us {gcra:>8.2f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Keycloak role resolution benchmark
+
+Starts a stand-in Keycloak admin API that answers every call after a fixed
+latency, with a realm of users that each hold one or two of a few realm
+roles. Resolves the roles of all users one call per user, one after
+another, and then with KeycloakAdmin.get_roles_by_user, and prints the
+wall time and number of calls of each.
+
+Usage: python benchmarks/role_resolution.py [--users 2000] [--roles 4] [--latency-ms 20]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    KEYCLOAK_REALM='benchmark',
+    KEYCLOAK_ADMIN_USER='admin',
+    KEYCLOAK_ADMIN_PASSWORD='admin',
+    KEYCLOAK_HTTP_RETRIES=0,
+)
+django.setup()
+
+from secure_files.apps.core.keycloak_admin import KeycloakAdmin  # noqa: E402
+
+
+class Realm:
+    latency = 0.02
+    roles = {}
+    members = {}
+    calls = 0
+    lock = threading.Lock()
+
+
+class FakeKeycloak(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body):
+        with Realm.lock:
+            Realm.calls += 1
+        time.sleep(Realm.latency)
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply({'access_token': 'benchmark', 'expires_in': 300})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        match = re.search(r'/users/([^/]+)/role-mappings/realm$', url.path)
+        if match:
+            return self.reply([{'name': role} for role in Realm.roles[match.group(1)]])
+        match = re.search(r'/roles/([^/]+)/users$', url.path)
+        if match:
+            first, page_size = int(query['first'][0]), int(query['max'][0])
+            return self.reply(Realm.members[unquote(match.group(1))][first:first + page_size])
+        return self.reply([{'name': role} for role in Realm.members])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--roles', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    Realm.latency = args.latency_ms / 1000
+    role_names = ['user'] + [f'role-{i}' for i in range(1, args.roles)]
+    Realm.members = {role: [] for role in role_names}
+    for i in range(args.users):
+        user_id = f'{i:08x}-0000-4000-8000-000000000000'
+        Realm.roles[user_id] = ['user'] + ([role_names[1 + i % (args.roles - 1)]] if args.roles > 1 else [])
+        for role in Realm.roles[user_id]:
+            Realm.members[role].append({'id': user_id})
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeKeycloak)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.KEYCLOAK_URL = f'http://127.0.0.1:{server.server_port}'
+
+    keycloak_admin = KeycloakAdmin()
+    keycloak_admin.get_keycloak_token()
+    user_ids = list(Realm.roles)
+
+    results = []
+    for name, resolve in [
+        ('per user', lambda: {user_id: keycloak_admin.get_user_roles(user_id) for user_id in user_ids}),
+        ('by role', lambda: keycloak_admin.get_roles_by_user(user_ids)),
+    ]:
+        Realm.calls = 0
+        start = time.perf_counter()
+        resolved = resolve()
+        results.append((name, time.perf_counter() - start, Realm.calls, len(resolved)))
+    server.shutdown()
+
+    print(f"{args.users} users, {args.roles} roles, {args.latency_ms:g}ms per Keycloak call")
+    print(f"{'strategy':>10} {'seconds':>9} {'calls':>7} {'users':>7}")
+    for name, elapsed, calls, users in results:
+        print(f"{name:>10} {elapsed:>9.2f} {calls:>7} {users:>7}")
+
+
+if __name__ == '__main__':
+    main()
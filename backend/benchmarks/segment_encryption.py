@@ -0,0 +1,73 @@
+"""
+Segment encryption scaling benchmark
+
+Encrypts and decrypts an in-memory payload with the segmented AES-256-GCM
+format at increasing degrees of parallelism and prints throughput and
+speed-up relative to a single worker.
+
+Usage: python benchmarks/segment_encryption.py [--size-mb 1024] [--workers 1 2 4 8 16]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from secure_files.apps.core.encryption import (  # noqa: E402
+    SegmentedFileEncryption, SegmentEngine, DEFAULT_SEGMENT_SIZE,
+)
+
+
+def feed(data, chunk_size=DEFAULT_SEGMENT_SIZE):
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+def drain(stream):
+    total = 0
+    for chunk in stream:
+        total += len(chunk)
+    return total
+
+
+def run(data, workers, segment_size):
+    engine = SegmentEngine(workers=workers)
+    cipher = SegmentedFileEncryption(segment_size=segment_size)
+
+    start = time.perf_counter()
+    ciphertext = b''.join(cipher.encrypt_stream(feed(data), engine=engine))
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    drain(SegmentedFileEncryption.decrypt_stream(cipher.key, feed(ciphertext), engine=engine))
+    decrypt_time = time.perf_counter() - start
+    return encrypt_time, decrypt_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--segment-kb', type=int, default=DEFAULT_SEGMENT_SIZE // 1024)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    data = os.urandom(size)
+    print(f"payload {args.size_mb} MB, segment {args.segment_kb} KB, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'enc MB/s':>10} {'dec MB/s':>10} {'enc x':>7} {'dec x':>7}")
+
+    baseline = None
+    for workers in args.workers:
+        encrypt_time, decrypt_time = run(data, workers, args.segment_kb * 1024)
+        if baseline is None:
+            baseline = (encrypt_time, decrypt_time)
+        print(
+            f"{workers:>8} {args.size_mb / encrypt_time:>10.0f} {args.size_mb / decrypt_time:>10.0f}"
+            f" {baseline[0] / encrypt_time:>7.2f} {baseline[1] / decrypt_time:>7.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Bearer token authentication latency benchmark
+
+Authenticates the same RS256 token repeatedly with KeycloakAuthentication
+against an in-memory database, with the verified-token cache cleared before
+every call and with it warm, and prints the latency of each path next to
+the cost of the signature check alone.
+
+Usage: python benchmarks/token_auth.py [--requests 2000] [--key-size 2048]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'secure_files.apps.files', 'secure_files.apps.core'],
+    ALLOWED_HOSTS=['*'],
+)
+django.setup()
+
+import jwt  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from secure_files.authentication import KeycloakAuthentication, token_cache  # noqa: E402
+from secure_files.jwks import jwks_store  # noqa: E402
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--key-size', type=int, default=2048)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=args.key_size)
+    public_key = private_key.public_key()
+    jwks_store._download = lambda: {'bench': public_key}
+
+    token = jwt.encode(
+        {
+            'sub': 'benchmark-subject',
+            'preferred_username': 'benchmark',
+            'exp': int(time.time()) + 3600,
+            'realm_access': {'roles': ['user']},
+        },
+        private_key,
+        algorithm='RS256',
+        headers={'kid': 'bench'}
+    )
+    request = Request(APIRequestFactory().get('/api/files/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+    authentication = KeycloakAuthentication()
+    authentication.authenticate(request)
+
+    def uncached():
+        token_cache.clear()
+        authentication.authenticate(request)
+
+    verify = per_call(lambda: jwt.decode(token, public_key, algorithms=['RS256']), args.requests)
+    cold = per_call(uncached, args.requests)
+    token_cache.clear()
+    token_cache.hits = token_cache.misses = 0
+    warm = per_call(lambda: authentication.authenticate(request), args.requests)
+
+    print(f"{args.requests} requests, RSA-{args.key_size}, us per request")
+    print(f"{'signature check':>18} {verify:>8.1f}us")
+    print(f"{'uncached':>18} {cold:>8.1f}us")
+    print(f"{'cached':>18} {warm:>8.1f}us  ({cold / warm:.0f}x)")
+    print(f"hit rate {token_cache.stats()['hit_rate']:.2%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import logging
+
+from .models import DirectoryUser
+from .keycloak_admin import KeycloakAdmin, KeycloakUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def get_user_by_email(email, keycloak_admin=None):
+    """
+    Keycloak representation of the user with this email, or None
+    Answered from the local directory while its row is within the staleness
+    bound; otherwise Keycloak is asked and the row is refreshed.
+    """
+    entry = DirectoryUser.lookup_email(email)
+    if entry is not None:
+        return entry.as_keycloak()
+
+    user = (keycloak_admin or KeycloakAdmin()).get_user_by_email(email)
+    if user is not None:
+        DirectoryUser.record(user)
+    return user
+
+
+def sync_directory(keycloak_admin=None):
+    """Mirror every Keycloak user and their realm roles locally; returns (created, updated, deleted)"""
+    keycloak_admin = keycloak_admin or KeycloakAdmin()
+    users = list(keycloak_admin.iter_users())
+    roles_by_user = keycloak_admin.get_roles_by_user(user['id'] for user in users)
+    if keycloak_admin.degraded:
+        # Cached role data must not be recorded as a fresh sync
+        raise KeycloakUnavailable("Keycloak became unavailable during the directory sync")
+    created, updated, deleted = DirectoryUser.sync(users, roles_by_user)
+    logger.info(f"Directory synced: {created} created, {updated} updated, {deleted} deleted")
+    return created, updated, deleted
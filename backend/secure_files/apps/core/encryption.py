@@ -1,4 +1,10 @@
 import os
+import struct
+import itertools
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from base64 import b64encode, b64decode
 
@@ -11,7 +17,7 @@ class FileEncryption:
         self.key = key if key else os.urandom(32)  # 256-bit key
         self.iv = iv if iv else os.urandom(16)   # 128-bit IV for AES
 
-    def encrypt(self, data):
+    def encrypt(self, data, associated_data=None):
         """
         Encrypt data using AES-256-GCM
         Returns: (encrypted_data, key, iv)
@@ -24,6 +30,8 @@ class FileEncryption:
                 backend=default_backend()
             )
             encryptor = cipher.encryptor()
+            if associated_data:
+                encryptor.authenticate_additional_data(associated_data)
 
             # Encrypt data
             encrypted_data = encryptor.update(data) + encryptor.finalize()
@@ -38,7 +46,7 @@ class FileEncryption:
         except Exception as e:
             raise EncryptionError(f"Encryption failed: {str(e)}")
 
-    def decrypt(self, encrypted_data, tag):
+    def decrypt(self, encrypted_data, tag, associated_data=None):
         """
         Decrypt data using AES-256-GCM
         """
@@ -50,6 +58,8 @@ class FileEncryption:
                 backend=default_backend()
             )
             decryptor = cipher.decryptor()
+            if associated_data:
+                decryptor.authenticate_additional_data(associated_data)
 
             # Decrypt data
             return decryptor.update(encrypted_data) + decryptor.finalize()
@@ -66,6 +76,314 @@ class FileEncryption:
         """Decode key from base64"""
         return b64decode(encoded_key.encode('utf-8'))
 
+
+# Segmented on-disk format
+#
+#   header  = magic (4) | version (1) | segment size (4, big endian) | nonce prefix (7)
+#   segment = AES-256-GCM ciphertext | tag (16)
+#
+# Every segment holds ``segment_size`` bytes of plaintext except the last one,
+# which may be shorter (or empty). Segment nonces are built from the random
+# nonce prefix, the segment index and a final-segment flag, and the header is
+# authenticated with every segment, so segments cannot be reordered, dropped
+# or truncated without decryption failing.
+SEGMENT_MAGIC = b'SFEG'
+SEGMENT_FORMAT_VERSION = 1
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+MIN_SEGMENT_SIZE = 16 * 1024
+MAX_SEGMENT_SIZE = 1024 * 1024
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+HEADER = struct.Struct('>4sBI7s')
+HEADER_SIZE = HEADER.size
+
+
+class SegmentedFileEncryption:
+    """Streaming AES-256-GCM encryption over fixed-size segments"""
+
+    def __init__(self, key=None, segment_size=None, nonce_prefix=None):
+        self.key = key if key else os.urandom(32)  # 256-bit key
+        self.segment_size = segment_size or DEFAULT_SEGMENT_SIZE
+        self.nonce_prefix = nonce_prefix if nonce_prefix else os.urandom(NONCE_PREFIX_SIZE)
+
+        if not MIN_SEGMENT_SIZE <= self.segment_size <= MAX_SEGMENT_SIZE:
+            raise EncryptionError(f"Invalid segment size: {self.segment_size}")
+        if len(self.nonce_prefix) != NONCE_PREFIX_SIZE:
+            raise EncryptionError("Invalid nonce prefix")
+
+        self.header = HEADER.pack(
+            SEGMENT_MAGIC, SEGMENT_FORMAT_VERSION, self.segment_size, self.nonce_prefix
+        )
+
+    @classmethod
+    def from_header(cls, key, header):
+        """Build a cipher for an existing blob from its header bytes"""
+        if len(header) < HEADER_SIZE:
+            raise EncryptionError("Truncated header")
+        magic, version, segment_size, nonce_prefix = HEADER.unpack(header[:HEADER_SIZE])
+        if magic != SEGMENT_MAGIC:
+            raise EncryptionError("Not a segmented encrypted file")
+        if version != SEGMENT_FORMAT_VERSION:
+            raise EncryptionError(f"Unsupported format version: {version}")
+        return cls(key=key, segment_size=segment_size, nonce_prefix=nonce_prefix)
+
+    @staticmethod
+    def is_segmented(data):
+        """Check whether the leading bytes of a blob carry the segmented format magic"""
+        return bytes(data[:len(SEGMENT_MAGIC)]) == SEGMENT_MAGIC
+
+    @property
+    def encrypted_segment_size(self):
+        return self.segment_size + TAG_SIZE
+
+    def segment_nonce(self, index, final):
+        """12-byte GCM nonce: prefix | segment index | final flag"""
+        return self.nonce_prefix + struct.pack('>I?', index, final)
+
+    def encrypt_segment(self, index, data, final=False):
+        """Encrypt a single segment, returning ciphertext followed by the tag"""
+        result = FileEncryption(self.key, self.segment_nonce(index, final)).encrypt(
+            bytes(data), associated_data=self.header
+        )
+        return result['encrypted_data'] + result['tag']
+
+    def decrypt_segment(self, index, data, final=False):
+        """Decrypt and authenticate a single segment"""
+        if len(data) < TAG_SIZE:
+            raise EncryptionError("Truncated segment")
+        data = bytes(data)
+        return FileEncryption(self.key, self.segment_nonce(index, final)).decrypt(
+            data[:-TAG_SIZE], data[-TAG_SIZE:], associated_data=self.header
+        )
+
+    def encrypt_stream(self, chunks, engine=None):
+        """
+        Encrypt an iterable of plaintext chunks
+        Yields the header followed by one encrypted segment at a time
+        """
+        engine = engine or SegmentEngine()
+        yield self.header
+        yield from engine.map(
+            self.encrypt_segment, split_segments(chunks, self.segment_size)
+        )
+
+    def encrypt_run(self, data, first_index, final=False, engine=None):
+        """
+        Encrypt a run of consecutive segments starting at segment first_index
+        Lets independently received pieces of a file be encrypted out of order;
+        ``data`` must be a whole number of segments unless it ends the file.
+        """
+        engine = engine or SegmentEngine()
+        view = memoryview(data)
+        count = max(1, -(-len(view) // self.segment_size))
+
+        def segments():
+            for offset in range(count):
+                start = offset * self.segment_size
+                yield (
+                    first_index + offset,
+                    bytes(view[start:start + self.segment_size]),
+                    final and offset == count - 1
+                )
+
+        return b''.join(engine.map(self.encrypt_segment, segments()))
+
+    def encryptor(self):
+        """Push-style encryptor for callers that receive plaintext incrementally"""
+        return SegmentEncryptor(self)
+
+    @classmethod
+    def decrypt_stream(cls, key, chunks, engine=None):
+        """
+        Decrypt an iterable of ciphertext chunks, header included
+        Yields plaintext one segment at a time
+        """
+        engine = engine or SegmentEngine()
+        header, chunks = read_header(chunks)
+        cipher = cls.from_header(key, header)
+        yield from engine.map(
+            cipher.decrypt_segment,
+            split_segments(chunks, cipher.encrypted_segment_size)
+        )
+
+    @classmethod
+    def decrypt_range(cls, key, fileobj, ciphertext_size, start, end, engine=None):
+        """
+        Decrypt plaintext bytes start..end (inclusive) from a seekable blob
+        Segment offsets follow from the header, so only the segments covering
+        the range are read and authenticated
+        """
+        engine = engine or SegmentEngine()
+        fileobj.seek(0)
+        cipher = cls.from_header(key, fileobj.read(HEADER_SIZE))
+        segment_count = cipher.segment_count(ciphertext_size)
+        first = start // cipher.segment_size
+        last = min(end // cipher.segment_size, segment_count - 1)
+
+        def segments():
+            fileobj.seek(HEADER_SIZE + first * cipher.encrypted_segment_size)
+            for index in range(first, last + 1):
+                yield index, fileobj.read(cipher.encrypted_segment_size), index == segment_count - 1
+
+        offset = first * cipher.segment_size
+        for plaintext in engine.map(cipher.decrypt_segment, segments()):
+            lower = max(start - offset, 0)
+            upper = min(end + 1 - offset, len(plaintext))
+            if lower < upper:
+                yield plaintext[lower:upper]
+            offset += cipher.segment_size
+
+    def segment_count(self, ciphertext_size):
+        """Number of segments in a stored blob of the given size"""
+        return max(1, -(-(ciphertext_size - HEADER_SIZE) // self.encrypted_segment_size))
+
+    def ciphertext_size(self, plaintext_size):
+        """Size of the stored blob for a plaintext of the given size"""
+        segments = max(1, -(-plaintext_size // self.segment_size))
+        return HEADER_SIZE + plaintext_size + segments * TAG_SIZE
+
+
+class SegmentEncryptor:
+    """
+    Incremental counterpart of SegmentedFileEncryption.encrypt_stream
+    update() returns ciphertext for every segment completed so far and
+    finalize() returns the final segment.
+    """
+
+    def __init__(self, cipher):
+        self.cipher = cipher
+        self.buffer = bytearray()
+        self.index = 0
+        self.started = False
+
+    def update(self, data):
+        output = []
+        if not self.started:
+            output.append(self.cipher.header)
+            self.started = True
+
+        self.buffer += data
+        segment_size = self.cipher.segment_size
+        # Keep at least one byte back so the final segment is known
+        while len(self.buffer) > segment_size:
+            output.append(self.cipher.encrypt_segment(self.index, self.buffer[:segment_size]))
+            del self.buffer[:segment_size]
+            self.index += 1
+        return b''.join(output)
+
+    def finalize(self):
+        output = b'' if self.started else self.cipher.header
+        self.started = True
+        output += self.cipher.encrypt_segment(self.index, self.buffer, final=True)
+        self.buffer = bytearray()
+        return output
+
+
+def read_header(chunks):
+    """Split the format header off a chunk stream, returning (header, remaining chunks)"""
+    chunks = iter(chunks)
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= HEADER_SIZE:
+            break
+    if len(buffer) < HEADER_SIZE:
+        raise EncryptionError("Truncated header")
+    return bytes(buffer[:HEADER_SIZE]), itertools.chain([bytes(buffer[HEADER_SIZE:])], chunks)
+
+
+def split_segments(chunks, segment_size):
+    """
+    Re-cut a chunk stream into fixed-size segments
+    Yields (index, data, final); the last segment may be short or empty
+    """
+    buffer = bytearray()
+    index = 0
+    for chunk in chunks:
+        buffer += chunk
+        # Keep at least one byte back so the final segment is known
+        while len(buffer) > segment_size:
+            yield index, bytes(buffer[:segment_size]), False
+            del buffer[:segment_size]
+            index += 1
+    yield index, bytes(buffer), True
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit(max_workers, func, *args):
+    """
+    Run func on the process-wide thread pool shared by all segment engines
+    The pool is replaced by a larger one when an engine asks for more
+    workers. Getting the pool and submitting happen under one lock, so
+    nothing lands on a pool that has been shut down; batches already queued
+    there still run and its threads exit once they are done.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor._max_workers < max_workers:
+            previous = _executor
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix='segment-crypto'
+            )
+            if previous is not None:
+                previous.shutdown(wait=False)
+        return _executor.submit(func, *args)
+
+
+class SegmentEngine:
+    """
+    Runs segment encryption/decryption on a bounded thread pool
+    OpenSSL releases the GIL while it works, so independent GCM segments scale
+    across cores. Segments are grouped into batches of roughly ``batch_size``
+    bytes per task, at most ``workers`` batches are in flight at once, and
+    results are yielded strictly in segment order.
+    """
+
+    def __init__(self, workers=1, batch_size=1024 * 1024):
+        self.workers = max(1, workers or 1)
+        self.batch_size = batch_size
+
+    def map(self, func, segments):
+        """Apply func(index, data, final) to each segment, yielding results in order"""
+        if self.workers == 1:
+            for segment in segments:
+                yield func(*segment)
+            return
+
+        in_flight = deque()
+        for batch in self._batches(segments):
+            if not in_flight and batch[-1][2]:
+                # Whole file fits in one batch, no point handing it off
+                yield from self._run_batch(func, batch)
+                return
+
+            in_flight.append(submit(self.workers, self._run_batch, func, batch))
+            if len(in_flight) >= self.workers:
+                yield from in_flight.popleft().result()
+
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+    def _batches(self, segments):
+        batch = []
+        size = 0
+        for segment in segments:
+            batch.append(segment)
+            size += len(segment[1])
+            if size >= self.batch_size or segment[2]:
+                yield batch
+                batch = []
+                size = 0
+
+    @staticmethod
+    def _run_batch(func, batch):
+        return [func(*segment) for segment in batch]
+
+
 class EncryptionError(Exception):
     """Custom exception for encryption/decryption errors"""
     pass
\ No newline at end of file
@@ -0,0 +1,146 @@
+import os
+import base64
+import logging
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from secure_files.cache import TTLCache
+
+from .encryption import FileEncryption, EncryptionError
+
+logger = logging.getLogger(__name__)
+
+WRAP_VERSION = 1
+WRAP_NONCE_SIZE = 12
+WRAP_TAG_SIZE = 16
+
+
+class KeyProviderError(Exception):
+    """Raised when a data key cannot be wrapped or unwrapped"""
+    pass
+
+
+class KeyProvider:
+    """
+    Interface for key-encryption-key services
+    Providers wrap per-file data keys so only wrapped keys are stored in the
+    database. ``context`` identifies the key owner and is bound to the
+    wrapped key, so a wrapped key cannot be moved to another owner's file.
+    """
+    name = None
+
+    def wrap_key(self, data_key, context):
+        raise NotImplementedError
+
+    def unwrap_key(self, wrapped_key, context):
+        raise NotImplementedError
+
+
+class LocalKeyProvider(KeyProvider):
+    """
+    File-backed key provider for development and tests
+    The master key comes from FILE_MASTER_KEY (base64) or is read from
+    FILE_MASTER_KEY_PATH, which is created on first use. With
+    FILE_KEY_PER_USER enabled every owner gets a KEK derived from the
+    master key with HKDF.
+    """
+    name = 'local'
+
+    def __init__(self):
+        self.per_user = getattr(settings, 'FILE_KEY_PER_USER', True)
+        self._master_key = None
+        self._lock = threading.Lock()
+
+    @property
+    def master_key(self):
+        if self._master_key is None:
+            with self._lock:
+                if self._master_key is None:
+                    self._master_key = self._load_master_key()
+        return self._master_key
+
+    def _load_master_key(self):
+        encoded = getattr(settings, 'FILE_MASTER_KEY', None)
+        if encoded:
+            return base64.b64decode(encoded)
+
+        path = getattr(settings, 'FILE_MASTER_KEY_PATH')
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(os.urandom(32))
+                logger.warning(f"Generated new master key at {path}")
+
+        with open(path, 'rb') as f:
+            key = f.read()
+        if len(key) != 32:
+            raise KeyProviderError(f"Master key at {path} must be 32 bytes")
+        return key
+
+    def _kek(self, context):
+        if not self.per_user:
+            return self.master_key
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'secure-files-kek:' + context.encode('utf-8')
+        ).derive(self.master_key)
+
+    def wrap_key(self, data_key, context):
+        nonce = os.urandom(WRAP_NONCE_SIZE)
+        try:
+            result = FileEncryption(self._kek(context), nonce).encrypt(
+                data_key, associated_data=context.encode('utf-8')
+            )
+        except EncryptionError as e:
+            raise KeyProviderError(f"Failed to wrap key: {str(e)}")
+        return bytes([WRAP_VERSION]) + nonce + result['encrypted_data'] + result['tag']
+
+    def unwrap_key(self, wrapped_key, context):
+        wrapped_key = bytes(wrapped_key)
+        if len(wrapped_key) < 1 + WRAP_NONCE_SIZE + WRAP_TAG_SIZE or wrapped_key[0] != WRAP_VERSION:
+            raise KeyProviderError("Unsupported wrapped key format")
+        nonce = wrapped_key[1:1 + WRAP_NONCE_SIZE]
+        try:
+            return FileEncryption(self._kek(context), nonce).decrypt(
+                wrapped_key[1 + WRAP_NONCE_SIZE:-WRAP_TAG_SIZE],
+                wrapped_key[-WRAP_TAG_SIZE:],
+                associated_data=context.encode('utf-8')
+            )
+        except EncryptionError as e:
+            raise KeyProviderError(f"Failed to unwrap key: {str(e)}")
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+# Unwrapped data keys, so repeated downloads skip the key provider
+data_key_cache = TTLCache(
+    max_size=getattr(settings, 'FILE_KEY_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'FILE_KEY_CACHE_TTL', 300)
+)
+
+
+def get_key_provider():
+    """Return the process-wide key provider configured by FILE_KEY_PROVIDER"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                provider_class = import_string(getattr(
+                    settings, 'FILE_KEY_PROVIDER',
+                    'secure_files.apps.core.key_management.LocalKeyProvider'
+                ))
+                _provider = provider_class()
+    return _provider
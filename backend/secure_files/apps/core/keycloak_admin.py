@@ -1,8 +1,15 @@
+import math
 import requests
 import logging
 
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
+
+from .keycloak_client import get_keycloak_client, is_unavailable
 
 from datetime import timedelta
 
@@ -10,12 +17,19 @@ class KeycloakError(Exception):
     """Base exception for Keycloak operations"""
     pass
 
+class KeycloakUnavailable(KeycloakError):
+    """Keycloak is down or failing and no cached copy of the data is available"""
+    pass
+
 logger = logging.getLogger(__name__)
 
 class KeycloakAdmin:
     def __init__(self):
         self.base_url = f"{settings.KEYCLOAK_URL}/admin/realms/{settings.KEYCLOAK_REALM}"
+        self.http = get_keycloak_client()
         self.token = cache.get('keycloak_admin_token', None)
+        # Set once a lookup has been answered from the cache because Keycloak was unavailable
+        self.degraded = False
 
     def get_keycloak_token(self) :
         """Get admin token from Keycloak for server-side operations"""
@@ -28,7 +42,7 @@ class KeycloakAdmin:
         try:
             # Use the /auth endpoint with admin credentials
             token_url = f"{settings.KEYCLOAK_URL}/realms/master/protocol/openid-connect/token"
-            response = requests.post(
+            response = self.http.post(
                 token_url,
                 data={
                     'username': settings.KEYCLOAK_ADMIN_USER,  # Using admin user from settings
@@ -38,8 +52,7 @@ class KeycloakAdmin:
                 },
                 headers={
                     'Content-Type': 'application/x-www-form-urlencoded'
-                },
-                verify=False  # Disable SSL verification
+                }
             )
 
             if response.status_code != 200:
@@ -61,11 +74,38 @@ class KeycloakAdmin:
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Error getting Keycloak admin token: {str(e)}")
+            if is_unavailable(e):
+                raise KeycloakUnavailable("Failed to obtain admin token") from e
             raise KeycloakError("Failed to obtain admin token") from e
+        except KeycloakError:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error getting admin token: {str(e)}")
             raise KeycloakError("Unexpected error obtaining admin token") from e
     
+    def _directory(self, cache_key, fetch):
+        """
+        Return ``fetch()`` and keep a copy of it for when Keycloak is down
+        If Keycloak cannot be reached, fails with a 5xx or the circuit breaker
+        is open, the last copy is returned instead and ``degraded`` is set so
+        the caller can mark its response as stale.
+        """
+        cache_key = f'keycloak_directory:{cache_key}'
+        try:
+            result = fetch()
+        except (requests.exceptions.RequestException, KeycloakUnavailable) as e:
+            if not isinstance(e, KeycloakUnavailable) and not is_unavailable(e):
+                raise
+            cached = cache.get(cache_key)
+            if cached is None:
+                raise KeycloakUnavailable("Keycloak is unavailable and nothing is cached") from e
+            logger.warning(f"Keycloak unavailable, serving cached {cache_key}: {str(e)}")
+            self.degraded = True
+            return cached
+
+        cache.set(cache_key, result, getattr(settings, 'KEYCLOAK_DIRECTORY_CACHE_TTL', 3600))
+        return result
+
     def _get_headers(self):
         token = self.get_keycloak_token()
         return {
@@ -97,11 +137,10 @@ class KeycloakAdmin:
             }
 
             # Create user
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/users",
                 headers=headers,
-                json=user_payload,
-                verify=False  # Disable SSL verification
+                json=user_payload
             )
             response.raise_for_status()
 
@@ -109,10 +148,9 @@ class KeycloakAdmin:
             user_id = response.headers['Location'].split('/')[-1]
 
             # Get role ID
-            role_response = requests.get(
+            role_response = self.http.get(
                 f"{self.base_url}/roles/{role}",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=headers
             )
             role_response.raise_for_status()
             role_data = role_response.json()
@@ -122,11 +160,10 @@ class KeycloakAdmin:
                 'id': role_data['id'],
                 'name': role
             }]
-            requests.post(
+            self.http.post(
                 f"{self.base_url}/users/{user_id}/role-mappings/realm",
                 headers=headers,
-                json=role_assignment,
-                verify=False  # Disable SSL verification
+                json=role_assignment
             )
 
             return user_id
@@ -144,10 +181,9 @@ class KeycloakAdmin:
                 'Content-Type': 'application/json'
             }
 
-            response = requests.delete(
+            response = self.http.delete(
                 f"{self.base_url}/users/{user_id}",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=headers
             )
             response.raise_for_status()
             return True
@@ -165,10 +201,9 @@ class KeycloakAdmin:
                 'Content-Type': 'application/json'
             }
 
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/users?username={username}&exact=true",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=headers
             )
             response.raise_for_status()
             users = response.json()
@@ -179,38 +214,88 @@ class KeycloakAdmin:
             logger.error(f"Keycloak user lookup error: {str(e)}")
             raise KeycloakError("Failed to lookup user in Keycloak")
         
-    def get_all_users(self):
-        """Get all users from Keycloak"""
+    @staticmethod
+    def prefix_search(search):
+        """
+        Keycloak search term matching users by prefix, like DirectoryUser.search
+        Keycloak reads ``*`` and quotes as wildcards and exact matches, so
+        they are dropped from the input and the prefix is made explicit.
+        """
+        term = (search or '').replace('*', '').replace('"', '').strip()
+        return f'{term}*' if term else None
+
+    def _fetch_users_page(self, first, max_results, search=None, brief=False):
+        params = {'first': first, 'max': max_results}
+        search = self.prefix_search(search)
+        if search:
+            params['search'] = search
+        if brief:
+            params['briefRepresentation'] = 'true'
         try:
-            token = self.get_keycloak_token()
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json'
-            }
-
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/users",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=self._get_headers(),
+                params=params
             )
             response.raise_for_status()
             return response.json()
-        
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Keycloak user listing error: {str(e)}")
+            if is_unavailable(e):
+                raise KeycloakUnavailable("Failed to list users in Keycloak") from e
+            raise KeycloakError("Failed to list users in Keycloak") from e
+
+    def get_users_page(self, first=0, max_results=50, search=None):
+        """One page of users, optionally only those whose username, email or name starts with ``search``"""
+        return self._directory(
+            f'users-page:{first}:{max_results}:{search or ""}',
+            lambda: self._fetch_users_page(first, max_results, search)
+        )
+
+    def iter_users(self, search=None, page_size=None, brief=False):
+        """
+        Yield every user, reading the directory page by page
+        The next page is requested while the current one is being consumed,
+        so at most two pages are held in memory at a time.
+        """
+        page_size = page_size or getattr(settings, 'KEYCLOAK_PAGE_SIZE', 500)
+        self.get_keycloak_token()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='keycloak-users') as executor:
+            first = 0
+            pending = executor.submit(self._fetch_users_page, first, page_size, search, brief)
+            while pending is not None:
+                page = pending.result()
+                first += len(page)
+                pending = None
+                if len(page) == page_size:
+                    pending = executor.submit(self._fetch_users_page, first, page_size, search, brief)
+                yield from page
+
+    def get_all_users(self):
+        """Get all users from Keycloak"""
+        try:
+            return self._directory('users', lambda: list(self.iter_users()))
         except requests.exceptions.RequestException as e:
             logger.error(f"Keycloak user lookup error: {str(e)}")
             raise KeycloakError("Failed to lookup user in Keycloak")
         
-    def get_users_count(self):
-        """Get total number of users"""
-        try:
-            headers = self._get_headers()
-            response = requests.get(
+    def get_users_count(self, search=None):
+        """Get total number of users, optionally only those whose username, email or name starts with ``search``"""
+        term = self.prefix_search(search)
+
+        def fetch():
+            response = self.http.get(
                 f"{self.base_url}/users/count",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=self._get_headers(),
+                params={'search': term} if term else None
             )
             response.raise_for_status()
             return response.json()
+
+        try:
+            return self._directory(f'users-count:{search or ""}', fetch)
+        except KeycloakUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting user count: {str(e)}")
             raise KeycloakError("Failed to get user count")
@@ -218,78 +303,161 @@ class KeycloakAdmin:
     def get_active_users_count(self):
         """Get count of active users in last 30 days"""
         try:
-            all_users = self.get_all_users(brief=True)
             thirty_days_ago = int((timezone.now() - timedelta(days=30)).timestamp() * 1000)
-            
-            active_users = [
-                user for user in all_users
+            return sum(
+                1 for user in self.iter_users(brief=True)
                 if user.get('lastLogin', 0) > thirty_days_ago
-            ]
-            
-            return len(active_users)
+            )
         except Exception as e:
             logger.error(f"Error getting active users count: {str(e)}")
             raise KeycloakError("Failed to get active users count")
 
     def get_user_by_id(self, user_id):
         """Get user details by ID"""
-        try:
-            headers = self._get_headers()
-            response = requests.get(
+        def fetch():
+            response = self.http.get(
                 f"{self.base_url}/users/{user_id}",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=self._get_headers()
             )
             response.raise_for_status()
             return response.json()
+
+        try:
+            return self._directory(f'user:{user_id}', fetch)
+        except KeycloakUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting user by ID: {str(e)}")
             raise KeycloakError(f"Failed to get user with ID {user_id}")
 
     def get_user_by_email(self, email):
         """Get user by email"""
-        try:
-            headers = self._get_headers()
-            params = {'email': email, 'exact': 'true'}
-            
-            response = requests.get(
+        def fetch():
+            response = self.http.get(
                 f"{self.base_url}/users",
-                headers=headers,
-                params=params,
-                verify=False  # Disable SSL verification
+                headers=self._get_headers(),
+                params={'email': email, 'exact': 'true'}
             )
             response.raise_for_status()
-            users = response.json()
+            return response.json()
+
+        try:
+            users = self._directory(f'user-email:{email.lower()}', fetch)
             return users[0] if users else None
+        except KeycloakUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting user by email: {str(e)}")
             raise KeycloakError(f"Failed to get user with email {email}")
 
 
     def get_user_roles(self, user_id):
-        """Get roles assigned to a user"""
-        try:
-            headers = self._get_headers()
-            response = requests.get(
+        """Get realm roles assigned to a user"""
+        def fetch():
+            response = self.http.get(
                 f"{self.base_url}/users/{user_id}/role-mappings/realm",
-                headers=headers,
-                verify=False  # Disable SSL verification
+                headers=self._get_headers()
             )
             response.raise_for_status()
-            return response
+            return response.json()
+
+        try:
+            return self._directory(f'user-roles:{user_id}', fetch)
+        except KeycloakUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting user roles: {str(e)}")
             raise KeycloakError("Failed to get user roles")
-        
+
+    def _fetch_all(self, fetch, items):
+        """Return ``fetch(item)`` for every item, in order, on at most KEYCLOAK_FETCH_CONCURRENCY threads"""
+        items = list(items)
+        workers = min(getattr(settings, 'KEYCLOAK_FETCH_CONCURRENCY', 8), len(items))
+        if workers <= 1:
+            return [fetch(item) for item in items]
+        # Obtain the admin token once here rather than once per thread on a cold cache
+        self.get_keycloak_token()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='keycloak-fetch') as executor:
+            return list(executor.map(fetch, items))
+
+    def get_realm_roles(self):
+        """Names of all realm roles"""
+        def fetch():
+            response = self.http.get(
+                f"{self.base_url}/roles",
+                headers=self._get_headers(),
+                params={'briefRepresentation': 'true'}
+            )
+            response.raise_for_status()
+            return [role['name'] for role in response.json()]
+
+        return self._directory('realm-roles', fetch)
+
+    def get_role_member_ids(self, role):
+        """IDs of the users a realm role is assigned to, read page by page"""
+        page_size = getattr(settings, 'KEYCLOAK_PAGE_SIZE', 500)
+        member_ids = []
+        first = 0
+        while True:
+            response = self.http.get(
+                f"{self.base_url}/roles/{quote(role, safe='')}/users",
+                headers=self._get_headers(),
+                params={'first': first, 'max': page_size, 'briefRepresentation': 'true'}
+            )
+            response.raise_for_status()
+            page = response.json()
+            member_ids.extend(user['id'] for user in page)
+            if len(page) < page_size:
+                return member_ids
+            first += page_size
+
+    def get_roles_by_user(self, user_ids):
+        """
+        Realm role names of each of ``user_ids``, as {user_id: [role, ...]}
+        Whichever needs fewer calls is used: one call per user, or one paged
+        call per realm role listing its members, merged here. Either way the
+        calls run concurrently.
+        """
+        user_ids = list(user_ids)
+        try:
+            roles = self.get_realm_roles()
+            # Any role may be held by the whole realm, so listing members costs
+            # up to one call per page of users for each role
+            page_size = getattr(settings, 'KEYCLOAK_PAGE_SIZE', 500)
+            per_role_calls = len(roles)
+            if len(user_ids) > per_role_calls:
+                per_role_calls *= max(math.ceil(self.get_users_count() / page_size), 1)
+            if len(user_ids) <= per_role_calls:
+                mappings = self._fetch_all(self.get_user_roles, user_ids)
+                return {
+                    user_id: [role['name'] for role in mapping]
+                    for user_id, mapping in zip(user_ids, mappings)
+                }
+
+            def fetch():
+                members = {}
+                for role, member_ids in zip(roles, self._fetch_all(self.get_role_member_ids, roles)):
+                    for member_id in member_ids:
+                        members.setdefault(member_id, []).append(role)
+                return members
+
+            members = self._directory('role-members', fetch)
+            return {user_id: members.get(user_id, []) for user_id in user_ids}
+
+        except KeycloakError:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting user roles: {str(e)}")
+            raise KeycloakError("Failed to get user roles")
+
     def update_user_status(self, user_id, enabled):
         """Update user status"""
         try:
             headers = self._get_headers()
-            response = requests.put(
+            response = self.http.put(
                 f"{self.base_url}/users/{user_id}",
                 headers=headers,
-                json={'enabled': enabled},
-                verify=False  # Disable SSL verification
+                json={'enabled': enabled}
             )
             response.raise_for_status()
             return True
@@ -0,0 +1,231 @@
+import re
+import time
+import random
+import logging
+import threading
+
+from urllib.parse import urlsplit
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+ID_SEGMENT = re.compile(r'/[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}(?=/|$)')
+
+
+class CallMetrics:
+    """Call counts and latencies per Keycloak endpoint"""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, elapsed, error=False, retry=False):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+            })
+            entry['calls'] += 1
+            entry['errors'] += int(error)
+            entry['retries'] += int(retry)
+            entry['total_ms'] += elapsed * 1000
+            entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: dict(entry, avg_ms=entry['total_ms'] / entry['calls'])
+                for endpoint, entry in sorted(self._endpoints.items())
+            }
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling Keycloak while the circuit breaker is open"""
+    pass
+
+
+def is_unavailable(error):
+    """Whether a requests error means Keycloak is down or overloaded, rather than refusing the call"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that keeps failing
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail at once for ``reset_timeout`` seconds. Then a single probe is
+    let through (half-open): success closes the circuit, failure opens it
+    again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0)
+        raise CircuitOpenError(f"Keycloak circuit is open, retrying in {retry_in:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                if self.state == self.CLOSED:
+                    logger.error(f"Keycloak circuit opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.trips += 1
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+class KeycloakClient:
+    """
+    Shared HTTP client for Keycloak
+    One requests.Session per process keeps connections alive in a bounded
+    pool, so consecutive calls reuse an open TCP/TLS connection. Every call
+    has connect and read timeouts. Idempotent calls are retried on
+    connection errors, timeouts and 502/503/504 with jittered exponential
+    backoff; POSTs are never retried. Failed attempts, whatever the error,
+    feed a circuit breaker, which makes calls fail fast while Keycloak is unhealthy.
+    """
+
+    def __init__(self, connect_timeout=3, read_timeout=10, retries=2, backoff=0.2, pool_size=20, breaker=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = CallMetrics()
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.verify = False  # Keycloak runs with a self-signed certificate
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def endpoint(method, url):
+        """Metric label for a call, with IDs collapsed so each endpoint is counted once"""
+        path = urlsplit(url).path
+        path = re.sub(r'^/admin/realms/[^/]+', '', path)
+        return f'{method} {ID_SEGMENT.sub("/{id}", path) or "/"}'
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = self.endpoint(method, url)
+        attempts = self.retries + 1 if method in IDEMPOTENT_METHODS else 1
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            self.breaker.before_call()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                # Every failed attempt is reported, or a half-open probe would never finish
+                self.breaker.record_failure()
+                retry = isinstance(e, (requests.ConnectionError, requests.Timeout)) and not last
+                self.metrics.record(endpoint, time.perf_counter() - start, error=True, retry=retry)
+                if not retry:
+                    raise
+                logger.warning(f"Keycloak {endpoint} failed, retrying: {str(e)}")
+                self._sleep(attempt)
+                continue
+
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            retry = response.status_code in RETRY_STATUSES and not last
+            self.metrics.record(
+                endpoint, time.perf_counter() - start, error=response.status_code >= 500, retry=retry
+            )
+            if not retry:
+                return response
+            logger.warning(f"Keycloak {endpoint} returned {response.status_code}, retrying")
+            response.close()
+            self._sleep(attempt)
+
+    def _sleep(self, attempt):
+        # Full jitter keeps workers that failed together from retrying together
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_keycloak_client():
+    """Return the process-wide Keycloak HTTP client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = KeycloakClient(
+                    connect_timeout=getattr(settings, 'KEYCLOAK_HTTP_CONNECT_TIMEOUT', 3),
+                    read_timeout=getattr(settings, 'KEYCLOAK_HTTP_READ_TIMEOUT', 10),
+                    retries=getattr(settings, 'KEYCLOAK_HTTP_RETRIES', 2),
+                    backoff=getattr(settings, 'KEYCLOAK_HTTP_BACKOFF', 0.2),
+                    pool_size=getattr(settings, 'KEYCLOAK_HTTP_POOL_SIZE', 20),
+                    breaker=CircuitBreaker(
+                        failure_threshold=getattr(settings, 'KEYCLOAK_BREAKER_FAILURE_THRESHOLD', 5),
+                        reset_timeout=getattr(settings, 'KEYCLOAK_BREAKER_RESET_TIMEOUT', 30)
+                    )
+                )
+    return _client
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from secure_files.apps.core.directory import sync_directory
+from secure_files.apps.core.keycloak_admin import KeycloakError
+
+
+class Command(BaseCommand):
+    help = 'Mirror Keycloak users and their realm roles into the local directory'
+
+    def handle(self, *args, **options):
+        try:
+            created, updated, deleted = sync_directory()
+        except KeycloakError as e:
+            raise CommandError(f'Directory sync failed: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced directory: {created} created, {updated} updated, {deleted} deleted; '
+            f'run again within {settings.DIRECTORY_MAX_STALENESS}s to keep it fresh'
+        ))
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryUser',
+            fields=[
+                ('keycloak_id', models.CharField(max_length=36, primary_key=True, serialize=False)),
+                ('username', models.CharField(db_index=True, max_length=255)),
+                ('email', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('first_name', models.CharField(blank=True, max_length=255)),
+                ('last_name', models.CharField(blank=True, max_length=255)),
+                ('enabled', models.BooleanField(default=True)),
+                ('totp', models.BooleanField(default=False)),
+                ('roles', models.JSONField(default=list)),
+                ('created_timestamp', models.BigIntegerField(blank=True, null=True)),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['username'],
+            },
+        ),
+    ]
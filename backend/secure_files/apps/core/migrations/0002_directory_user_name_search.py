@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:26
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def fill_search_keys(apps, schema_editor):
+    DirectoryUser = apps.get_model('core', 'DirectoryUser')
+    DirectoryUser.objects.update(first_name_lower=Lower('first_name'), last_name_lower=Lower('last_name'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directoryuser',
+            name='first_name_lower',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='directoryuser',
+            name='last_name_lower',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
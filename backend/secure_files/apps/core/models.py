@@ -0,0 +1,192 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.utils import timezone
+
+from secure_files.apps.files.models import ChangeVersion
+
+
+class DirectoryUser(models.Model):
+    """
+    Local mirror of a Keycloak user
+    Kept current by the ``sync_directory`` command and refreshed on login,
+    so sharing by email, recipient suggestions and the admin user list are
+    indexed queries instead of Keycloak calls. Usernames and emails are
+    stored lowercased, as Keycloak does, and names get lowercased copies, so
+    lookups are exact or case-sensitive prefix matches on indexed columns
+    (on PostgreSQL Django adds a pattern_ops index for LIKE 'x%' to each).
+    """
+    SYNC_KEY = 'directory'
+    FIELDS = (
+        'username', 'email', 'first_name', 'last_name', 'first_name_lower', 'last_name_lower',
+        'enabled', 'totp', 'created_timestamp',
+    )
+
+    keycloak_id = models.CharField(max_length=36, primary_key=True)
+    username = models.CharField(max_length=255, db_index=True)
+    email = models.CharField(max_length=255, blank=True, db_index=True)
+    first_name = models.CharField(max_length=255, blank=True)
+    last_name = models.CharField(max_length=255, blank=True)
+    first_name_lower = models.CharField(max_length=255, blank=True, db_index=True)  # Search keys
+    last_name_lower = models.CharField(max_length=255, blank=True, db_index=True)
+    enabled = models.BooleanField(default=True)
+    totp = models.BooleanField(default=False)
+    roles = models.JSONField(default=list)
+    created_timestamp = models.BigIntegerField(null=True, blank=True)
+    synced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['username']
+
+    def __str__(self):
+        return self.username
+
+    @staticmethod
+    def name_values(first_name, last_name):
+        return {
+            'first_name': first_name,
+            'last_name': last_name,
+            'first_name_lower': first_name.lower(),
+            'last_name_lower': last_name.lower(),
+        }
+
+    @classmethod
+    def values_from_keycloak(cls, user):
+        return {
+            'username': user['username'].lower(),
+            'email': (user.get('email') or '').lower(),
+            **cls.name_values(user.get('firstName') or '', user.get('lastName') or ''),
+            'enabled': user.get('enabled', False),
+            'totp': user.get('totp', False),
+            'created_timestamp': user.get('createdTimestamp'),
+        }
+
+    def as_keycloak(self):
+        """The row in Keycloak's user representation, as KeycloakAdmin returns users"""
+        return {
+            'id': self.keycloak_id,
+            'username': self.username,
+            'email': self.email,
+            'firstName': self.first_name,
+            'lastName': self.last_name,
+            'enabled': self.enabled,
+            'totp': self.totp,
+            'createdTimestamp': self.created_timestamp,
+        }
+
+    @staticmethod
+    def max_staleness():
+        return timezone.timedelta(seconds=getattr(settings, 'DIRECTORY_MAX_STALENESS', 900))
+
+    @classmethod
+    def staleness_bound(cls):
+        return timezone.now() - cls.max_staleness()
+
+    @classmethod
+    def last_synced(cls):
+        """When the last full sync completed, or None"""
+        return ChangeVersion.objects.filter(key=cls.SYNC_KEY).values_list('updated_at', flat=True).first()
+
+    @classmethod
+    def is_fresh(cls):
+        """Whether a full sync completed within DIRECTORY_MAX_STALENESS"""
+        last_synced = cls.last_synced()
+        return last_synced is not None and last_synced >= cls.staleness_bound()
+
+    @classmethod
+    def lookup_email(cls, email):
+        """The user with this email if their row is within the staleness bound, else None"""
+        entry = cls.objects.filter(email=email.strip().lower()).first()
+        if entry is None:
+            return None
+        # A full sync vouches for rows it left unchanged
+        if entry.synced_at >= cls.staleness_bound() or cls.is_fresh():
+            return entry
+        return None
+
+    @classmethod
+    def search(cls, query):
+        """
+        Users whose username, email, first or last name starts with ``query``
+        Case-insensitive, the same prefix semantic KeycloakAdmin searches with
+        """
+        query = query.strip().lower()
+        return cls.objects.filter(
+            models.Q(username__startswith=query)
+            | models.Q(email__startswith=query)
+            | models.Q(first_name_lower__startswith=query)
+            | models.Q(last_name_lower__startswith=query)
+        )
+
+    @classmethod
+    def record(cls, user, roles=None):
+        """Store one user fetched from Keycloak"""
+        defaults = dict(cls.values_from_keycloak(user), synced_at=timezone.now())
+        if roles is not None:
+            defaults['roles'] = roles
+        entry, _ = cls.objects.update_or_create(keycloak_id=user['id'], defaults=defaults)
+        return entry
+
+    @classmethod
+    def record_login(cls, claims):
+        """
+        Refresh a user's row from a verified access token
+        Tokens carry effective roles rather than direct role mappings, so
+        roles are only taken from the token for users the directory does
+        not know yet. Each user is looked at no more than once per half
+        staleness bound per process, and unchanged rows are only written
+        once they age past it.
+        """
+        refresh_interval = cls.max_staleness() / 2
+        if not cache.add(f'directory_login:{claims["sub"]}', True, refresh_interval.total_seconds()):
+            return
+        values = {
+            'username': claims.get('preferred_username', claims['sub']).lower(),
+            'email': (claims.get('email') or '').lower(),
+            **cls.name_values(claims.get('given_name', ''), claims.get('family_name', '')),
+            'enabled': True,
+        }
+        now = timezone.now()
+        entry = cls.objects.filter(keycloak_id=claims['sub']).first()
+        if entry is None:
+            cls.objects.get_or_create(keycloak_id=claims['sub'], defaults=dict(
+                values,
+                roles=claims.get('realm_access', {}).get('roles', []),
+                synced_at=now
+            ))
+            return
+        changed = any(getattr(entry, field) != value for field, value in values.items())
+        if changed or now >= entry.synced_at + refresh_interval:
+            cls.objects.filter(keycloak_id=claims['sub']).update(synced_at=now, **values)
+
+    @classmethod
+    def sync(cls, users, roles_by_user, batch_size=500):
+        """
+        Bring the mirror in line with a full listing of Keycloak users
+        Only new and changed rows are written, and rows of users that are
+        gone are deleted. Returns (created, updated, deleted).
+        """
+        now = timezone.now()
+        existing = {
+            row[0]: row[1:]
+            for row in cls.objects.values_list('keycloak_id', *cls.FIELDS, 'roles').iterator()
+        }
+        created, changed = [], []
+        for user in users:
+            values = cls.values_from_keycloak(user)
+            roles = sorted(roles_by_user.get(user['id'], []))
+            entry = cls(keycloak_id=user['id'], roles=roles, synced_at=now, **values)
+            current = existing.pop(user['id'], None)
+            if current is None:
+                created.append(entry)
+            elif current != tuple(values[field] for field in cls.FIELDS) + (roles,):
+                changed.append(entry)
+
+        with transaction.atomic():
+            cls.objects.bulk_create(created, batch_size=batch_size, ignore_conflicts=True)
+            cls.objects.bulk_update(changed, [*cls.FIELDS, 'roles', 'synced_at'], batch_size=batch_size)
+            gone = list(existing)
+            for start in range(0, len(gone), batch_size):
+                cls.objects.filter(keycloak_id__in=gone[start:start + batch_size]).delete()
+            ChangeVersion.bump([cls.SYNC_KEY])
+        return len(created), len(changed), len(gone)
@@ -0,0 +1,447 @@
+import io
+import os
+import time
+
+from unittest import mock
+
+import requests
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rest_framework.test import APIClient
+
+from secure_files.authentication import VerifiedTokenCache
+from secure_files.cache import TTLCache
+from secure_files.ratelimit import LocalRateLimitBackend, gcra
+from secure_files.throttling import Limit, Policy, principal, principal_roles
+
+from . import encryption
+from .encryption import EncryptionError, SegmentedFileEncryption
+from .keycloak_admin import KeycloakAdmin
+from .keycloak_client import CircuitBreaker, CircuitOpenError, KeycloakClient
+from .models import DirectoryUser
+
+KEYCLOAK_URL = 'http://keycloak.test/admin/realms/secure-files/users'
+
+
+class CircuitBreakerProbeTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.client = KeycloakClient(retries=0, breaker=self.breaker)
+        self.client.session.request = mock.Mock()
+
+    def test_failed_probe_with_non_connection_error_reopens_circuit(self):
+        self.client.session.request.side_effect = requests.exceptions.ChunkedEncodingError('truncated body')
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            self.client.get(KEYCLOAK_URL)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        # Half-open probe that fails the same way
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            self.client.get(KEYCLOAK_URL)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker._probing)
+
+        # The next probe is let through and closes the circuit
+        self.client.session.request.side_effect = None
+        self.client.session.request.return_value = mock.Mock(status_code=200)
+        self.assertEqual(self.client.get(KEYCLOAK_URL).status_code, 200)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_non_connection_errors_are_not_retried(self):
+        client = KeycloakClient(retries=2, backoff=0, breaker=CircuitBreaker(failure_threshold=5))
+        client.session.request = mock.Mock(side_effect=requests.exceptions.TooManyRedirects())
+        with self.assertRaises(requests.exceptions.TooManyRedirects):
+            client.get(KEYCLOAK_URL)
+        self.assertEqual(client.session.request.call_count, 1)
+
+    def test_open_circuit_rejects_calls(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+
+class TTLCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache(ttl=60)
+        with mock.patch('secure_files.cache.time.monotonic', return_value=1000.0):
+            cache.set('short', 1, ttl=5)
+            cache.set('capped', 2, ttl=600)
+            cache.set('expired', 3, ttl=-1)
+        with mock.patch('secure_files.cache.time.monotonic', return_value=1010.0):
+            self.assertIsNone(cache.get('short'))
+            self.assertEqual(cache.get('capped'), 2)
+            self.assertIsNone(cache.get('expired'))
+        with mock.patch('secure_files.cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('capped'))
+
+    def test_delete_matching(self):
+        cache = TTLCache()
+        cache.set('a', {'user': 1})
+        cache.set('b', {'user': 2})
+        cache.delete_matching(lambda value: value['user'] == 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), {'user': 2})
+
+
+class DirectorySearchTests(TestCase):
+    def setUp(self):
+        DirectoryUser.sync([
+            {'id': 'a', 'username': 'Alice', 'email': 'alice@example.com', 'firstName': 'Alice', 'lastName': 'McAdams'},
+            {'id': 'b', 'username': 'bob', 'email': 'bob@example.com', 'firstName': 'Robert', 'lastName': 'Adams'},
+        ], {})
+
+    def search(self, query):
+        return sorted(DirectoryUser.search(query).values_list('keycloak_id', flat=True))
+
+    def test_matches_any_field_by_case_insensitive_prefix(self):
+        self.assertEqual(self.search('ALI'), ['a'])
+        self.assertEqual(self.search('bob@'), ['b'])
+        self.assertEqual(self.search('rob'), ['b'])
+        self.assertEqual(self.search('adams'), ['b'])
+
+    def test_does_not_match_substrings(self):
+        self.assertEqual(self.search('dams'), [])
+        self.assertEqual(self.search('example'), [])
+
+    def test_keycloak_is_searched_by_the_same_prefix(self):
+        self.assertEqual(KeycloakAdmin.prefix_search(' Ada '), 'Ada*')
+        self.assertEqual(KeycloakAdmin.prefix_search('*ada*'), 'ada*')
+        self.assertEqual(KeycloakAdmin.prefix_search('"ada"'), 'ada*')
+        self.assertIsNone(KeycloakAdmin.prefix_search('*'))
+
+
+@override_settings(RATE_LIMIT_POLICIES={})
+class AdminDirectoryUpdateTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create(username='admin')
+        admin.token = {'sub': 'admin-sub', 'realm_access': {'roles': ['admin']}}
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+        DirectoryUser.record({'id': 'bob-id', 'username': 'bob', 'email': 'bob@example.com', 'enabled': True})
+        patcher = mock.patch('secure_files.apps.core.views.KeycloakAdmin')
+        self.keycloak_admin = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_created_user_is_recorded(self):
+        self.keycloak_admin.create_user.return_value = 'carol-id'
+        response = self.client.post('/api/admin/create-user/', {
+            'username': 'Carol', 'email': 'carol@example.com', 'password': 'secret', 'role': 'user',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        entry = DirectoryUser.objects.get(keycloak_id='carol-id')
+        self.assertEqual((entry.username, entry.enabled, entry.roles), ('carol', True, ['user']))
+
+    def test_deleted_user_is_removed(self):
+        bob = User.objects.create(username='bob')
+        self.keycloak_admin.get_user_id_by_username.return_value = 'bob-id'
+        response = self.client.delete(f'/api/admin/{bob.pk}/delete-user/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse(DirectoryUser.objects.filter(keycloak_id='bob-id').exists())
+
+    def test_toggled_status_is_mirrored(self):
+        self.keycloak_admin.get_user_by_id.return_value = {'id': 'bob-id', 'username': 'bob', 'enabled': True}
+        response = self.client.post('/api/admin/bob-id/toggle-status/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse(DirectoryUser.objects.get(keycloak_id='bob-id').enabled)
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='dave')
+        self.claims = {'sub': 'dave-sub', 'exp': time.time() + 600}
+
+    def test_user_deleted_by_another_process_is_dropped(self):
+        worker = VerifiedTokenCache(revocation_interval=0)
+        worker.set('token', self.user, self.claims)
+        self.assertEqual(worker.get('token')[0].pk, self.user.pk)
+
+        # The delete happens elsewhere, this cache is never told directly
+        User.objects.filter(pk=self.user.pk).delete()
+        self.assertIsNone(worker.get('token'))
+
+    def test_revocation_checks_are_rate_limited(self):
+        worker = VerifiedTokenCache(revocation_interval=60)
+        worker.set('token', self.user, self.claims)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(worker.get('token'))
+
+
+class SegmentEngineExecutorTests(SimpleTestCase):
+    def test_growing_the_pool_retires_the_previous_one(self):
+        cipher = encryption.SegmentedFileEncryption(segment_size=16 * 1024)
+        data = os.urandom(256 * 1024)
+
+        small = encryption.SegmentEngine(workers=2, batch_size=16 * 1024)
+        ciphertext = b''.join(cipher.encrypt_stream([data], engine=small))
+        previous = encryption._executor
+
+        large = encryption.SegmentEngine(workers=previous._max_workers + 2, batch_size=16 * 1024)
+        plaintext = b''.join(encryption.SegmentedFileEncryption.decrypt_stream(cipher.key, [ciphertext], engine=large))
+
+        self.assertEqual(plaintext, data)
+        self.assertIsNot(encryption._executor, previous)
+        self.assertTrue(previous._shutdown)
+        for thread in previous._threads:
+            thread.join(timeout=5)
+        self.assertFalse(any(thread.is_alive() for thread in previous._threads))
+
+
+class SegmentFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.cipher = SegmentedFileEncryption(segment_size=16 * 1024)
+        self.segment = self.cipher.encrypted_segment_size
+
+    def encrypt(self, data):
+        return b''.join(self.cipher.encrypt_stream([data]))
+
+    def decrypt(self, ciphertext, chunk_size=5000):
+        chunks = [ciphertext[i:i + chunk_size] for i in range(0, len(ciphertext), chunk_size)]
+        return b''.join(SegmentedFileEncryption.decrypt_stream(self.cipher.key, chunks))
+
+    def test_round_trip(self):
+        for size in [0, 1, 16 * 1024, 16 * 1024 + 1, 100 * 1024]:
+            data = os.urandom(size)
+            ciphertext = self.encrypt(data)
+            self.assertTrue(SegmentedFileEncryption.is_segmented(ciphertext))
+            self.assertEqual(len(ciphertext), self.cipher.ciphertext_size(size))
+            self.assertEqual(self.decrypt(ciphertext), data)
+
+    def test_flipped_byte_is_rejected(self):
+        ciphertext = bytearray(self.encrypt(os.urandom(40 * 1024)))
+        ciphertext[encryption.HEADER_SIZE + self.segment + 10] ^= 1
+        with self.assertRaises(EncryptionError):
+            self.decrypt(bytes(ciphertext))
+
+    def test_tampered_header_is_rejected(self):
+        ciphertext = bytearray(self.encrypt(os.urandom(1024)))
+        ciphertext[encryption.HEADER_SIZE - 1] ^= 1  # Last byte of the nonce prefix
+        with self.assertRaises(EncryptionError):
+            self.decrypt(bytes(ciphertext))
+
+    def test_truncation_at_a_segment_boundary_is_rejected(self):
+        ciphertext = self.encrypt(os.urandom(40 * 1024))
+        with self.assertRaises(EncryptionError):
+            self.decrypt(ciphertext[:encryption.HEADER_SIZE + 2 * self.segment])
+
+    def test_reordered_segments_are_rejected(self):
+        ciphertext = self.encrypt(os.urandom(40 * 1024))
+        header, body = ciphertext[:encryption.HEADER_SIZE], ciphertext[encryption.HEADER_SIZE:]
+        first, second, rest = body[:self.segment], body[self.segment:2 * self.segment], body[2 * self.segment:]
+        with self.assertRaises(EncryptionError):
+            self.decrypt(header + second + first + rest)
+
+    def test_appended_segment_is_rejected(self):
+        ciphertext = self.encrypt(os.urandom(40 * 1024))
+        extra = self.cipher.encrypt_segment(3, os.urandom(1024), final=True)
+        with self.assertRaises(EncryptionError):
+            self.decrypt(ciphertext + extra)
+
+    def test_other_formats_are_not_mistaken_for_segmented(self):
+        self.assertFalse(SegmentedFileEncryption.is_segmented(b'gAAAAABl'))
+        with self.assertRaises(EncryptionError):
+            SegmentedFileEncryption.from_header(self.cipher.key, b'gAAAAABl' + bytes(8))
+
+
+class RangeDecryptionTests(SimpleTestCase):
+    def setUp(self):
+        self.cipher = SegmentedFileEncryption(segment_size=16 * 1024)
+        self.data = os.urandom(40 * 1024)
+        self.ciphertext = b''.join(self.cipher.encrypt_stream([self.data]))
+
+    def decrypt_range(self, start, end, ciphertext=None):
+        ciphertext = ciphertext or self.ciphertext
+        return b''.join(SegmentedFileEncryption.decrypt_range(
+            self.cipher.key, io.BytesIO(ciphertext), len(ciphertext), start, end
+        ))
+
+    def test_ranges_within_and_across_segments(self):
+        segment = self.cipher.segment_size
+        for start, end in [
+            (0, 0),
+            (5, 99),
+            (segment - 1, segment),
+            (segment, 2 * segment - 1),
+            (100, 2 * segment + 100),
+            (len(self.data) - 1, len(self.data) - 1),
+            (0, len(self.data) - 1),
+        ]:
+            self.assertEqual(self.decrypt_range(start, end), self.data[start:end + 1], (start, end))
+
+    def test_end_past_the_last_byte_is_clamped(self):
+        self.assertEqual(self.decrypt_range(len(self.data) - 10, len(self.data) + 1000), self.data[-10:])
+
+    def test_only_covering_segments_are_authenticated(self):
+        ciphertext = bytearray(self.ciphertext)
+        ciphertext[-1] ^= 1  # Tag of the last segment
+        self.assertEqual(self.decrypt_range(0, 99, bytes(ciphertext)), self.data[:100])
+        with self.assertRaises(EncryptionError):
+            self.decrypt_range(len(self.data) - 100, len(self.data) - 1, bytes(ciphertext))
+
+    def test_truncated_blob_is_rejected(self):
+        truncated = self.ciphertext[:encryption.HEADER_SIZE + 2 * self.cipher.encrypted_segment_size]
+        with self.assertRaises(EncryptionError):
+            self.decrypt_range(self.cipher.segment_size, 2 * self.cipher.segment_size - 1, truncated)
+
+
+class GCRATests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = LocalRateLimitBackend()
+        self.now = 1000.0
+        patcher = mock.patch('secure_files.ratelimit.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hits(self, count, key='k', **kwargs):
+        return [self.limiter.hit(key, 10, 60, **kwargs) for _ in range(count)]
+
+    def test_burst_then_one_request_per_interval(self):
+        self.assertEqual(self.hits(3, burst=3), [(True, 0.0)] * 3)
+        self.assertEqual(self.hits(1, burst=3), [(False, 6.0)])
+
+        self.now += 5
+        allowed, retry_after = self.limiter.hit('k', 10, 60, burst=3)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 1.0)
+
+        self.now += 1
+        self.assertEqual(self.hits(1, burst=3), [(True, 0.0)])
+        self.assertFalse(self.hits(1, burst=3)[0][0])
+
+    def test_denied_hits_are_not_recorded(self):
+        self.hits(3, burst=3)
+        self.assertEqual(self.hits(5, burst=3), [(False, 6.0)] * 5)
+        self.now += 6
+        self.assertTrue(self.hits(1, burst=3)[0][0])
+
+    def test_burst_defaults_to_the_limit(self):
+        self.assertTrue(all(allowed for allowed, _ in self.hits(10)))
+        self.assertFalse(self.hits(1)[0][0])
+
+    def test_cost_is_charged_in_units(self):
+        self.assertTrue(self.limiter.hit('k', 10, 60, burst=3, cost=3)[0])
+        self.assertEqual(self.limiter.hit('k', 10, 60, burst=3, cost=2), (False, 12.0))
+
+    def test_keys_are_limited_independently_and_reset(self):
+        self.hits(3, burst=3)
+        self.assertTrue(self.hits(1, key='other', burst=3)[0][0])
+        self.limiter.reset('k')
+        self.assertTrue(self.hits(1, burst=3)[0][0])
+
+    def test_reservations_are_paced_not_refused(self):
+        delays = [self.limiter.reserve('k', 10, 60, burst=3) for _ in range(5)]
+        self.assertEqual(delays, [0.0, 0.0, 0.0, 6.0, 12.0])
+        self.now += 60
+        self.assertEqual(self.limiter.reserve('k', 10, 60, burst=3), 0.0)
+
+    def test_expired_keys_are_pruned(self):
+        self.limiter.prune_every = 2
+        self.hits(1)
+        self.now += 60
+        self.hits(1, key='other')
+        self.assertEqual(list(self.limiter._tats), ['other'])
+
+    def test_gcra(self):
+        self.assertEqual(gcra(100.0, None, 6.0, 18.0), (106.0, 0.0))
+        self.assertEqual(gcra(100.0, 50.0, 6.0, 18.0), (106.0, 0.0))
+        self.assertEqual(gcra(100.0, 118.0, 6.0, 18.0), (None, 6.0))
+
+
+class RateLimitPolicyTests(SimpleTestCase):
+    def limits(self, policy, roles):
+        return {
+            scope: (limit.limit, limit.period, limit.burst)
+            for scope, limit in policy.limits_for(roles).items()
+        }
+
+    def test_limit_parsing(self):
+        limit = Limit.parse('30/min')
+        self.assertEqual((limit.limit, limit.period, limit.burst), (30, 60, 30))
+        limit = Limit.parse({'rate': '5/hour', 'burst': 2})
+        self.assertEqual((limit.limit, limit.period, limit.burst), (5, 3600, 2))
+        for value in ['30', 'x/min', '30/fortnight', '0/s', {'rate': '1/s', 'burst': 0}]:
+            with self.assertRaises(ImproperlyConfigured, msg=value):
+                Limit.parse(value)
+
+    def test_first_configured_role_held_applies(self):
+        policy = Policy('route', {
+            'ip': '5/min',
+            'user': '2/min',
+            'roles': {
+                'admin': {'user': None},
+                'service-account': {'user': {'rate': '60/min', 'burst': 20}},
+            },
+        })
+        self.assertEqual(self.limits(policy, set()), {'ip': (5, 60, 5), 'user': (2, 60, 2)})
+        self.assertEqual(self.limits(policy, {'user'}), {'ip': (5, 60, 5), 'user': (2, 60, 2)})
+        self.assertEqual(self.limits(policy, {'service-account'}), {'ip': (5, 60, 5), 'user': (60, 60, 20)})
+        self.assertEqual(self.limits(policy, {'service-account', 'admin'}), {'ip': (5, 60, 5)})
+
+    def test_unknown_scopes_are_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            Policy('route', {'tenant': '1/s'})
+        with self.assertRaises(ImproperlyConfigured):
+            Policy('route', {'roles': {'admin': {'tenant': '1/s'}}})
+
+    def test_principal_and_roles_come_from_the_token(self):
+        user = User(pk=7, username='svc')
+        self.assertEqual(principal(user), 'local-7')
+        user.token = {
+            'sub': 'svc-sub',
+            'preferred_username': 'service-account-backup',
+            'realm_access': {'roles': ['user']},
+        }
+        self.assertEqual(principal(user), 'svc-sub')
+        self.assertEqual(principal_roles(user), {'user', 'service-account'})
+        self.assertEqual(principal_roles(User()), set())
+
+
+@override_settings(RATE_LIMIT_POLICIES={
+    'file-bulk-download': {'user': '1/min', 'roles': {'admin': {'user': None}}},
+})
+class PolicyRateThrottleTests(TestCase):
+    def setUp(self):
+        for target, value in [
+            ('secure_files.throttling._policies', None),
+            ('secure_files.ratelimit._limiter', LocalRateLimitBackend()),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def client_for(self, username, roles):
+        user = User.objects.create(username=username)
+        user.token = {'sub': f'{username}-sub', 'realm_access': {'roles': roles}}
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client
+
+    def test_user_over_the_route_limit_is_throttled(self):
+        client = self.client_for('erin', ['user'])
+        self.assertEqual(client.get('/api/files/bulk-download/').status_code, 404)
+
+        response = client.get('/api/files/bulk-download/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response['Retry-After']), 60)
+
+        # Limits are per principal and per route
+        self.assertEqual(self.client_for('frank', ['user']).get('/api/files/bulk-download/').status_code, 404)
+        self.assertEqual(client.get('/api/files/storage-stats/').status_code, 200)
+
+    def test_role_override_lifts_the_limit(self):
+        client = self.client_for('grace', ['admin'])
+        for _ in range(3):
+            self.assertEqual(client.get('/api/files/bulk-download/').status_code, 404)
@@ -14,15 +14,20 @@ from django.utils import timezone
 from django.db.models.functions import TruncDate
 from django.db import transaction
 
-from secure_files.apps.files.models import File, FileShare, ShareLink, FileAccess
+from secure_files.apps.files.models import File, FileShare, ShareLink, FileAccess, UserStorageUsage
 from .serializers import (
     UserAdminSerializer,
     UserStatsSerializer,
     SystemStatsSerializer,
     CreateUserSerializer
 )
+from .models import DirectoryUser
 from .permissions import HasKeycloakRole
-from .keycloak_admin import KeycloakAdmin, KeycloakError
+from .key_management import data_key_cache
+from secure_files.authentication import token_cache
+from secure_files.jwks import jwks_store
+from .keycloak_admin import KeycloakAdmin, KeycloakError, KeycloakUnavailable
+from .keycloak_client import get_keycloak_client
 from datetime import timedelta
 
 logger = logging.getLogger(__name__)
@@ -69,6 +74,15 @@ class AdminViewSet(viewsets.ViewSet):
                     password=validated_data['password']
                 )
 
+            # Keep the local directory in step, it is read instead of Keycloak while fresh
+            DirectoryUser.record({
+                'id': keycloak_user_id,
+                'username': validated_data['username'],
+                'email': validated_data['email'],
+                'enabled': True,
+                'createdTimestamp': int(timezone.now().timestamp() * 1000),
+            }, roles=[validated_data['role']])
+
             return Response({
                 'message': 'User created successfully',
                 'user': {
@@ -105,9 +119,12 @@ class AdminViewSet(viewsets.ViewSet):
                 if keycloak_user_id:
                     # Delete from Keycloak
                     keycloak_admin.delete_user(keycloak_user_id)
+                    DirectoryUser.objects.filter(keycloak_id=keycloak_user_id).delete()
 
                 # Delete from Django
+                user_id = user.pk
                 user.delete()
+                token_cache.invalidate_user(user_id)
 
             return Response({
                 'message': 'User deleted successfully'
@@ -168,8 +185,7 @@ class AdminViewSet(viewsets.ViewSet):
             })
         else:
             # Regular users see their own stats
-            used_storage = File.objects.filter(owner=user).aggregate(
-                total=Sum('file_size'))['total'] or 0
+            used_storage = UserStorageUsage.for_user(user).used_bytes
             used_links = ShareLink.objects.filter(file__owner=user).count()
 
             return Response({
@@ -360,7 +376,10 @@ class AdminViewSet(viewsets.ViewSet):
         """Get system-wide statistics"""
         try:
             keycloak_admin = KeycloakAdmin()
-            keycloak_users = keycloak_admin.get_all_users()
+            if DirectoryUser.is_fresh():
+                keycloak_users = [entry.as_keycloak() for entry in DirectoryUser.objects.all()]
+            else:
+                keycloak_users = keycloak_admin.get_all_users()
             # Count total and active users
             total_users = len(keycloak_users)
             active_users = sum(1 for user in keycloak_users if user.get('enabled', False) and user.get('totp', False))
@@ -392,8 +411,18 @@ class AdminViewSet(viewsets.ViewSet):
             }
 
             serializer = SystemStatsSerializer(data)
-            return Response(serializer.data)
+            response = Response(serializer.data)
+            if keycloak_admin.degraded:
+                response['Warning'] = '110 - "Response is Stale"'
+            return response
 
+        except KeycloakUnavailable as e:
+            logger.error(f"Keycloak unavailable: {str(e)}")
+            return Response(
+                {'error': 'User directory is temporarily unavailable'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.KEYCLOAK_BREAKER_RESET_TIMEOUT)}
+            )
         except requests.exceptions.RequestException as e:
             logger.error(f"Error communicating with Keycloak: {str(e)}")
             return Response(
@@ -407,21 +436,71 @@ class AdminViewSet(viewsets.ViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """Hit rates of this worker's in-process caches"""
+        return Response({
+            'verified_tokens': token_cache.stats(),
+            'data_keys': data_key_cache.stats(),
+            'jwks_fetches': jwks_store.fetches,
+        })
+
+    @action(detail=False, methods=['get'], url_path='keycloak-stats')
+    def keycloak_stats(self, request):
+        """Circuit breaker state and latency and error counts of this worker's Keycloak calls by endpoint"""
+        client = get_keycloak_client()
+        return Response({
+            'breaker': client.breaker.stats(),
+            'endpoints': client.metrics.stats(),
+        })
+
     @action(detail=False, methods=['get'], url_path='user-management')
     def user_management(self, request):
-        """Get user list with their stats"""
+        """
+        Get user list with their stats
+        With ``page``, ``page_size`` or ``search`` only one page of matching
+        users is returned, with the total count. Users come from the local
+        directory while it is fresh, and from Keycloak otherwise.
+        """
         try:
             keycloak_admin = KeycloakAdmin()
-            keycloak_users = keycloak_admin.get_all_users()
-    
+            from_directory = DirectoryUser.is_fresh()
+            entries = DirectoryUser.objects.all()
+            paged = any(param in request.query_params for param in ('page', 'page_size', 'search'))
+            if paged:
+                try:
+                    page = max(int(request.query_params.get('page', 1)), 1)
+                    page_size = min(
+                        max(int(request.query_params.get('page_size', settings.ADMIN_USER_PAGE_SIZE)), 1),
+                        settings.ADMIN_USER_MAX_PAGE_SIZE
+                    )
+                except ValueError:
+                    return Response(
+                        {'error': 'page and page_size must be integers'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                search = request.query_params.get('search') or None
+                if from_directory:
+                    if search:
+                        entries = DirectoryUser.search(search)
+                    total = entries.count()
+                    entries = entries[(page - 1) * page_size:page * page_size]
+                else:
+                    total = keycloak_admin.get_users_count(search)
+                    keycloak_users = keycloak_admin.get_users_page((page - 1) * page_size, page_size, search)
+            elif not from_directory:
+                keycloak_users = keycloak_admin.get_all_users()
+
+            if from_directory:
+                keycloak_users = [entry.as_keycloak() for entry in entries]
+                roles_by_user = {entry.keycloak_id: entry.roles for entry in entries}
+            else:
+                roles_by_user = keycloak_admin.get_roles_by_user(user['id'] for user in keycloak_users)
+
             # Process user data
             user_data = []
             for user in keycloak_users:
-                # Get user roles
-                user_roles_response = keycloak_admin.get_user_roles(user['id'])
-
-                roles = [role['name'] for role in user_roles_response.json()]
-                logger.info(f"User roles: user={user}, roles={roles}")
+                roles = roles_by_user.get(user['id'], [])
                 # Convert timestamps
                 last_login = user.get('lastLogin')
                 if last_login:
@@ -442,8 +521,26 @@ class AdminViewSet(viewsets.ViewSet):
                 })
     
             serializer = UserStatsSerializer(user_data, many=True, context={'request': request})
-            return Response(serializer.data)
+            if paged:
+                response = Response({
+                    'count': total,
+                    'page': page,
+                    'page_size': page_size,
+                    'results': serializer.data
+                })
+            else:
+                response = Response(serializer.data)
+            if keycloak_admin.degraded:
+                response['Warning'] = '110 - "Response is Stale"'
+            return response
                 
+        except KeycloakUnavailable as e:
+            logger.error(f"Keycloak unavailable: {str(e)}")
+            return Response(
+                {'error': 'User directory is temporarily unavailable'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.KEYCLOAK_BREAKER_RESET_TIMEOUT)}
+            )
         except requests.exceptions.RequestException as e:
             logger.error(f"Error communicating with Keycloak: {str(e)}")
             return Response(
@@ -470,7 +567,8 @@ class AdminViewSet(viewsets.ViewSet):
 
             # Also update Keycloak user status
             keycloak_admin.update_user_status(user['id'], user['enabled'])
-            
+            DirectoryUser.objects.filter(keycloak_id=user['id']).update(enabled=user['enabled'])
+
             return Response({
                 'id': user['id'],
                 'username': user['username'],
@@ -2,4 +2,12 @@ from django.apps import AppConfig
 
 class FilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'secure_files.apps.files'
\ No newline at end of file
+    name = 'secure_files.apps.files'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from secure_files.throttling import get_rate_limit_policies, get_egress_limits
+
+        # Fail at startup rather than on the first request
+        get_rate_limit_policies()
+        get_egress_limits()
@@ -0,0 +1,103 @@
+import zlib
+import fnmatch
+import logging
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # Optional, zlib is used instead
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_NONE = ''
+CODEC_ZLIB = 'zlib'
+CODEC_ZSTD = 'zstd'
+
+
+class CompressionError(Exception):
+    """Raised for unknown codecs or corrupt compressed data"""
+    pass
+
+
+def default_codec():
+    """Configured codec, falling back to zlib when zstandard is not installed"""
+    codec = getattr(settings, 'FILE_COMPRESSION_CODEC', CODEC_ZSTD)
+    if codec == CODEC_ZSTD and zstandard is None:
+        return CODEC_ZLIB
+    return codec
+
+
+def is_compressible(mime_type):
+    """Whether the compression policy expects a MIME type to shrink"""
+    if not mime_type:
+        return False
+    patterns = settings.FILE_COMPRESSION_MIME_TYPES
+    mime_type = mime_type.split(';')[0].strip().lower()
+    return any(fnmatch.fnmatchcase(mime_type, pattern) for pattern in patterns)
+
+
+def select_codec(mime_type):
+    """Codec to compress a file of the given MIME type with, or CODEC_NONE"""
+    if not getattr(settings, 'FILE_COMPRESSION', False) or not is_compressible(mime_type):
+        return CODEC_NONE
+    return default_codec()
+
+
+def compressor(codec):
+    """Incremental compressor exposing compress() and flush()"""
+    level = getattr(settings, 'FILE_COMPRESSION_LEVEL', None)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise CompressionError("zstandard is not installed")
+        return zstandard.ZstdCompressor(level=level or 3).compressobj()
+    if codec == CODEC_ZLIB:
+        return zlib.compressobj(level or 6)
+    raise CompressionError(f"Unknown compression codec '{codec}'")
+
+
+def decompressor(codec):
+    """Incremental decompressor exposing decompress() and flush()"""
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise CompressionError("zstandard is required to read this file")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    raise CompressionError(f"Unknown compression codec '{codec}'")
+
+
+def compress_stream(chunks, codec):
+    """Compress an iterable of byte chunks, passing it through for CODEC_NONE"""
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+
+    engine = compressor(codec)
+    for chunk in chunks:
+        data = engine.compress(chunk)
+        if data:
+            yield data
+    data = engine.flush()
+    if data:
+        yield data
+
+
+def decompress_stream(chunks, codec):
+    """Decompress an iterable of byte chunks produced by compress_stream()"""
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+
+    engine = decompressor(codec)
+    try:
+        for chunk in chunks:
+            data = engine.decompress(chunk)
+            if data:
+                yield data
+        data = engine.flush()
+    except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as e:
+        raise CompressionError(f"Corrupt {codec} data: {str(e)}")
+    if data:
+        yield data
@@ -0,0 +1,65 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from secure_files.apps.core.encryption import SEGMENT_FORMAT_VERSION
+
+
+def content_etag(file_instance, encrypted=False):
+    """
+    Strong ETag for a file's decrypted content, or its stored ciphertext
+    The plaintext checksum identifies the bytes; the format version lets a
+    change in how content is produced invalidate every cached copy.
+    """
+    if not file_instance.checksum:
+        return None
+    suffix = '-enc' if encrypted else ''
+    return f'"{file_instance.checksum}-v{SEGMENT_FORMAT_VERSION}{suffix}"'
+
+
+def content_last_modified(file_instance):
+    """Last-Modified timestamp for a file's content; files are immutable once uploaded"""
+    return int(file_instance.uploaded_at.timestamp()) if file_instance.uploaded_at else None
+
+
+def listing_etag(request, versions, scope=''):
+    """Weak ETag for a listing from the change versions it depends on and its query"""
+    digest = hashlib.sha256(f'{scope};'.encode('utf-8'))
+    for key in sorted(versions):
+        digest.update(f'{key}={versions[key]};'.encode('utf-8'))
+    digest.update(request.get_full_path().encode('utf-8'))
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def evaluate_preconditions(request, etag=None, last_modified=None):
+    """
+    304/412 response when the request's conditional headers are satisfied
+    Returns None when the full response should be produced.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def if_range_matches(request, etag=None, last_modified=None):
+    """Whether a Range request may be honoured given its If-Range header"""
+    header = request.META.get('HTTP_IF_RANGE')
+    if not header:
+        return True
+    if header.startswith(('"', 'W/')):
+        # Only strong validators may be used with If-Range
+        return etag is not None and header == etag
+    return last_modified is not None and parse_http_date_safe(header) == last_modified
+
+
+def set_validators(response, etag=None, last_modified=None):
+    """Attach validators and make caches revalidate the per-user response"""
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Authorization',))
+    return response
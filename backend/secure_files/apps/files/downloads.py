@@ -0,0 +1,161 @@
+import logging
+import posixpath
+
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+
+from .utils import DEFAULT_CHUNK_SIZE, iter_chunks
+from .streaming import transfer_content
+from .ranges import parse_range_header
+from .conditional import (
+    content_etag, content_last_modified, evaluate_preconditions, if_range_matches, set_validators,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadEngine:
+    """
+    Streams decrypted file content to the client
+    Ciphertext is read, decrypted and handed to the server one bounded chunk
+    at a time, so a download holds at most one encryption batch in memory no
+    matter how large the file is. Legacy Fernet blobs are the exception and
+    are still decrypted whole.
+    With ``encrypted`` set the stored ciphertext is sent instead, for
+    clients that decrypt locally. With ``asynchronous`` set (under ASGI) the
+    body is an async iterator that reads and decrypts in the transfer
+    thread pool, so slow clients don't hold a thread. A ``pacer`` slows the
+    body down to its egress byte rates.
+    """
+
+    def __init__(self, file_instance, chunk_size=None, encrypted=False, asynchronous=False, pacer=None):
+        self.file_instance = file_instance
+        self.chunk_size = chunk_size or getattr(settings, 'FILE_DOWNLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+        self.encrypted = encrypted
+        self.asynchronous = asynchronous
+        self.pacer = pacer
+        self.etag = content_etag(file_instance, encrypted=encrypted)
+        self.last_modified = content_last_modified(file_instance)
+
+    def not_modified(self, request):
+        """
+        304 (or 412) response for a satisfied conditional request
+        Decided from database fields alone, before any storage I/O
+        """
+        return evaluate_preconditions(request, self.etag, self.last_modified)
+
+    def requested_range(self, request):
+        """
+        Inclusive (start, end) the request asks for, or None for the whole file
+        Raises RangeNotSatisfiable for ranges outside the file
+        """
+        if not if_range_matches(request, self.etag, self.last_modified):
+            return None
+        return parse_range_header(request.META.get('HTTP_RANGE'), self.file_instance.file_size)
+
+    def stream(self, byte_range=None):
+        """Yield plaintext for the whole file or an inclusive (start, end) range"""
+        if byte_range is None:
+            chunks = self.file_instance.decrypt_file_data()
+        else:
+            chunks = self.file_instance.decrypt_file_range(*byte_range)
+
+        try:
+            for chunk in chunks:
+                if len(chunk) <= self.chunk_size:
+                    yield chunk
+                    continue
+                # Decompression can inflate a segment well past the chunk size
+                view = memoryview(chunk)
+                for offset in range(0, len(view), self.chunk_size):
+                    yield bytes(view[offset:offset + self.chunk_size])
+        except Exception as e:
+            # Headers are gone by now; dropping the connection is all that is left
+            logger.error(f"Download of file {self.file_instance.id} aborted: {str(e)}")
+            raise
+        finally:
+            chunks.close()
+
+    def response(self, byte_range=None, content_type=None, filename=None):
+        """Full or partial (206) streaming response"""
+        file_size = self.file_instance.file_size
+        response = StreamingHttpResponse(
+            transfer_content(self.stream(byte_range), self.asynchronous, self.pacer),
+            status=200 if byte_range is None else 206,
+            content_type=content_type or self.file_instance.mime_type or 'application/octet-stream'
+        )
+        if byte_range is None:
+            response['Content-Length'] = file_size
+        else:
+            start, end = byte_range
+            response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+            response['Content-Length'] = end - start + 1
+
+        response['Accept-Ranges'] = 'bytes'
+        set_validators(response, self.etag, self.last_modified)
+        if filename:
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def offload_uri(self):
+        """
+        Internal nginx location serving the stored blob, or None
+        Only local storage under MEDIA_ROOT can be handed to nginx.
+        """
+        if not getattr(settings, 'FILE_DOWNLOAD_OFFLOAD', False):
+            return None
+        try:
+            default_storage.path(self.file_instance.file.name)
+        except NotImplementedError:
+            return None
+        prefix = getattr(settings, 'FILE_DOWNLOAD_OFFLOAD_PREFIX', '/protected-media/')
+        return posixpath.join(prefix, quote(self.file_instance.file.name))
+
+    def encrypted_response(self, filename=None):
+        """
+        Stored ciphertext plus the data key, for clients that decrypt locally
+        With FILE_DOWNLOAD_OFFLOAD Django only answers with X-Accel-Redirect
+        and nginx sends the blob itself, ranges included, so the worker is
+        free as soon as authorization and accounting are done; nginx can only
+        pace a single connection, so it gets the slowest egress cap. Without
+        it the blob is streamed from here.
+        """
+        uri = self.offload_uri()
+        if uri:
+            response = HttpResponse(content_type='application/octet-stream')
+            response['X-Accel-Redirect'] = uri
+            if self.pacer:
+                response['X-Accel-Limit-Rate'] = self.pacer.connection_rate()
+        elif self.asynchronous or self.pacer:
+            blob = self.file_instance.file.open('rb')
+            response = StreamingHttpResponse(
+                transfer_content(self._read_blob(blob), self.asynchronous, self.pacer),
+                content_type='application/octet-stream'
+            )
+            response['Content-Length'] = self.file_instance.file.size
+        else:
+            response = FileResponse(
+                self.file_instance.file.open('rb'),
+                content_type='application/octet-stream'
+            )
+
+        key = self.file_instance.get_encryption_key_b64()
+        if key:
+            response['X-Encryption-Key'] = key
+            response['Access-Control-Expose-Headers'] = 'X-Encryption-Key'
+        set_validators(response, self.etag, self.last_modified)
+        if filename:
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def _read_blob(self, blob):
+        with blob:
+            yield from iter_chunks(blob, self.chunk_size)
+
+    def range_not_satisfiable(self):
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{self.file_instance.file_size}'
+        return response
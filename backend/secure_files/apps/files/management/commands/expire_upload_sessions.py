@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from secure_files.apps.files.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Delete expired upload sessions and their stored chunks'
+
+    def handle(self, *args, **options):
+        # Completed sessions have no chunks left and are simply dropped
+        expired = UploadSession.objects.filter(expires_at__lte=timezone.now())
+        count = 0
+        for session in expired.iterator():
+            session.discard()
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired upload sessions'))
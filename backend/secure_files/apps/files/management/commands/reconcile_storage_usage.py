@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from secure_files.apps.files.models import UserStorageUsage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user storage ledger from File rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only reconcile these users')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        drifted = 0
+        for user in users.iterator():
+            before = UserStorageUsage.objects.filter(user=user).first()
+            usage = UserStorageUsage.reconcile(user)
+            if before and (before.used_bytes, before.reserved_bytes) != (usage.used_bytes, usage.reserved_bytes):
+                drifted += 1
+                self.stdout.write(
+                    f'{user.username}: used {before.used_bytes} -> {usage.used_bytes}, '
+                    f'reserved {before.reserved_bytes} -> {usage.reserved_bytes}'
+                )
+
+        self.stdout.write(self.style.SUCCESS(f'Reconciled storage usage, {drifted} ledgers corrected'))
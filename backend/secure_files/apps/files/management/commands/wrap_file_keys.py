@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from secure_files.apps.files.models import File
+
+
+class Command(BaseCommand):
+    help = 'Wrap legacy raw file encryption keys with the configured key provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = File.objects.filter(key_provider='', encryption_key__isnull=False)
+        wrapped = 0
+        for file in queryset.iterator(chunk_size=options['batch_size']):
+            with transaction.atomic():
+                file.wrap_data_key(bytes(file.encryption_key))
+                file.save(update_fields=['encryption_key', 'key_provider'])
+            wrapped += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Wrapped {wrapped} file keys'))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_alter_fileshare_shared_with'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='key_provider',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
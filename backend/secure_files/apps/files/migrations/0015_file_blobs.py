@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0014_user_storage_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('checksum', models.CharField(max_length=64)),
+                ('file', models.FileField(upload_to='uploads/')),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('mime_type', models.CharField(blank=True, max_length=255, null=True)),
+                ('encryption_key', models.BinaryField(blank=True, null=True)),
+                ('key_provider', models.CharField(blank=True, default='', max_length=32)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_blobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('owner', 'checksum')},
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='files', to='files.fileblob'),
+        ),
+    ]
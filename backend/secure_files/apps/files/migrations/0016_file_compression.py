@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0015_file_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='compression',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='fileblob',
+            name='compression',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
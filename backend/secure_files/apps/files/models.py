@@ -1,3 +1,4 @@
+import os
 import uuid
 import base64
 import hashlib
@@ -5,16 +6,35 @@ import jwt
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db import models
-from django.db.models import Count
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 import logging
 
+from secure_files.apps.core.encryption import (
+    SegmentedFileEncryption, SegmentEngine, EncryptionError, SEGMENT_MAGIC,
+)
+from secure_files.apps.core.key_management import (
+    get_key_provider, data_key_cache, KeyProviderError,
+)
+from .utils import iter_chunks, slice_chunks, StreamingContentFile
+from .compression import compress_stream, decompress_stream, CompressionError
+
 logger = logging.getLogger(__name__)
 
+def get_segment_engine():
+    """Segment engine configured with the deployment's encryption parallelism"""
+    return SegmentEngine(
+        workers=getattr(settings, 'FILE_ENCRYPTION_WORKERS', 1),
+        batch_size=getattr(settings, 'FILE_ENCRYPTION_BATCH_SIZE', 1024 * 1024)
+    )
+
 class File(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
@@ -22,15 +42,24 @@ class File(models.Model):
     mime_type = models.CharField(max_length=255, null=True, blank=True)
     file_size = models.BigIntegerField(default=0)
     checksum = models.CharField(max_length=64, null=True, blank=True)  # SHA-256 hash
-    encryption_key = models.BinaryField(null=True, blank=True)
+    encryption_key = models.BinaryField(null=True, blank=True)  # Wrapped data key
+    key_provider = models.CharField(max_length=32, blank=True, default='')  # Empty for legacy raw keys
+    compression = models.CharField(max_length=16, blank=True, default='')  # Codec applied before encryption
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    blob = models.ForeignKey(
+        'FileBlob',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='files'
+    )  # Shared content when deduplication is enabled
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-uploaded_at']
 
     def save(self, *args, **kwargs):
-        if not self.pk:  # Only on creation
+        if self._state.adding and not self.checksum:  # Only on creation
             if self.file:
                 # Calculate file size
                 self.file.seek(0, 2)  # Seek to end
@@ -43,8 +72,55 @@ class File(models.Model):
                     sha256.update(chunk)
                 self.checksum = sha256.hexdigest()
 
+        if self._state.adding and self.should_deduplicate():
+            with transaction.atomic():
+                self.deduplicate()
+                super().save(*args, **kwargs)
+            return
+
         super().save(*args, **kwargs)
 
+    def should_deduplicate(self):
+        return (
+            getattr(settings, 'FILE_DEDUPLICATION', False)
+            and self.blob_id is None
+            and bool(self.checksum)
+            and bool(self.file)
+        )
+
+    def deduplicate(self):
+        """
+        Point this new file at its owner's blob for the same content
+        The first copy of some content becomes the blob. Later copies drop
+        their freshly stored ciphertext once the transaction commits and take
+        over the blob's file and wrapped data key.
+        """
+        blob, created = FileBlob.objects.select_for_update().get_or_create(
+            owner_id=self.owner_id,
+            checksum=self.checksum,
+            defaults={
+                'file': self.file.name,
+                'file_size': self.file_size,
+                'mime_type': self.mime_type,
+                'encryption_key': self.encryption_key,
+                'key_provider': self.key_provider,
+                'compression': self.compression,
+            }
+        )
+        if not created and blob.file.name != self.file.name:
+            duplicate = self.file.name
+            transaction.on_commit(lambda: default_storage.delete(duplicate))
+            self.file = blob.file.name
+            self.encryption_key = blob.encryption_key
+            self.key_provider = blob.key_provider
+            self.compression = blob.compression
+            # wrap_data_key cached the discarded key under this file's id
+            data_key_cache.delete(str(self.pk))
+
+        FileBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        self.blob = blob
+        return blob
+
     def calculate_checksum(self, file_data):
         """Calculate SHA-256 checksum of file data"""
         sha256 = hashlib.sha256()
@@ -55,73 +131,133 @@ class File(models.Model):
                 sha256.update(chunk)
         return sha256.hexdigest()
 
-    def generate_fernet_key(self):
-        """Generate a new Fernet key and store it in raw format"""
-        fernet_key = Fernet.generate_key()  # This generates a url-safe base64-encoded key
-        self.encryption_key = base64.urlsafe_b64decode(fernet_key)  # Store the raw bytes
-        return fernet_key
-
-    def get_fernet_key(self):
-        """Get the Fernet key in the correct format for encryption/decryption"""
+    @property
+    def key_context(self):
+        """Context the data key is wrapped under (the owning user)"""
+        return str(self.owner_id)
+
+    def generate_encryption_key(self):
+        """Generate a new 256-bit data key and store it wrapped by the key provider"""
+        data_key = os.urandom(32)
+        self.wrap_data_key(data_key)
+        return data_key
+
+    def wrap_data_key(self, data_key):
+        """Wrap a raw data key with the configured key provider"""
+        provider = get_key_provider()
+        self.encryption_key = provider.wrap_key(data_key, self.key_context)
+        self.key_provider = provider.name
+        data_key_cache.set(str(self.pk), data_key)
+
+    def get_data_key(self):
+        """Get the unwrapped data key, or None if the file is not encrypted"""
         if not self.encryption_key:
             return None
-        # Convert raw bytes back to url-safe base64
-        return base64.urlsafe_b64encode(self.encryption_key)
+        if not self.key_provider:
+            # Legacy rows hold the raw key
+            return bytes(self.encryption_key)
+
+        cache_key = str(self.pk)
+        data_key = data_key_cache.get(cache_key)
+        if data_key is None:
+            provider = get_key_provider()
+            if provider.name != self.key_provider:
+                raise KeyProviderError(
+                    f"File key was wrapped by '{self.key_provider}', configured provider is '{provider.name}'"
+                )
+            data_key = provider.unwrap_key(self.encryption_key, self.key_context)
+            data_key_cache.set(cache_key, data_key)
+        return data_key
 
     def encrypt_file_data(self, file_data):
-        """Encrypt file data using Fernet"""
-        try:
-            fernet_key = self.generate_fernet_key()
-            # Ensure we're using bytes
-            if isinstance(file_data, str):
-                file_data = file_data.encode('utf-8')
-
-            # Create Fernet cipher with properly formatted key
-            fernet = Fernet(fernet_key)
-            
-            # Encrypt the data
-            encrypted_data = fernet.encrypt(file_data)
-            
-            # Log for debugging
-            logger.info(f"First 32 bytes of encrypted data: {encrypted_data[:32]}")
-            logger.info(f"Encryption key (base64): {fernet_key.decode()}")
-            
-            return encrypted_data
-            
-        except Exception as e:
-            logger.error(f"Encryption error: {str(e)}", exc_info=True)
-            raise
+        """
+        Encrypt file data into the segmented AES-256-GCM format
+        Accepts bytes, an uploaded file or an iterable of chunks and
+        yields ciphertext chunks. The data is compressed first when
+        ``compression`` names a codec.
+        """
+        key = self.generate_encryption_key()
+        cipher = SegmentedFileEncryption(
+            key=key,
+            segment_size=getattr(settings, 'FILE_ENCRYPTION_SEGMENT_SIZE', None)
+        )
+        return cipher.encrypt_stream(
+            compress_stream(iter_chunks(file_data), self.compression),
+            engine=get_segment_engine()
+        )
 
     def decrypt_file_data(self):
         """
         Get decrypted file content
-        Returns bytes of decrypted content
+        Yields decrypted content chunk by chunk; legacy Fernet blobs are
+        detected from their header and decrypted in one piece
         """
-        if not self.encryption_key:
-            # If file is not encrypted, return raw content
-            with self.file.open('rb') as f:
-                return f.read()
-
-        # Read encrypted content
+        chunk_size = getattr(settings, 'FILE_ENCRYPTION_SEGMENT_SIZE', None)
         with self.file.open('rb') as f:
-            encrypted_data = f.read()
-
-        # Decrypt content
-        try:
-            # Create Fernet instance with proper key formatting
-            key = base64.urlsafe_b64encode(self.encryption_key)
-            # Ensure key is properly padded
-            if len(key) % 4:
-                key += b'=' * (4 - len(key) % 4)
-            
-            fernet = Fernet(key)
-            decrypted_data = fernet.decrypt(encrypted_data)
-            logger.info(f"Decrypted data: {decrypted_data[:32]}")
-            logger.info(f"Decryption key: {key.decode()}")
-            return decrypted_data
+            if not self.encryption_key:
+                # If file is not encrypted, return raw content
+                yield from iter_chunks(f, chunk_size)
+                return
+
+            head = f.read(len(SEGMENT_MAGIC))
+            try:
+                if head == SEGMENT_MAGIC:
+                    yield from decompress_stream(
+                        SegmentedFileEncryption.decrypt_stream(
+                            self.get_data_key(),
+                            iter_chunks(f, chunk_size, initial=head),
+                            engine=get_segment_engine()
+                        ),
+                        self.compression
+                    )
+                else:
+                    yield self._decrypt_fernet(head + f.read())
+            except (EncryptionError, KeyProviderError, InvalidToken, CompressionError) as e:
+                raise ValueError(f"Failed to decrypt file: {str(e)}")
+
+    def decrypt_file_range(self, start, end):
+        """
+        Get decrypted bytes start..end (inclusive)
+        Segmented blobs only read the segments covering the range; legacy
+        Fernet blobs have to be decrypted in full and sliced
+        """
+        if self.compression:
+            # Compressed offsets do not map onto segments, decompress up to the range end
+            yield from slice_chunks(self.decrypt_file_data(), start, end)
+            return
 
-        except Exception as e:
-            raise ValueError(f"Failed to decrypt file: {str(e)}")
+        with self.file.open('rb') as f:
+            if not self.encryption_key:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 64 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+                return
+
+            head = f.read(len(SEGMENT_MAGIC))
+            try:
+                if head == SEGMENT_MAGIC:
+                    yield from SegmentedFileEncryption.decrypt_range(
+                        self.get_data_key(), f, self.file.size, start, end,
+                        engine=get_segment_engine()
+                    )
+                else:
+                    yield self._decrypt_fernet(head + f.read())[start:end + 1]
+            except (EncryptionError, KeyProviderError, InvalidToken) as e:
+                raise ValueError(f"Failed to decrypt file: {str(e)}")
+
+    def _decrypt_fernet(self, encrypted_data):
+        """Decrypt a legacy whole-file Fernet token"""
+        # Create Fernet instance with proper key formatting
+        key = base64.urlsafe_b64encode(self.get_data_key())
+        # Ensure key is properly padded
+        if len(key) % 4:
+            key += b'=' * (4 - len(key) % 4)
+        return Fernet(key).decrypt(encrypted_data)
 
     def get_encryption_key_b64(self):
         """Get base64 encoded encryption key for client"""
@@ -130,7 +266,7 @@ class File(models.Model):
         try:
             # Return the key in standard base64 format (not url-safe)
             # because the client will handle the url-safe conversion
-            return base64.b64encode(self.encryption_key).decode('utf-8')
+            return base64.b64encode(self.get_data_key()).decode('utf-8')
         except Exception as e:
             logger.error(f"Error encoding encryption key: {str(e)}", exc_info=True)
             return None
@@ -138,13 +274,67 @@ class File(models.Model):
     
     def check_storage_quota(self):
         """Check if user has exceeded their storage quota"""
-        user_storage = File.objects.filter(owner=self.owner).aggregate(
-            total=models.Sum('file_size')
-        )['total'] or 0
-        
-        if user_storage + self.file_size > settings.USER_STORAGE_LIMIT:
+        usage = UserStorageUsage.for_user(self.owner)
+
+        if usage.used_bytes + usage.reserved_bytes + self.file_size > settings.USER_STORAGE_LIMIT:
             raise ValidationError("Storage quota exceeded")
 
+class FileBlob(models.Model):
+    """
+    Encrypted content shared by an owner's identical files
+    Keyed on the plaintext SHA-256, so deduplication never crosses owners.
+    ``ref_count`` counts the File rows pointing here; the blob and its
+    ciphertext are deleted with the last one.
+    """
+    id = models.BigAutoField(primary_key=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='file_blobs')
+    checksum = models.CharField(max_length=64)  # SHA-256 of the plaintext
+    file = models.FileField(upload_to='uploads/')
+    file_size = models.BigIntegerField(default=0)
+    mime_type = models.CharField(max_length=255, null=True, blank=True)
+    encryption_key = models.BinaryField(null=True, blank=True)  # Wrapped data key
+    key_provider = models.CharField(max_length=32, blank=True, default='')
+    compression = models.CharField(max_length=16, blank=True, default='')
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['owner', 'checksum']
+
+    @classmethod
+    def lookup(cls, owner, checksum):
+        """Blob the owner already holds for this content, if any"""
+        return cls.objects.filter(owner=owner, checksum=checksum.lower(), ref_count__gt=0).first()
+
+    @classmethod
+    def release(cls, blob_id):
+        """Drop one reference, deleting the blob when it was the last"""
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                return
+            if blob.ref_count <= 1:
+                blob.delete()
+            else:
+                cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+
+    def create_file(self, name, mime_type=None):
+        """New File for this content without receiving its bytes again"""
+        file_instance = File(
+            name=name,
+            owner_id=self.owner_id,
+            file=self.file.name,
+            file_size=self.file_size,
+            checksum=self.checksum,
+            mime_type=mime_type or self.mime_type,
+            encryption_key=self.encryption_key,
+            key_provider=self.key_provider,
+            compression=self.compression
+        )
+        file_instance.save()
+        return file_instance
+
+
 class FileAccess(models.Model):
     """Tracks individual file access events"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -398,4 +588,417 @@ class FileStatistics(models.Model):
                 'share_count': file.shares.count() + file.share_links.count(),
                 'last_accessed': timezone.now()
             }
-        )
\ No newline at end of file
+        )
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload
+    The client declares the total size up front and sends fixed-size chunks in
+    any order. Chunk size is a whole number of encryption segments, so every
+    chunk is encrypted on arrival with its own segment indices and the
+    finished blob is the header followed by the chunk ciphertexts in order.
+    Each stored chunk is authenticated segment by segment as it is written.
+    Completion joins the chunks in one pass that authenticates them again and
+    hashes their plaintext in order, giving the same content checksum as a
+    single-request upload.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('completing', 'Completing'),
+        ('completed', 'Completed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    mime_type = models.CharField(max_length=255, null=True, blank=True)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    encryption_key = models.BinaryField()  # Wrapped data key, copied to the File on completion
+    key_provider = models.CharField(max_length=32)
+    header = models.BinaryField()  # Segmented format header, fixes the nonce prefix for all chunks
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    file = models.ForeignKey(File, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    @property
+    def storage_prefix(self):
+        return f'upload_sessions/{self.id}'
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        """Plaintext size of chunk ``index``; only the last chunk may be short"""
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        return self.total_size - self.chunk_size * (self.total_chunks - 1)
+
+    def is_expired(self):
+        return timezone.now() >= self.expires_at
+
+    def touch(self):
+        """Push expiry out while the client is still making progress"""
+        ttl = getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 60 * 60)
+        self.expires_at = timezone.now() + timezone.timedelta(seconds=ttl)
+        UploadSession.objects.filter(pk=self.pk).update(expires_at=self.expires_at)
+
+    def initialize_encryption(self):
+        """Generate and wrap the data key and fix the segment layout for all chunks"""
+        provider = get_key_provider()
+        cipher = SegmentedFileEncryption(
+            segment_size=getattr(settings, 'FILE_ENCRYPTION_SEGMENT_SIZE', None)
+        )
+        if self.chunk_size % cipher.segment_size:
+            raise ValidationError("Chunk size must be a multiple of the encryption segment size")
+        self.encryption_key = provider.wrap_key(cipher.key, str(self.owner_id))
+        self.key_provider = provider.name
+        self.header = cipher.header
+        data_key_cache.set(f'upload-session:{self.pk}', cipher.key)
+
+    def get_cipher(self):
+        cache_key = f'upload-session:{self.pk}'
+        data_key = data_key_cache.get(cache_key)
+        if data_key is None:
+            data_key = get_key_provider().unwrap_key(self.encryption_key, str(self.owner_id))
+            data_key_cache.set(cache_key, data_key)
+        return SegmentedFileEncryption.from_header(data_key, bytes(self.header))
+
+    def store_chunk(self, index, data):
+        """Encrypt one chunk and store its ciphertext, replacing any earlier copy"""
+        cipher = self.get_cipher()
+        engine = get_segment_engine()
+        first_segment = index * (self.chunk_size // cipher.segment_size)
+        final = index == self.total_chunks - 1
+        ciphertext = cipher.encrypt_run(data, first_segment, final=final, engine=engine)
+
+        storage_name = default_storage.save(
+            f'{self.storage_prefix}/{index}.part',
+            ContentFile(ciphertext)
+        )
+        try:
+            checksum = self.verify_chunk(cipher, storage_name, first_segment, final, engine)
+            if checksum != hashlib.sha256(data).hexdigest():
+                raise ValidationError(f"Chunk {index} did not survive storage intact")
+
+            with transaction.atomic():
+                # Completion switches the status under this lock, so no chunk changes once it has started
+                if not UploadSession.objects.select_for_update().filter(pk=self.pk, status='active').exists():
+                    raise ValidationError("Upload session is no longer accepting chunks")
+                chunk, created = UploadChunk.objects.get_or_create(
+                    session=self,
+                    index=index,
+                    defaults={'size': len(data), 'storage_name': storage_name, 'checksum': checksum}
+                )
+                previous = None if created else chunk.storage_name
+                if not created:
+                    chunk.size = len(data)
+                    chunk.storage_name = storage_name
+                    chunk.checksum = checksum
+                    chunk.save(update_fields=['size', 'storage_name', 'checksum', 'received_at'])
+        except Exception:
+            default_storage.delete(storage_name)
+            raise
+
+        if previous and previous != storage_name:
+            default_storage.delete(previous)
+        return chunk
+
+    def verify_chunk(self, cipher, storage_name, first_segment, final, engine):
+        """Authenticate every segment of a stored chunk and return the SHA-256 of its plaintext"""
+        with default_storage.open(storage_name, 'rb') as f:
+            stored = f.read()
+        sha256 = hashlib.sha256()
+        for plaintext in self._decrypt_chunk(cipher, stored, first_segment, final, engine):
+            sha256.update(plaintext)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def _decrypt_chunk(cipher, stored, first_segment, final, engine):
+        """Yield the plaintext of a stored chunk's segments, authenticating each"""
+        count = max(1, -(-len(stored) // cipher.encrypted_segment_size))
+
+        def segments():
+            for offset in range(count):
+                start = offset * cipher.encrypted_segment_size
+                yield (
+                    first_segment + offset,
+                    stored[start:start + cipher.encrypted_segment_size],
+                    final and offset == count - 1
+                )
+
+        try:
+            yield from engine.map(cipher.decrypt_segment, segments())
+        except EncryptionError:
+            raise ValidationError("Stored chunk failed authentication")
+
+    def missing_chunks(self):
+        # Chunks stored before they were verified on arrival have no checksum and are sent again
+        received = set(self.chunks.exclude(checksum='').values_list('index', flat=True))
+        return [index for index in range(self.total_chunks) if index not in received]
+
+    def begin_completion(self):
+        """
+        Claim an active session for completion; returns whether this caller won
+        Only a short row lock is taken, assembling happens in complete().
+        """
+        with transaction.atomic():
+            claimed = UploadSession.objects.select_for_update().filter(
+                pk=self.pk, status='active'
+            ).update(status='completing')
+        if claimed:
+            self.status = 'completing'
+            self.touch()
+        return bool(claimed)
+
+    def _assembled_ciphertext(self, chunks, sha256):
+        """
+        Yield the header and the chunk ciphertexts in order
+        Each chunk is decrypted on the way through, feeding its plaintext to
+        ``sha256`` and checking it against the digest taken when it was stored.
+        """
+        cipher = self.get_cipher()
+        engine = get_segment_engine()
+        segments_per_chunk = self.chunk_size // cipher.segment_size
+        yield bytes(self.header)
+        for chunk in chunks:
+            with default_storage.open(chunk.storage_name, 'rb') as f:
+                stored = f.read()
+            chunk_sha256 = hashlib.sha256()
+            for plaintext in self._decrypt_chunk(
+                cipher, stored, chunk.index * segments_per_chunk, chunk.index == self.total_chunks - 1, engine
+            ):
+                sha256.update(plaintext)
+                chunk_sha256.update(plaintext)
+            if chunk_sha256.hexdigest() != chunk.checksum:
+                raise ValidationError(f"Chunk {chunk.index} changed since it was stored")
+            yield stored
+
+    def complete(self, name):
+        """
+        Join the chunks into the final blob and create its File row
+        Called after begin_completion(), outside any transaction, so the
+        decrypt-and-hash pass over the joined chunks holds no lock; on failure
+        the session goes back to accepting chunks.
+        """
+        chunks = list(self.chunks.order_by('index'))
+        try:
+            if [chunk.index for chunk in chunks] != list(range(self.total_chunks)):
+                raise ValidationError("Upload is incomplete")
+            if any(chunk.size != self.expected_chunk_size(chunk.index) for chunk in chunks):
+                raise ValidationError("Assembled file size does not match the declared size")
+            if not all(chunk.checksum for chunk in chunks):
+                raise ValidationError("Upload has unverified chunks, send them again")
+
+            file_instance = File(
+                name=self.file_name,
+                owner=self.owner,
+                mime_type=self.mime_type,
+                file_size=self.total_size,
+                encryption_key=self.encryption_key,
+                key_provider=self.key_provider
+            )
+            sha256 = hashlib.sha256()
+            name = default_storage.get_available_name(name)
+            try:
+                path = default_storage.save(name, StreamingContentFile(self._assembled_ciphertext(chunks, sha256), name))
+            except Exception:
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                raise
+            file_instance.file = path
+            try:
+                # Same plaintext SHA-256 as a single-request upload, so deduplication matches both
+                file_instance.checksum = sha256.hexdigest()
+                file_instance.save()
+            except Exception:
+                default_storage.delete(path)
+                raise
+        except Exception:
+            UploadSession.objects.filter(pk=self.pk, status='completing').update(status='active')
+            self.status = 'active'
+            raise
+
+        self.status = 'completed'
+        self.file = file_instance
+        self.save(update_fields=['status', 'file'])
+        self.delete_chunks()
+        # The new File row is in the ledger now, the reservation can go
+        UserStorageUsage.release(self.owner_id, self.total_size)
+        return file_instance
+
+    def discard(self):
+        """Abort the session, dropping its chunks and quota reservation"""
+        self.delete_chunks()
+        if self.status != 'completed':
+            UserStorageUsage.release(self.owner_id, self.total_size)
+        self.delete()
+
+    def delete_chunks(self):
+        """Remove stored chunk ciphertext and chunk rows"""
+        try:
+            _, names = default_storage.listdir(self.storage_prefix)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            default_storage.delete(f'{self.storage_prefix}/{name}')
+        self.chunks.all().delete()
+
+
+class UploadChunk(models.Model):
+    """A received chunk of an upload session"""
+    id = models.BigAutoField(primary_key=True)
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    storage_name = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=64, default='')  # SHA-256 of the plaintext, set once the stored chunk authenticated
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['session', 'index']
+        ordering = ['index']
+
+
+class UserStorageUsage(models.Model):
+    """
+    Per-user storage ledger
+    ``used_bytes`` tracks the total size of the user's files and is kept up to
+    date by File create/delete signals. ``reserved_bytes`` holds quota claimed
+    by uploads that are still in flight. Both are only changed with single
+    conditional UPDATE statements, so concurrent uploads cannot overshoot
+    the limit.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='storage_usage'
+    )
+    used_bytes = models.BigIntegerField(default=0)
+    reserved_bytes = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "User storage usage"
+
+    @classmethod
+    def for_user(cls, user):
+        """Ledger row for a user, backfilled from their files on first use"""
+        user_id = getattr(user, 'pk', user)
+        usage = cls.objects.filter(user_id=user_id).first()
+        if usage is None:
+            used = File.objects.filter(owner_id=user_id).aggregate(
+                total=models.Sum('file_size')
+            )['total'] or 0
+            usage, _ = cls.objects.get_or_create(user_id=user_id, defaults={'used_bytes': used})
+        return usage
+
+    @classmethod
+    def adjust(cls, user, delta):
+        """Add delta bytes to a user's used storage"""
+        user_id = getattr(user, 'pk', user)
+        updated = cls.objects.filter(user_id=user_id).update(
+            used_bytes=Greatest(F('used_bytes') + delta, 0),
+            updated_at=timezone.now()
+        )
+        if not updated:
+            # The backfill already reflects the change being recorded
+            cls.for_user(user_id)
+
+    @classmethod
+    def reserve(cls, user, size, limit=None):
+        """
+        Atomically claim quota for an upload before any bytes are written
+        Returns False when the reservation would exceed the limit.
+        """
+        limit = limit if limit is not None else settings.USER_STORAGE_LIMIT
+        usage = cls.for_user(user)
+        return cls.objects.filter(
+            pk=usage.pk,
+            used_bytes__lte=limit - size - F('reserved_bytes')
+        ).update(
+            reserved_bytes=F('reserved_bytes') + size,
+            updated_at=timezone.now()
+        ) == 1
+
+    @classmethod
+    def release(cls, user, size):
+        """Give back a reservation once the upload finished or failed"""
+        user_id = getattr(user, 'pk', user)
+        cls.objects.filter(user_id=user_id).update(
+            reserved_bytes=Greatest(F('reserved_bytes') - size, 0),
+            updated_at=timezone.now()
+        )
+
+    @classmethod
+    def reconcile(cls, user):
+        """Rebuild a user's ledger row from their File rows and open upload sessions"""
+        user_id = getattr(user, 'pk', user)
+        used = File.objects.filter(owner_id=user_id).aggregate(
+            total=models.Sum('file_size')
+        )['total'] or 0
+        reserved = UploadSession.objects.filter(
+            owner_id=user_id,
+            status='active',
+            expires_at__gt=timezone.now()
+        ).aggregate(total=models.Sum('total_size'))['total'] or 0
+        usage, _ = cls.objects.update_or_create(
+            user_id=user_id,
+            defaults={'used_bytes': used, 'reserved_bytes': reserved}
+        )
+        return usage
+
+    @property
+    def available_bytes(self):
+        return max(settings.USER_STORAGE_LIMIT - self.used_bytes - self.reserved_bytes, 0)
+
+
+class ChangeVersion(models.Model):
+    """
+    Change counter per principal
+    Bumped whenever anything a principal's file listings are built from
+    changes, so list endpoints can derive weak ETags without querying or
+    serializing the files. Keys are ``user:<id>`` for owners and
+    ``sub:<keycloak id>`` for share recipients. ``directory`` is bumped by
+    every completed sync of the local user directory (core.DirectoryUser),
+    ``users`` whenever a Django user is deleted.
+    """
+    USERS_KEY = 'users'
+
+    key = models.CharField(max_length=255, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def user_key(user):
+        return f'user:{getattr(user, "pk", user)}'
+
+    @staticmethod
+    def sub_key(keycloak_id):
+        return f'sub:{keycloak_id}'
+
+    @classmethod
+    def bump(cls, keys):
+        for key in set(keys):
+            updated = cls.objects.filter(key=key).update(
+                version=F('version') + 1,
+                updated_at=timezone.now()
+            )
+            if not updated:
+                _, created = cls.objects.get_or_create(key=key, defaults={'version': 1})
+                if not created:
+                    cls.objects.filter(key=key).update(version=F('version') + 1)
+
+    @classmethod
+    def current(cls, keys):
+        """Versions for the given keys, 0 for keys that never changed"""
+        versions = dict(cls.objects.filter(key__in=keys).values_list('key', 'version'))
+        return {key: versions.get(key, 0) for key in keys}
@@ -0,0 +1,49 @@
+import re
+
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.IGNORECASE)
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header cannot be served for the resource size"""
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Parse a single-range HTTP Range header
+    Returns (start, end) with end inclusive, or None when the whole resource
+    should be served (no header, malformed header or multiple ranges)
+    """
+    if not header:
+        return None
+
+    match = RANGE_RE.match(header)
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def is_initial_range(header):
+    """Whether a Range header, if any, asks for the start of the resource"""
+    if not header:
+        return True
+    match = RANGE_RE.match(header)
+    return not match or match.group(1) == '0' or not any(match.groups())
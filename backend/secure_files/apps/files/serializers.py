@@ -137,9 +137,10 @@ class FileSerializer(serializers.ModelSerializer):
 
     def get_encryption_data(self, obj):
         """Return encrypted data in base64 format"""
-        if obj.encryption_key:
+        key = obj.get_encryption_key_b64()
+        if key:
             return {
-                'key': base64.b64encode(obj.encryption_key).decode('utf-8'),
+                'key': key,
             }
         return None
 
@@ -0,0 +1,86 @@
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import File, FileBlob, FileShare, ShareLink, ChangeVersion, UserStorageUsage
+
+
+@receiver(post_save, sender=File)
+def record_file_created(sender, instance, created, **kwargs):
+    """Add new files to their owner's storage ledger"""
+    if created:
+        UserStorageUsage.adjust(instance.owner_id, instance.file_size)
+
+
+@receiver(post_delete, sender=File)
+def record_file_deleted(sender, instance, **kwargs):
+    """Remove deleted files from their owner's storage ledger"""
+    UserStorageUsage.adjust(instance.owner_id, -instance.file_size)
+
+
+@receiver(post_delete, sender=File)
+def release_file_blob(sender, instance, **kwargs):
+    """Drop the deleted file's reference to its shared blob"""
+    if instance.blob_id:
+        FileBlob.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=FileBlob)
+def delete_blob_content(sender, instance, **kwargs):
+    """Remove a blob's ciphertext once nothing references it"""
+    name = instance.file.name
+    if name:
+        transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def file_change_keys(file_instance):
+    """Change version keys of everyone who can list the file"""
+    keys = [ChangeVersion.user_key(file_instance.owner_id)]
+    keys += [
+        ChangeVersion.sub_key(keycloak_id)
+        for keycloak_id in FileShare.objects.filter(file_id=file_instance.pk).values_list('keycloak_id', flat=True)
+        if keycloak_id
+    ]
+    return keys
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def bump_file_listings(sender, instance, **kwargs):
+    """Invalidate list ETags of the file's owner and recipients"""
+    ChangeVersion.bump(file_change_keys(instance))
+
+
+def file_owner_key(file_id):
+    owner_id = File.objects.filter(pk=file_id).values_list('owner_id', flat=True).first()
+    return [ChangeVersion.user_key(owner_id)] if owner_id else []
+
+
+@receiver(post_save, sender=FileShare)
+@receiver(post_delete, sender=FileShare)
+def bump_share_listings(sender, instance, **kwargs):
+    """Sharing changes both the recipient's and the owner's listings"""
+    keys = file_owner_key(instance.file_id)
+    if instance.keycloak_id:
+        keys.append(ChangeVersion.sub_key(instance.keycloak_id))
+    ChangeVersion.bump(keys)
+
+
+@receiver(post_save, sender=ShareLink)
+def bump_share_link_created(sender, instance, created, **kwargs):
+    """New share links show up in the owner's share counts; access updates do not"""
+    if created:
+        ChangeVersion.bump(file_owner_key(instance.file_id))
+
+
+@receiver(post_delete, sender=ShareLink)
+def bump_share_link_deleted(sender, instance, **kwargs):
+    ChangeVersion.bump(file_owner_key(instance.file_id))
+
+
+@receiver(post_delete, sender=User)
+def bump_users_version(sender, instance, **kwargs):
+    """Tells every process's token cache to drop users it may still hold"""
+    ChangeVersion.bump([ChangeVersion.USERS_KEY])
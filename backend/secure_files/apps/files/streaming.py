@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_transfer_executor():
+    """Thread pool that runs blocking storage reads and decryption for async transfers"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'FILE_TRANSFER_THREADS', 32),
+                thread_name_prefix='file-transfer'
+            )
+    return _executor
+
+
+def is_asgi_request(request):
+    """Whether the request is served by the ASGI handler"""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def aiterate(iterable, batch_size=None):
+    """
+    Drive a blocking byte iterator from the transfer thread pool
+    Chunks are pulled in batches of about ``batch_size`` bytes per hop, so the
+    event loop never blocks on storage or crypto and a slow client holds no
+    thread between batches.
+    """
+    batch_size = batch_size or getattr(settings, 'FILE_TRANSFER_BATCH_SIZE', 1024 * 1024)
+    iterator = iter(iterable)
+    loop = asyncio.get_running_loop()
+    executor = get_transfer_executor()
+
+    def next_batch():
+        batch = []
+        size = 0
+        for chunk in iterator:
+            batch.append(chunk)
+            size += len(chunk)
+            if size >= batch_size:
+                break
+        return batch
+
+    try:
+        while True:
+            batch = await loop.run_in_executor(executor, next_batch)
+            if not batch:
+                break
+            for chunk in batch:
+                yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            await loop.run_in_executor(executor, close)
+
+
+def transfer_content(iterable, asynchronous=False, pacer=None):
+    """Response body for a blocking iterator, paced to ``pacer``'s byte rates if given"""
+    if asynchronous:
+        content = aiterate(iterable)
+        return pacer.apace(content) if pacer else content
+    return pacer.pace(iterable) if pacer else iterable
+
+
+def streaming_content(request, iterable, pacer=None):
+    """
+    Response body for a blocking iterator
+    Under ASGI Django would otherwise read a sync iterator into a list
+    before sending anything.
+    """
+    return transfer_content(iterable, is_asgi_request(request), pacer)
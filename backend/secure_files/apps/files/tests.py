@@ -0,0 +1,404 @@
+import os
+import re
+import base64
+import hashlib
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rest_framework.test import APIClient
+
+from .models import File, FileAccess, FileBlob, UploadChunk, UploadSession, UserStorageUsage
+from .ranges import RangeNotSatisfiable, is_initial_range, parse_range_header
+
+MEDIA_ROOT = tempfile.mkdtemp()
+NGINX_CONF = os.path.join(os.path.dirname(settings.BASE_DIR), 'nginx', 'nginx.conf')
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    FILE_MASTER_KEY=base64.b64encode(os.urandom(32)).decode('ascii'),
+    RATE_LIMIT_POLICIES={},
+)
+class FileTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner', email='owner@example.com')
+        self.user.token = {'sub': 'owner-sub', 'realm_access': {'roles': ['user']}}
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, data, name='data.bin'):
+        response = self.client.post(
+            '/api/files/upload/',
+            {'file': SimpleUploadedFile(name, data)},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return File.objects.get(pk=response.data['id'])
+
+
+class EncryptedDownloadOffloadTests(FileTestCase):
+    def test_offloaded_response_carries_client_headers(self):
+        file_instance = self.upload(os.urandom(4096))
+
+        with override_settings(FILE_DOWNLOAD_OFFLOAD=True):
+            response = self.client.get(f'/api/files/{file_instance.id}/content/?mode=encrypted')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected-media/'))
+        self.assertEqual(base64.b64decode(response['X-Encryption-Key']), file_instance.get_data_key())
+        self.assertIn('X-Encryption-Key', response['Access-Control-Expose-Headers'])
+        self.assertTrue(response['ETag'])
+
+    def test_nginx_relays_offloaded_headers(self):
+        if not os.path.exists(NGINX_CONF):
+            self.skipTest('nginx configuration is not part of this checkout')
+        with open(NGINX_CONF) as f:
+            location = re.search(r'location /protected-media/ \{(.*?)\}', f.read(), re.S).group(1)
+
+        # nginx drops upstream headers on X-Accel-Redirect unless they are added back
+        for header in ['X-Encryption-Key', 'Access-Control-Expose-Headers', 'ETag']:
+            variable = '$upstream_http_' + header.lower().replace('-', '_')
+            self.assertRegex(location, rf'add_header {re.escape(header)} {re.escape(variable)} always;')
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header(' BYTES = 10 - 20 ', 1000), (10, 20))
+
+    def test_ranges_are_clamped_to_the_resource(self):
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), (0, 999))
+
+    def test_whole_resource_is_served_for_unusable_headers(self):
+        for header in [None, '', 'bytes=-', 'bytes=0-1,5-6', 'items=0-1', 'bytes=20-10']:
+            self.assertIsNone(parse_range_header(header, 1000), header)
+
+    def test_unsatisfiable_ranges(self):
+        for header, size in [('bytes=1000-', 1000), ('bytes=-0', 1000), ('bytes=0-', 0), ('bytes=-5', 0)]:
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range_header(header, size)
+
+    def test_initial_range(self):
+        self.assertTrue(is_initial_range(None))
+        self.assertTrue(is_initial_range('bytes=0-99'))
+        self.assertTrue(is_initial_range('bytes=0-1,5-6'))
+        self.assertFalse(is_initial_range('bytes=100-'))
+        self.assertFalse(is_initial_range('bytes=-100'))
+
+
+class RangeDownloadTests(FileTestCase):
+    def test_partial_content(self):
+        data = os.urandom(200 * 1024)
+        file_instance = self.upload(data)
+
+        response = self.client.get(f'/api/files/{file_instance.id}/content/', HTTP_RANGE='bytes=70000-140000')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 70000-140000/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[70000:140001])
+
+    def test_unsatisfiable_range(self):
+        file_instance = self.upload(os.urandom(1024))
+
+        response = self.client.get(f'/api/files/{file_instance.id}/content/', HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+
+@override_settings(UPLOAD_SESSION_CHUNK_SIZE=128 * 1024, FILE_ENCRYPTION_SEGMENT_SIZE=64 * 1024)
+class UploadSessionTests(FileTestCase):
+    def start_session(self, data):
+        response = self.client.post(
+            '/api/files/upload-sessions/',
+            {'file_name': 'large.bin', 'total_size': len(data)},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data
+
+    def put_chunk(self, session, index, data):
+        chunk_size = session['chunk_size']
+        return self.client.put(
+            f"/api/files/upload-sessions/{session['id']}/chunks/{index}/",
+            data[index * chunk_size:(index + 1) * chunk_size],
+            content_type='application/octet-stream'
+        )
+
+    def upload_in_session(self, data):
+        session = self.start_session(data)
+        for index in reversed(range(session['total_chunks'])):
+            self.assertEqual(self.put_chunk(session, index, data).status_code, 200)
+        response = self.client.post(f"/api/files/upload-sessions/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(UploadSession.objects.get(pk=session['id']).status, 'completed')
+        return File.objects.get(pk=response.data['id'])
+
+    def test_out_of_order_chunks_complete(self):
+        data = os.urandom(300 * 1024)
+        file_instance = self.upload_in_session(data)
+
+        self.assertEqual(b''.join(file_instance.decrypt_file_data()), data)
+        self.assertEqual(file_instance.checksum, hashlib.sha256(data).hexdigest())
+
+    @override_settings(FILE_DEDUPLICATION=True)
+    def test_session_and_multipart_uploads_share_a_blob(self):
+        data = os.urandom(300 * 1024)
+        by_session = self.upload_in_session(data)
+        by_request = self.upload(data)
+
+        self.assertEqual(by_session.checksum, by_request.checksum)
+        self.assertEqual(by_session.blob_id, by_request.blob_id)
+        response = self.client.get(f'/api/files/blobs/{hashlib.sha256(data).hexdigest()}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_session_holds_its_reservation_until_completion(self):
+        data = os.urandom(200 * 1024)
+        session = self.start_session(data)
+        usage = UserStorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.used_bytes, usage.reserved_bytes), (0, len(data)))
+
+        for index in range(session['total_chunks']):
+            self.put_chunk(session, index, data)
+        self.client.post(f"/api/files/upload-sessions/{session['id']}/complete/")
+        usage.refresh_from_db()
+        self.assertEqual((usage.used_bytes, usage.reserved_bytes), (len(data), 0))
+
+    def test_chunk_corrupted_after_storing_fails_completion(self):
+        data = os.urandom(200 * 1024)
+        session = self.start_session(data)
+        for index in range(session['total_chunks']):
+            self.put_chunk(session, index, data)
+        chunk = UploadChunk.objects.get(session_id=session['id'], index=0)
+        with default_storage.open(chunk.storage_name, 'rb') as f:
+            stored = bytearray(f.read())
+        stored[100] ^= 1
+        default_storage.delete(chunk.storage_name)
+        default_storage.save(chunk.storage_name, ContentFile(bytes(stored)))
+
+        response = self.client.post(f"/api/files/upload-sessions/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get(pk=session['id']).status, 'active')
+        self.assertFalse(File.objects.exists())
+
+    def test_chunks_are_rejected_once_completion_started(self):
+        data = os.urandom(200 * 1024)
+        session = self.start_session(data)
+        for index in range(session['total_chunks']):
+            self.put_chunk(session, index, data)
+
+        self.assertTrue(UploadSession.objects.get(pk=session['id']).begin_completion())
+        self.assertEqual(self.put_chunk(session, 0, data).status_code, 404)
+        self.assertFalse(UploadSession.objects.get(pk=session['id']).begin_completion())
+
+    def test_failed_completion_reopens_session(self):
+        data = os.urandom(200 * 1024)
+        session = self.start_session(data)
+        for index in range(session['total_chunks']):
+            self.put_chunk(session, index, data)
+        UploadChunk.objects.filter(session_id=session['id'], index=1).update(checksum='')
+
+        upload = UploadSession.objects.get(pk=session['id'])
+        self.assertTrue(upload.begin_completion())
+        with self.assertRaises(ValidationError):
+            upload.complete('uploads/large.bin')
+        self.assertEqual(UploadSession.objects.get(pk=session['id']).status, 'active')
+
+
+class StorageLedgerTests(FileTestCase):
+    def usage(self):
+        return UserStorageUsage.objects.values_list('used_bytes', 'reserved_bytes').get(user=self.user)
+
+    def test_reservations_respect_the_limit(self):
+        self.assertTrue(UserStorageUsage.reserve(self.user, 600, limit=1000))
+        self.assertTrue(UserStorageUsage.reserve(self.user, 400, limit=1000))
+        self.assertFalse(UserStorageUsage.reserve(self.user, 1, limit=1000))
+        self.assertEqual(self.usage(), (0, 1000))
+
+        UserStorageUsage.release(self.user, 600)
+        self.assertTrue(UserStorageUsage.reserve(self.user, 600, limit=1000))
+        UserStorageUsage.release(self.user, 5000)
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_used_bytes_count_against_reservations(self):
+        UserStorageUsage.for_user(self.user)
+        UserStorageUsage.adjust(self.user, 900)
+        self.assertFalse(UserStorageUsage.reserve(self.user, 200, limit=1000))
+        self.assertTrue(UserStorageUsage.reserve(self.user, 100, limit=1000))
+
+    def test_upload_is_recorded_and_its_reservation_released(self):
+        file_instance = self.upload(os.urandom(4096))
+        self.assertEqual(self.usage(), (4096, 0))
+
+        file_instance.delete()
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_upload_over_quota_is_refused(self):
+        with override_settings(USER_STORAGE_LIMIT=1024):
+            response = self.client.post(
+                '/api/files/upload/',
+                {'file': SimpleUploadedFile('data.bin', os.urandom(4096))},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_ledger_is_backfilled_and_reconciled_from_files(self):
+        self.upload(os.urandom(4096))
+        UserStorageUsage.objects.all().delete()
+        self.assertEqual(UserStorageUsage.for_user(self.user).used_bytes, 4096)
+
+        UserStorageUsage.objects.filter(user=self.user).update(used_bytes=1, reserved_bytes=99)
+        UserStorageUsage.reconcile(self.user)
+        self.assertEqual(self.usage(), (4096, 0))
+
+
+@override_settings(FILE_DEDUPLICATION=True)
+class BlobDeduplicationTests(FileTestCase):
+    def upload(self, data, name='data.bin'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return super().upload(data, name)
+
+    def delete(self, file_instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            file_instance.delete()
+
+    def stored_names(self):
+        if not default_storage.exists('uploads'):
+            return set()
+        return set(default_storage.listdir('uploads')[1])
+
+    def test_identical_uploads_share_one_blob(self):
+        data = os.urandom(4096)
+        stored_before = self.stored_names()
+        first = self.upload(data, 'first.bin')
+        second = self.upload(data, 'second.bin')
+
+        blob = FileBlob.objects.get()
+        self.assertEqual((first.blob_id, second.blob_id), (blob.pk, blob.pk))
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(self.stored_names() - stored_before, {os.path.basename(blob.file.name)})
+        self.assertEqual(b''.join(second.decrypt_file_data()), data)
+
+    def test_last_reference_deletes_the_blob_and_its_content(self):
+        data = os.urandom(4096)
+        first = self.upload(data, 'first.bin')
+        second = self.upload(data, 'second.bin')
+        name = first.file.name
+
+        self.delete(first)
+        self.assertEqual(FileBlob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(b''.join(File.objects.get(pk=second.pk).decrypt_file_data()), data)
+
+        self.delete(second)
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_file_created_from_a_stored_blob_takes_a_reference(self):
+        data = os.urandom(4096)
+        original = self.upload(data)
+        checksum = hashlib.sha256(data).hexdigest()
+
+        response = self.client.post(f'/api/files/blobs/{checksum}/', {'name': 'copy.bin'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        copy = File.objects.get(pk=response.data['id'])
+        self.assertEqual(copy.blob_id, original.blob_id)
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        self.assertEqual(b''.join(copy.decrypt_file_data()), data)
+
+        self.delete(original)
+        self.delete(copy)
+        response = self.client.post(f'/api/files/blobs/{checksum}/', {'name': 'copy.bin'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_blobs_are_not_shared_between_owners(self):
+        data = os.urandom(4096)
+        mine = self.upload(data)
+        other = User.objects.create(username='other')
+        other.token = {'sub': 'other-sub', 'realm_access': {'roles': ['user']}}
+        self.client.force_authenticate(user=other)
+        theirs = self.upload(data)
+
+        self.assertNotEqual(mine.blob_id, theirs.blob_id)
+        self.assertEqual(FileBlob.objects.count(), 2)
+        response = self.client.get(f'/api/files/blobs/{hashlib.sha256(data).hexdigest()}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_releasing_a_missing_blob_is_a_no_op(self):
+        FileBlob.release(12345)
+        self.assertFalse(FileBlob.objects.exists())
+
+
+class ConditionalRequestTests(FileTestCase):
+    def test_matching_etag_is_not_modified(self):
+        file_instance = self.upload(os.urandom(4096))
+        url = f'/api/files/{file_instance.id}/content/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(FileAccess.objects.count(), 1)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertFalse(response.content)
+        self.assertEqual(FileAccess.objects.count(), 1)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_unmodified_since_upload(self):
+        file_instance = self.upload(os.urandom(4096))
+        url = f'/api/files/{file_instance.id}/content/'
+        last_modified = self.client.get(url)['Last-Modified']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 1970 00:00:00 GMT').status_code, 200)
+
+    def test_plaintext_and_ciphertext_have_distinct_etags(self):
+        file_instance = self.upload(os.urandom(4096))
+        url = f'/api/files/{file_instance.id}/content/'
+        plain = self.client.get(url)['ETag']
+        encrypted = self.client.get(url + '?mode=encrypted')['ETag']
+
+        self.assertNotEqual(plain, encrypted)
+        self.assertEqual(self.client.get(url + '?mode=encrypted', HTTP_IF_NONE_MATCH=plain).status_code, 200)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        data = os.urandom(4096)
+        file_instance = self.upload(data)
+        url = f'/api/files/{file_instance.id}/content/'
+        etag = self.client.get(url)['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_listing_is_not_modified_until_a_file_changes(self):
+        self.upload(os.urandom(1024))
+        etag = self.client.get('/api/files/')['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        self.assertEqual(self.client.get('/api/files/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/files/?search=x', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.upload(os.urandom(1024), 'second.bin')
+        response = self.client.get('/api/files/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
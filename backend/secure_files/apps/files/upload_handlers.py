@@ -0,0 +1,158 @@
+import os
+import uuid
+import hashlib
+import logging
+
+import magic
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+from secure_files.apps.core.encryption import SegmentedFileEncryption
+
+from .compression import select_codec, compressor, CODEC_NONE
+
+logger = logging.getLogger(__name__)
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """
+    Upload whose ciphertext has already been written to its final storage location
+    Carries the raw data key and plaintext metadata gathered while streaming;
+    the view wraps the key once the owner is known.
+    """
+
+    def __init__(self, storage_name, data_key, name, content_type, size, charset,
+                 checksum, detected_mime_type, compression=CODEC_NONE, discarded=False):
+        super().__init__(None, name, content_type, size, charset)
+        self.storage_name = storage_name
+        self.data_key = data_key
+        self.checksum = checksum
+        self.detected_mime_type = detected_mime_type
+        self.compression = compression
+        self.discarded = discarded
+
+    def open(self, mode=None):
+        raise ValueError("Encrypted uploads cannot be reopened as plaintext")
+
+    def delete_blob(self):
+        """Remove the stored ciphertext, e.g. when the upload is rejected"""
+        if self.storage_name and default_storage.exists(self.storage_name):
+            default_storage.delete(self.storage_name)
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Encrypts and hashes each multipart chunk as it arrives
+    Ciphertext is written straight to the file's final storage location, so
+    plaintext never touches memory beyond one chunk or a temporary file.
+    Uploads larger than MAX_UPLOAD_SIZE keep being drained from the socket
+    but are no longer written, and are reported back as discarded.
+    Data is held back until the MIME type has been sniffed, which decides
+    whether it is compressed before encryption.
+    """
+    SNIFF_SIZE = 2048
+    FIELD_NAME = 'file'
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.field_name != self.FIELD_NAME:
+            raise SkipFile()
+
+        self.max_size = getattr(settings, 'MAX_UPLOAD_SIZE', None)
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.head = b''
+        self.pending = []
+        self.detected_mime_type = None
+        self.compression = None
+        self.compressor = None
+        self.discarded = False
+
+        extension = self.file_name.split('.')[-1] if '.' in self.file_name else ''
+        self.storage_name = default_storage.get_available_name(f'uploads/{uuid.uuid4()}.{extension}')
+        cipher = SegmentedFileEncryption(
+            segment_size=getattr(settings, 'FILE_ENCRYPTION_SEGMENT_SIZE', None)
+        )
+        self.data_key = cipher.key
+        self.encryptor = cipher.encryptor()
+        self.destination = self._open_destination(self.storage_name)
+
+    def _open_destination(self, name):
+        try:
+            path = default_storage.path(name)
+        except NotImplementedError:
+            # Remote storage backends provide their own writable file objects
+            return default_storage.open(name, 'wb')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, 'xb')
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.discarded:
+            return None
+
+        if self.max_size and self.size > self.max_size:
+            logger.warning(f"Upload exceeds {self.max_size} bytes, discarding {self.storage_name}")
+            self._discard()
+            return None
+
+        self.hasher.update(raw_data)
+        if self.compression is None:
+            self.head += raw_data[:self.SNIFF_SIZE - len(self.head)]
+            self.pending.append(raw_data)
+            if len(self.head) >= self.SNIFF_SIZE:
+                self._start_compression()
+            return None
+
+        self._write(raw_data)
+        return None
+
+    def _start_compression(self):
+        self.detected_mime_type = magic.from_buffer(self.head, mime=True) if self.head else None
+        self.compression = select_codec(self.detected_mime_type)
+        if self.compression:
+            self.compressor = compressor(self.compression)
+        pending, self.pending = self.pending, []
+        for raw_data in pending:
+            self._write(raw_data)
+
+    def _write(self, raw_data):
+        if self.compressor:
+            raw_data = self.compressor.compress(raw_data)
+        if raw_data:
+            self.destination.write(self.encryptor.update(raw_data))
+
+    def file_complete(self, file_size):
+        if not self.discarded:
+            if self.compression is None:
+                self._start_compression()
+            if self.compressor:
+                self.destination.write(self.encryptor.update(self.compressor.flush()))
+            self.destination.write(self.encryptor.finalize())
+            self.destination.close()
+
+        return EncryptedUploadedFile(
+            storage_name=None if self.discarded else self.storage_name,
+            data_key=self.data_key,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=self.size,
+            charset=self.charset,
+            checksum=self.hasher.hexdigest(),
+            detected_mime_type=self.detected_mime_type,
+            compression=self.compression or CODEC_NONE,
+            discarded=self.discarded
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'destination') and not self.discarded:
+            self._discard()
+
+    def _discard(self):
+        self.discarded = True
+        self.destination.close()
+        if default_storage.exists(self.storage_name):
+            default_storage.delete(self.storage_name)
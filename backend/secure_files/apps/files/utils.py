@@ -1,5 +1,9 @@
 import hashlib
 
+from django.core.files.base import File as DjangoFile
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
 def check_file_integrity(file_data, stored_checksum):
     """
     Verifies file integrity using SHA-256
@@ -27,4 +31,90 @@ def format_file_size(size):
         if size < 1024.0:
             return f"{size:.1f} {unit}"
         size /= 1024.0
-    return f"{size:.1f} PB"
\ No newline at end of file
+    return f"{size:.1f} PB"
+
+def iter_chunks(file_data, chunk_size=None, initial=b''):
+    """
+    Yield file data as a sequence of byte chunks
+    Accepts bytes, str, Django files, file-like objects or iterables of bytes
+    """
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    if initial:
+        yield initial
+
+    if isinstance(file_data, str):
+        file_data = file_data.encode('utf-8')
+    if isinstance(file_data, (bytes, bytearray, memoryview)):
+        view = memoryview(file_data)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+    elif hasattr(file_data, 'read'):
+        # Read from the current position rather than rewinding like chunks()
+        yield from iter(lambda: file_data.read(chunk_size), b'')
+    else:
+        yield from file_data
+
+def slice_chunks(chunks, start, end):
+    """
+    Yield bytes start..end (inclusive) of a stream of byte chunks
+    Stops reading the stream once the end of the range is reached
+    """
+    offset = 0
+    for chunk in chunks:
+        chunk_end = offset + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(start - offset, 0):end + 1 - offset]
+        offset = chunk_end
+        if offset > end:
+            break
+
+class StreamingContentFile(DjangoFile):
+    """
+    Read-once file object over an iterator of byte chunks
+    Lets Storage.save() consume a generator without materialising it
+    """
+
+    def __init__(self, chunks, name=None):
+        super().__init__(None, name)
+        self._iterator = iter(chunks)
+        self._buffer = b''
+        self._consumed = False
+
+    def __bool__(self):
+        return True
+
+    def chunks(self, chunk_size=None):
+        self._consumed = True
+        if self._buffer:
+            buffer, self._buffer = self._buffer, b''
+            yield buffer
+        for chunk in self._iterator:
+            if chunk:
+                yield bytes(chunk)
+
+    def read(self, size=-1):
+        self._consumed = True
+        if size is None or size < 0:
+            data = self._buffer + b''.join(bytes(chunk) for chunk in self._iterator)
+            self._buffer = b''
+            return data
+
+        while len(self._buffer) < size:
+            chunk = next(self._iterator, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def seek(self, offset, whence=0):
+        # Storage backends rewind before reading; only that is supported
+        if offset != 0 or whence != 0 or self._consumed:
+            raise OSError("StreamingContentFile is not seekable")
+        return 0
+
+    def tell(self):
+        return 0
+
+    def close(self):
+        pass
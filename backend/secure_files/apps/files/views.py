@@ -14,21 +14,34 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 
 from django.conf import settings
 from django.core.cache import cache
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.db.models import F
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
 from django.db.models import Sum
 from django.db.models import Q
 from django.db.models import Sum
+from django.db import transaction
+from django.core.exceptions import ValidationError
 
-from .models import File, FileShare, ShareLink, FileAccess, FileStatistics
+from .models import (
+    File, FileBlob, FileShare, ShareLink, FileAccess, FileStatistics, UploadSession, UserStorageUsage,
+    ChangeVersion,
+)
+from .ranges import RangeNotSatisfiable, is_initial_range
+from .conditional import listing_etag, evaluate_preconditions, set_validators
+from .downloads import DownloadEngine
+from .archives import stream_zip
+from .streaming import is_asgi_request, streaming_content
+from .upload_handlers import EncryptingUploadHandler, EncryptedUploadedFile
 from .serializers import (
     FileSerializer, FileShareSerializer, ShareLinkSerializer,
 )
-from ..core.keycloak_admin import KeycloakAdmin
+from ..core.models import DirectoryUser
+from ..core.keycloak_admin import KeycloakUnavailable
+from ..core.directory import get_user_by_email
 from secure_files.apps.core.permissions import HasKeycloakRole
+from secure_files.throttling import EgressPacer
 
 logger = logging.getLogger(__name__)
 
@@ -144,11 +157,33 @@ class FileViewSet(viewsets.ModelViewSet):
             return queryset.order_by(sort_field)
         return queryset.order_by(f'-{sort_field}')
 
+    def listing_etag(self, include_owned=True):
+        """
+        Weak ETag for the current user's file listing
+        Built from change versions only, so a match skips querying and
+        serializing the files. Admins list every file and relative date
+        filters move with the clock, so neither is cached.
+        """
+        token = getattr(self.request.user, 'token', {}) or {}
+        roles = token.get('realm_access', {}).get('roles', [])
+        if 'admin' in roles or self.request.query_params.get('date_range', 'all') != 'all':
+            return None
+
+        keys = [ChangeVersion.user_key(self.request.user)] if include_owned else []
+        if token.get('sub'):
+            keys.append(ChangeVersion.sub_key(token['sub']))
+        return listing_etag(self.request, ChangeVersion.current(keys), scope=','.join(sorted(roles)))
+
     def list(self, request, *args, **kwargs):
         """Enhanced list method with filtering, searching, and sorting"""
         try:
             logger.info(f"List request from user: {request.user.username}")
-            
+
+            etag = self.listing_etag()
+            not_modified = evaluate_preconditions(request, etag) if etag else None
+            if not_modified is not None:
+                return not_modified
+
             # Get base queryset
             queryset = self.get_queryset()
             if queryset is None:
@@ -176,10 +211,12 @@ class FileViewSet(viewsets.ModelViewSet):
             page = self.paginate_queryset(queryset)
             if page is not None:
                 serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
+                response = self.get_paginated_response(serializer.data)
+            else:
+                serializer = self.get_serializer(queryset, many=True)
+                response = Response(serializer.data)
 
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return set_validators(response, etag) if etag else response
 
         except Exception as e:
             logger.exception("Error in file list")  # This logs the full traceback
@@ -249,7 +286,7 @@ class FileViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            keycloak_user = KeycloakAdmin().get_user_by_email(shared_with_email)
+            keycloak_user = get_user_by_email(shared_with_email)
             if not keycloak_user:
                 return Response(
                     {'error': f'No user found with email {shared_with_email}'},
@@ -282,6 +319,13 @@ class FileViewSet(viewsets.ModelViewSet):
             serializer = FileShareSerializer(share)
             return Response(serializer.data)
 
+        except KeycloakUnavailable as e:
+            logger.error(f"Keycloak unavailable while sharing file: {str(e)}")
+            return Response(
+                {'error': 'User directory is temporarily unavailable'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.KEYCLOAK_BREAKER_RESET_TIMEOUT)}
+            )
         except Exception as e:
             logger.error(f"Error sharing file: {str(e)}")
             return Response(
@@ -289,8 +333,30 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def initialize_request(self, request, *args, **kwargs):
+        drf_request = super().initialize_request(request, *args, **kwargs)
+        if self.action == 'upload_file':
+            # Must be in place before anything touches the request body
+            request.upload_handlers = [EncryptingUploadHandler(request)]
+        return drf_request
+
     @action(detail=False, methods=['post'], url_path='upload')
     def upload_file(self, request):
+        file_obj = None
+        # Claim quota before the upload handler writes anything. The request
+        # body bounds the file size; uploads over MAX_UPLOAD_SIZE are discarded
+        # while parsing, so that caps the claim.
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        reserved = min(content_length or settings.MAX_UPLOAD_SIZE, settings.MAX_UPLOAD_SIZE)
+        if not UserStorageUsage.reserve(request.user, reserved):
+            return Response(
+                {'error': 'Storage quota exceeded'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         try:
             file_obj = request.FILES.get('file')
             if not file_obj:
@@ -301,87 +367,356 @@ class FileViewSet(viewsets.ModelViewSet):
 
             # Check file size
             if file_obj.size > settings.MAX_UPLOAD_SIZE:
+                self.discard_upload(file_obj)
                 return Response({
                     'error': f'File size exceeds limit of {settings.MAX_UPLOAD_SIZE / (1024*1024):.1f} MB'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Check quota
-            used_storage = File.objects.filter(owner=request.user).aggregate(
-                total=Sum('file_size'))['total'] or 0
-            if hasattr(settings, 'USER_STORAGE_LIMIT') and used_storage + file_obj.size > settings.USER_STORAGE_LIMIT:
+            original_filename = request.POST.get('original_filename') or file_obj.name
+
+            # Create file instance
+            file_instance = File(
+                name=original_filename,
+                owner=request.user
+            )
+
+            # Already encrypted and stored while the request body was parsed
+            file_instance.file = file_obj.storage_name
+            file_instance.file_size = file_obj.size
+            file_instance.checksum = file_obj.checksum
+            file_instance.mime_type = request.POST.get('mime_type') or file_obj.detected_mime_type
+            file_instance.compression = file_obj.compression
+            file_instance.wrap_data_key(file_obj.data_key)
+            file_instance.save()
+
+            serializer = self.get_serializer(file_instance)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        except Exception as e:
+            logger.error(f"Upload error: {str(e)}")
+            self.discard_upload(file_obj)
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        finally:
+            # Saved files are accounted for in used_bytes by now
+            UserStorageUsage.release(request.user, reserved)
+
+    def discard_upload(self, file_obj):
+        """Remove ciphertext already written by the streaming upload handler"""
+        if isinstance(file_obj, EncryptedUploadedFile):
+            file_obj.delete_blob()
+
+    def get_upload_session(self, session_id):
+        """Active, unexpired upload session owned by the current user"""
+        session = UploadSession.objects.filter(
+            id=session_id,
+            owner=self.request.user,
+            status='active'
+        ).first()
+        if session and session.is_expired():
+            session.discard()
+            return None
+        return session
+
+    def upload_session_data(self, session):
+        missing = session.missing_chunks()
+        return {
+            'id': str(session.id),
+            'file_name': session.file_name,
+            'total_size': session.total_size,
+            'chunk_size': session.chunk_size,
+            'total_chunks': session.total_chunks,
+            'received_chunks': session.total_chunks - len(missing),
+            'missing_chunks': missing,
+            'expires_at': session.expires_at,
+        }
+
+    @action(detail=False, methods=['post'], url_path='upload-sessions')
+    def create_upload_session(self, request):
+        """Start a resumable chunked upload"""
+        try:
+            file_name = request.data.get('file_name')
+            try:
+                total_size = int(request.data.get('total_size'))
+            except (TypeError, ValueError):
+                total_size = -1
+            if not file_name or total_size < 0:
+                return Response(
+                    {'error': 'file_name and total_size are required'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if total_size > settings.UPLOAD_SESSION_MAX_SIZE:
+                return Response({
+                    'error': f'File size exceeds limit of {settings.UPLOAD_SESSION_MAX_SIZE / (1024*1024):.1f} MB'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # Held until the session completes, is aborted or expires
+            if not UserStorageUsage.reserve(request.user, total_size):
                 return Response(
                     {'error': 'Storage quota exceeded'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Read file content
-            file_content = file_obj.read()
-            file_obj.seek(0)
+            session = UploadSession(
+                owner=request.user,
+                file_name=file_name,
+                mime_type=request.data.get('mime_type') or None,
+                total_size=total_size,
+                chunk_size=settings.UPLOAD_SESSION_CHUNK_SIZE,
+                expires_at=timezone.now() + timezone.timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+            )
+            try:
+                session.initialize_encryption()
+                session.save()
+            except Exception:
+                UserStorageUsage.release(request.user, total_size)
+                raise
 
-            original_filename = request.POST.get('original_filename') or file_obj.name
-            # Get MIME type
-            mime_type = request.POST.get('mime_type') or magic.from_buffer(file_content[:1024], mime=True)
+            return Response(self.upload_session_data(session), status=status.HTTP_201_CREATED)
 
-            # Generate unique filename
-            file_extension = file_obj.name.split('.')[-1] if '.' in file_obj.name else ''
-            unique_filename = f"{uuid.uuid4()}.{file_extension}"
+        except Exception as e:
+            logger.error(f"Upload session error: {str(e)}")
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-            # Create file instance
-            file_instance = File(
-                name=original_filename,
-                owner=request.user,
-                mime_type=mime_type,
-                file_size=file_obj.size
+    @action(detail=False, methods=['get', 'delete'], url_path=r'upload-sessions/(?P<session_id>[0-9a-f-]+)')
+    def upload_session(self, request, session_id=None):
+        """Query which chunks have been received, or abort the upload"""
+        session = self.get_upload_session(session_id)
+        if not session:
+            return Response(
+                {'error': 'Upload session not found or expired'},
+                status=status.HTTP_404_NOT_FOUND
             )
 
-            # Calculate checksum before encryption
-            file_instance.checksum = file_instance.calculate_checksum(file_content)
+        if request.method == 'DELETE':
+            session.discard()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        return Response(self.upload_session_data(session))
+
+    @action(detail=False, methods=['put'], url_path=r'upload-sessions/(?P<session_id>[0-9a-f-]+)/chunks/(?P<index>\d+)')
+    def upload_chunk(self, request, session_id=None, index=None):
+        """Upload one chunk as the raw request body; chunks may arrive in any order"""
+        try:
+            session = self.get_upload_session(session_id)
+            if not session:
+                return Response(
+                    {'error': 'Upload session not found or expired'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            index = int(index)
+            if index >= session.total_chunks:
+                return Response(
+                    {'error': f'Chunk index must be below {session.total_chunks}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Read one byte past the expected size to detect oversized chunks
+            expected_size = session.expected_chunk_size(index)
+            data = b''
+            while len(data) <= expected_size:
+                piece = request.read(expected_size + 1 - len(data))
+                if not piece:
+                    break
+                data += piece
+            if len(data) != expected_size:
+                return Response(
+                    {'error': f'Chunk {index} must be exactly {expected_size} bytes'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            # Handle encryption
-            file_content = file_instance.encrypt_file_data(file_content)
+            if index == 0 and not session.mime_type:
+                session.mime_type = magic.from_buffer(data[:2048], mime=True)
+                session.save(update_fields=['mime_type'])
+
+            session.store_chunk(index, data)
+            session.touch()
+
+            return Response({
+                'index': index,
+                'size': len(data),
+                'received_chunks': session.chunks.count(),
+                'total_chunks': session.total_chunks,
+            })
 
-            # Save file
-            file_path = default_storage.save(
-                f'uploads/{unique_filename}',
-                ContentFile(file_content)
+        except Exception as e:
+            logger.error(f"Chunk upload error: {str(e)}")
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-            file_instance.file = file_path
-            file_instance.save()
+
+    @action(detail=False, methods=['post'], url_path=r'upload-sessions/(?P<session_id>[0-9a-f-]+)/complete')
+    def complete_upload_session(self, request, session_id=None):
+        """Assemble all received chunks into a File"""
+        try:
+            session = self.get_upload_session(session_id)
+            if not session:
+                return Response(
+                    {'error': 'Upload session not found or expired'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            missing = session.missing_chunks()
+            if missing:
+                return Response(
+                    {'error': 'Upload is incomplete', 'missing_chunks': missing},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            # Chunk uploads stop once the session is claimed; the blob is assembled without holding a lock
+            if not session.begin_completion():
+                return Response(
+                    {'error': 'Upload session is already being completed'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            file_extension = session.file_name.split('.')[-1] if '.' in session.file_name else ''
+            file_instance = session.complete(f'uploads/{uuid.uuid4()}.{file_extension}')
 
             serializer = self.get_serializer(file_instance)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+        except ValidationError as e:
+            return Response(
+                {'error': ' '.join(e.messages)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
-            logger.error(f"Upload error: {str(e)}")
+            logger.error(f"Upload completion error: {str(e)}")
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        
-    @action(detail=True, methods=['get'])
-    def content(self, request, pk=None):
-        """Get decrypted file content"""
+
+    @action(detail=False, methods=['get', 'post'], url_path=r'blobs/(?P<checksum>[0-9a-fA-F]{64})')
+    def blob(self, request, checksum=None):
+        """
+        Pre-flight for deduplicated uploads
+        GET tells the client whether its content is already stored; POST
+        creates a new file from that content without sending the bytes.
+        """
+        if not getattr(settings, 'FILE_DEDUPLICATION', False):
+            return Response(
+                {'error': 'Deduplication is not enabled'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if request.method == 'GET':
+            blob = FileBlob.lookup(request.user, checksum)
+            if not blob:
+                return Response({'checksum': checksum.lower(), 'exists': False}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'checksum': blob.checksum, 'exists': True, 'file_size': blob.file_size})
+
+        name = request.data.get('name')
+        if not name:
+            return Response(
+                {'error': 'File name is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        blob = FileBlob.lookup(request.user, checksum)
+        if not blob:
+            return Response(
+                {'error': 'Content not found, upload the file instead'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        reserved = blob.file_size
+        if not UserStorageUsage.reserve(request.user, reserved):
+            return Response(
+                {'error': 'Storage quota exceeded'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         try:
-            file_instance = self.get_object()
-            decrypted_content = file_instance.decrypt_file_data()
+            with transaction.atomic():
+                # Holding the row lock keeps the last reference from going away meanwhile
+                blob = FileBlob.objects.select_for_update().filter(pk=blob.pk, ref_count__gt=0).first()
+                if not blob:
+                    return Response(
+                        {'error': 'Content not found, upload the file instead'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                file_instance = blob.create_file(name, mime_type=request.data.get('mime_type'))
+
+            serializer = self.get_serializer(file_instance)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-            response = HttpResponse(
-                decrypted_content,
-                content_type=file_instance.mime_type or 'application/octet-stream'
+        except Exception as e:
+            logger.error(f"Deduplicated upload error: {str(e)}")
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        finally:
+            UserStorageUsage.release(request.user, reserved)
+
+    def _download_response(self, request, file_instance, filename=None, content_type=None, share_link=None):
+        """
+        Response for a file download in the requested mode
+        ``?mode=encrypted`` returns the stored ciphertext and data key for
+        clients that decrypt locally; otherwise the content is decrypted
+        here. The body is paced to the egress caps of the principal, the
+        file owner and ``share_link``. Returns the response and whether it
+        starts a new transfer, i.e. is not a follow-up range or a
+        revalidation.
+        """
+        encrypted = request.GET.get('mode') == 'encrypted'
+        if encrypted and file_instance.compression:
+            return Response(
+                {'error': 'Compressed files can only be downloaded decrypted'},
+                status=status.HTTP_400_BAD_REQUEST
+            ), False
+
+        engine = DownloadEngine(
+            file_instance,
+            encrypted=encrypted,
+            asynchronous=is_asgi_request(request),
+            pacer=EgressPacer.for_request(request, owner=file_instance.owner_id, share_link=share_link)
+        )
+        not_modified = engine.not_modified(request)
+        if not_modified is not None:
+            return not_modified, False
 
-            if request.GET.get('download'):
-                response['Content-Disposition'] = f'attachment; filename="{file_instance.name}"'
+        if encrypted:
+            response = engine.encrypted_response(filename=filename)
+            return response, is_initial_range(request.META.get('HTTP_RANGE'))
 
-            # Record access
-            FileAccess.objects.create(
-                file=file_instance,
-                accessed_by=request.user if request.user.is_authenticated else None,
-                ip_address=self.get_client_ip(request),
-                user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                access_type='download' if request.GET.get('download') else 'view'
+        try:
+            byte_range = engine.requested_range(request)
+        except RangeNotSatisfiable:
+            return engine.range_not_satisfiable(), False
+
+        response = engine.response(byte_range, content_type=content_type, filename=filename)
+        return response, byte_range is None or byte_range[0] == 0
+
+    @action(detail=True, methods=['get'])
+    def content(self, request, pk=None):
+        """Get decrypted file content, honouring single byte-range requests"""
+        try:
+            file_instance = self.get_object()
+            response, initial = self._download_response(
+                request,
+                file_instance,
+                filename=file_instance.name if request.GET.get('download') else None
             )
 
+            # Record access once per transfer, not for every follow-up range
+            if initial:
+                FileAccess.objects.create(
+                    file=file_instance,
+                    accessed_by=request.user if request.user.is_authenticated else None,
+                    ip_address=self.get_client_ip(request),
+                    user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                    access_type='download' if request.GET.get('download') else 'view'
+                )
+
             return response
 
         except Exception as e:
@@ -389,13 +724,74 @@ class FileViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+    @action(detail=False, methods=['get', 'post'], url_path='bulk-download')
+    def bulk_download(self, request):
+        """
+        Stream several files as one ZIP archive
+        Takes ``ids`` (a JSON list, or comma separated in the query string)
+        or the ``search`` / ``file_type`` filters of the file list.
+        """
+        ids = request.data.get('ids') if request.method == 'POST' else None
+        if ids is None and request.query_params.get('ids'):
+            ids = [value for value in request.query_params['ids'].split(',') if value]
+
+        queryset = self.get_queryset()
+        if ids is not None:
+            if not isinstance(ids, list):
+                return Response(
+                    {'error': 'ids must be a list of file IDs'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                ids = [uuid.UUID(str(value)) for value in ids]
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid file ID'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            queryset = queryset.filter(id__in=ids)
+        else:
+            queryset = self.apply_type_filter(self.apply_search_filter(queryset))
+
+        max_files = getattr(settings, 'BULK_DOWNLOAD_MAX_FILES', 1000)
+        files = list(queryset.order_by('name')[:max_files + 1])
+        if not files:
+            return Response(
+                {'error': 'No files found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if len(files) > max_files:
+            return Response(
+                {'error': f'Bulk downloads are limited to {max_files} files'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ip_address = self.get_client_ip(request)
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        FileAccess.objects.bulk_create([
+            FileAccess(
+                file=file_instance,
+                accessed_by=request.user,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                access_type='download'
+            )
+            for file_instance in files
+        ])
+
+        response = StreamingHttpResponse(
+            streaming_content(request, stream_zip(files), pacer=EgressPacer.for_request(request)),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="files-{timezone.now():%Y%m%d-%H%M%S}.zip"'
+        return response
+
     @action(detail=False, methods=['get'], url_path='storage-stats')
     def storage_stats(self, request):
         """Get storage statistics for the current user"""
         user = request.user
         # Regular users see their own stats
-        used_storage = File.objects.filter(owner=user).aggregate(
-            total=Sum('file_size'))['total'] or 0
+        used_storage = UserStorageUsage.for_user(user).used_bytes
         used_links = ShareLink.objects.filter(file__owner=user).count()
         return Response({
             'used_storage': used_storage,
@@ -452,6 +848,25 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['get'], url_path='share-suggestions')
+    def share_suggestions(self, request):
+        """Users to share with whose username, email or name starts with ``q``, from the local directory"""
+        query = request.query_params.get('q', '').strip()
+        if len(query) < 2:
+            return Response([])
+
+        entries = DirectoryUser.search(query).filter(enabled=True).exclude(
+            keycloak_id=request.user.token.get('sub')
+        )[:settings.SHARE_SUGGESTIONS_LIMIT]
+        return Response([
+            {
+                'username': entry.username,
+                'email': entry.email,
+                'name': f"{entry.first_name} {entry.last_name}".strip() or entry.username,
+            }
+            for entry in entries
+        ])
+
     @action(detail=False, methods=['get'], url_path='shared-with-me')
     def shared_with_me(self, request):
         """
@@ -469,6 +884,11 @@ class FileViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
     
+            etag = self.listing_etag(include_owned=False)
+            not_modified = evaluate_preconditions(request, etag) if etag else None
+            if not_modified is not None:
+                return not_modified
+
             logger.info(f"Finding files shared with Keycloak ID: {keycloak_id}")
     
             # Get files shared with user's Keycloak ID
@@ -492,10 +912,12 @@ class FileViewSet(viewsets.ModelViewSet):
             page = self.paginate_queryset(queryset)
             if page is not None:
                 serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-    
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+                response = self.get_paginated_response(serializer.data)
+            else:
+                serializer = self.get_serializer(queryset, many=True)
+                response = Response(serializer.data)
+
+            return set_validators(response, etag) if etag else response
     
         except Exception as e:
             logger.exception("Error retrieving shared files")  # This logs the full traceback
@@ -710,49 +1132,36 @@ class FileViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_401_UNAUTHORIZED
                     )
 
-            # Read file content (already encrypted)
-            # with share_link.file.file.open('rb') as f:
-            #     file_content = f.read()
-
-            file_content = share_link.file.decrypt_file_data()
-            # Create response with encrypted content
-            response = HttpResponse(
-                file_content,
-                content_type='application/octet-stream'
+            response, initial = self._download_response(
+                request,
+                share_link.file,
+                filename=share_link.file.name,
+                content_type='application/octet-stream',
+                share_link=share_link.token
             )
 
-            response['Content-Disposition'] = f'attachment; filename="{share_link.file.name}"'
-            
-            if share_link.file.encryption_key:
-                logger.info("File is encrypted")
-                encryption_key = share_link.file.get_encryption_key_b64()
-                logger.info(f"Encryption key: {encryption_key}")
-                response['X-Encryption-Key'] = encryption_key
-                # In your download view:
-
-                logger.info("Encryption details:")
-                with share_link.file.file.open('rb') as f:
-                    content = f.read()
-                    logger.info(f"First byte (version): {content[0]}")
-                    logger.info(f"First 32 bytes: {content[:32]}")
-
+            if share_link.file.encryption_key and response.status_code < 300:
+                response['X-Encryption-Key'] = share_link.file.get_encryption_key_b64()
                 # Also add Access-Control-Expose-Headers to make custom header visible to JavaScript
                 response['Access-Control-Expose-Headers'] = 'X-Encryption-Key'
 
-            # Update access statistics
-            share_link.access_count = F('access_count') + 1
-            share_link.last_accessed = timezone.now()
-            share_link.save()
+            # Only the start of a transfer counts against the link, so resumed
+            # and seeking range requests or revalidations don't use up max_access_count
+            if initial:
+                # Update access statistics
+                share_link.access_count = F('access_count') + 1
+                share_link.last_accessed = timezone.now()
+                share_link.save()
 
-            # Record access
-            FileAccess.objects.create(
-                file=share_link.file,
-                accessed_by=request.user if request.user.is_authenticated else None,
-                ip_address=self.get_client_ip(request),
-                user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                access_type='download',
-                share_link=share_link
-            )
+                # Record access
+                FileAccess.objects.create(
+                    file=share_link.file,
+                    accessed_by=request.user if request.user.is_authenticated else None,
+                    ip_address=self.get_client_ip(request),
+                    user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                    access_type='download',
+                    share_link=share_link
+                )
 
             return response
 
@@ -1,55 +1,83 @@
-import base64
-import requests
+import copy
+import time
+import hashlib
+
 import jwt
 
 from rest_framework import authentication
 from rest_framework import exceptions
 
-from django.contrib.auth.models import User
 from django.conf import settings
-from django.core.cache import cache
+from django.contrib.auth.models import User
 
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
+from .jwks import jwks_store, JWKSError
+from .cache import TTLCache
+from .apps.core.models import DirectoryUser
+from .apps.files.models import ChangeVersion
+
+
+class VerifiedTokenCache(TTLCache):
+    """
+    Verified bearer tokens and the users they resolved to
+    Entries are keyed by a SHA-256 of the token and kept until the token's
+    ``exp``, capped at ``ttl`` seconds, so a token seen again skips both the
+    RS256 verification and the user lookup. Every process has its own copy,
+    so each one polls the shared ``users`` change version at most every
+    ``revocation_interval`` seconds and drops all entries once a user was
+    deleted anywhere.
+    """
+
+    def __init__(self, max_size=4096, ttl=300, revocation_interval=1):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.revocation_interval = revocation_interval
+        self._users_version = None
+        self._next_revocation_check = 0
+
+    def check_revocations(self):
+        now = time.monotonic()
+        if now < self._next_revocation_check:
+            return
+        self._next_revocation_check = now + self.revocation_interval
+        key = ChangeVersion.USERS_KEY
+        version = ChangeVersion.current([key])[key]
+        if version != self._users_version:
+            self.clear()
+            self._users_version = version
+
+    @staticmethod
+    def cache_key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        """Cached (user, claims) for a token, or None"""
+        self.check_revocations()
+        entry = super().get(self.cache_key(token))
+        if entry is None:
+            return None
+        # Requests get their own instance to set the token on
+        return copy.copy(entry[0]), entry[1]
 
+    def set(self, token, user, claims):
+        # Entries are only added on top of a known users version
+        self.check_revocations()
+        super().set(self.cache_key(token), (copy.copy(user), claims), ttl=claims.get('exp', 0) - time.time())
 
-class KeycloakAuthentication(authentication.BaseAuthentication):
-    def get_public_key(self):
-        cached_key = cache.get('keycloak_public_key')
-        if cached_key:
-            return cached_key
+    def invalidate_user(self, user_id):
+        self.delete_matching(lambda entry: entry[0].pk == user_id)
+
+
+token_cache = VerifiedTokenCache(
+    max_size=getattr(settings, 'KEYCLOAK_TOKEN_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'KEYCLOAK_TOKEN_CACHE_TTL', 300),
+    revocation_interval=getattr(settings, 'KEYCLOAK_TOKEN_REVOCATION_INTERVAL', 1)
+)
 
+
+class KeycloakAuthentication(authentication.BaseAuthentication):
+    def get_public_key(self, kid=None):
         try:
-            jwks_uri = f"{settings.KEYCLOAK_URL}/realms/{settings.KEYCLOAK_REALM}/protocol/openid-connect/certs"
-            keys_response = requests.get(jwks_uri, verify=False)
-            keys_response.raise_for_status()
-            keys = keys_response.json()
-
-            # Find the RSA signing key
-            for key in keys['keys']:
-                if key['use'] == 'sig' and key['kty'] == 'RSA':
-                    # Construct PEM public key
-                    n = base64.urlsafe_b64decode(key['n'] + '=' * (4 - len(key['n']) % 4))
-                    e = base64.urlsafe_b64decode(key['e'] + '=' * (4 - len(key['e']) % 4))
-                    
-                    numbers = rsa.RSAPublicNumbers(
-                        e=int.from_bytes(e, byteorder='big'),
-                        n=int.from_bytes(n, byteorder='big')
-                    )
-                    public_key = numbers.public_key()
-                    
-                    pem = public_key.public_bytes(
-                        encoding=serialization.Encoding.PEM,
-                        format=serialization.PublicFormat.SubjectPublicKeyInfo
-                    )
-                    
-                    # Cache the PEM key
-                    cache.set('keycloak_public_key', pem, 3600)
-                    return pem
-
-            raise Exception("No suitable signing key found")
-            
-        except Exception as e:
+            return jwks_store.get_key(kid)
+        except JWKSError as e:
             print(f"Error fetching public key: {str(e)}")
             raise exceptions.AuthenticationFailed(f'Could not fetch public key: {str(e)}')
 
@@ -68,7 +96,17 @@ class KeycloakAuthentication(authentication.BaseAuthentication):
                 return None
 
             token = auth_parts[1]
-            public_key = self.get_public_key()
+            cached = token_cache.get(token)
+            if cached is not None:
+                user, decoded_token = cached
+                user.token = decoded_token
+                return (user, decoded_token)
+
+            try:
+                kid = jwt.get_unverified_header(token).get('kid')
+            except jwt.InvalidTokenError as e:
+                raise exceptions.AuthenticationFailed(f'Token validation failed: {str(e)}')
+            public_key = self.get_public_key(kid)
 
             try:
                 decoded_token = jwt.decode(
@@ -93,6 +131,8 @@ class KeycloakAuthentication(authentication.BaseAuthentication):
                 username=username,
                 defaults={'email': email}
             )
+            DirectoryUser.record_login(decoded_token)
+            token_cache.set(token, user, decoded_token)
             user.token = decoded_token
             return (user, decoded_token)
 
@@ -0,0 +1,187 @@
+import json
+import time
+import logging
+import threading
+
+import requests
+
+from django.conf import settings
+
+from jwt.algorithms import RSAAlgorithm
+
+from .apps.core.keycloak_client import get_keycloak_client
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSError(Exception):
+    """Raised when no usable signing key can be found for a token"""
+    pass
+
+
+class JWKSStore:
+    """
+    Process-wide cache of the realm's signing keys, indexed by ``kid``
+    Keys are kept as ready-to-use public key objects. Once ``ttl`` has
+    passed they are still served while one background thread refetches
+    them (stale-while-revalidate), up to ``max_stale``. A token signed with
+    an unknown ``kid`` after a key rotation triggers a refetch, at most one
+    per ``min_refresh_interval``. Fetches are single-flight: concurrent
+    callers wait for the fetch in progress instead of starting their own.
+    """
+
+    def __init__(self, jwks_uri=None, ttl=300, max_stale=3600, min_refresh_interval=10, timeout=5):
+        self._jwks_uri = jwks_uri
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.fetches = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._attempts = 0
+        self._error = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    @property
+    def jwks_uri(self):
+        return self._jwks_uri or (
+            f"{settings.KEYCLOAK_URL}/realms/{settings.KEYCLOAK_REALM}/protocol/openid-connect/certs"
+        )
+
+    def get_key(self, kid=None):
+        """Public key for ``kid``, or the only signing key for tokens without one"""
+        now = time.monotonic()
+        with self._lock:
+            keys, fetched_at, attempt = self._keys, self._fetched_at, self._attempts
+        age = now - fetched_at if fetched_at is not None else None
+
+        if age is None or age > self.max_stale:
+            with self._lock:
+                error = self._error
+            if error is not None and not self._may_refetch():
+                # Keycloak just failed us; don't hammer it on every request
+                raise error
+            self._refresh(attempt)
+        elif age > self.ttl:
+            self._refresh_in_background()
+        else:
+            key = self._lookup(keys, kid)
+            if key is not None:
+                return key
+
+        with self._lock:
+            keys, attempt = self._keys, self._attempts
+        key = self._lookup(keys, kid)
+        if key is not None:
+            return key
+
+        # Unknown kid: the realm may have rotated its keys since the last fetch
+        if self._may_refetch():
+            self._refresh(attempt)
+            with self._lock:
+                key = self._lookup(self._keys, kid)
+            if key is not None:
+                return key
+        raise JWKSError(f"No signing key found for kid '{kid}'")
+
+    def _lookup(self, keys, kid):
+        if kid is not None:
+            return keys.get(kid)
+        if len(keys) == 1:
+            return next(iter(keys.values()))
+        return None
+
+    def _may_refetch(self):
+        with self._lock:
+            return (
+                self._attempted_at is None
+                or time.monotonic() - self._attempted_at >= self.min_refresh_interval
+            )
+
+    def _refresh(self, attempt):
+        """
+        Fetch the key set unless another caller tried since ``attempt`` was read
+        Callers that waited for that fetch share its outcome, failures included.
+        """
+        with self._fetch_lock:
+            with self._lock:
+                if self._attempts != attempt:
+                    if self._error is not None:
+                        raise self._error
+                    return
+            self._fetch()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            attempt = self._attempts
+
+        def refresh():
+            try:
+                self._refresh(attempt)
+            except JWKSError as e:
+                logger.warning(f"Background JWKS refresh failed, serving cached keys: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name='jwks-refresh', daemon=True).start()
+
+    def _fetch(self):
+        with self._lock:
+            self._attempted_at = time.monotonic()
+        try:
+            keys = self._download()
+        except JWKSError as e:
+            with self._lock:
+                self._error = e
+                self._attempts += 1
+            raise
+
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self._error = None
+            self._attempts += 1
+            self.fetches += 1
+
+    def _download(self):
+        try:
+            response = get_keycloak_client().get(self.jwks_uri, timeout=self.timeout)
+            response.raise_for_status()
+            jwks = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise JWKSError(f"Could not fetch signing keys: {str(e)}")
+
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            if jwk.get('kty') != 'RSA' or jwk.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[jwk.get('kid')] = RSAAlgorithm.from_jwk(json.dumps(jwk))
+            except Exception as e:
+                logger.warning(f"Skipping unusable signing key {jwk.get('kid')}: {str(e)}")
+        if not keys:
+            raise JWKSError("No suitable signing key found")
+        return keys
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._attempted_at = None
+            self._error = None
+            self._attempts += 1
+
+
+jwks_store = JWKSStore(
+    ttl=getattr(settings, 'KEYCLOAK_JWKS_TTL', 300),
+    max_stale=getattr(settings, 'KEYCLOAK_JWKS_MAX_STALE', 3600),
+    min_refresh_interval=getattr(settings, 'KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL', 10)
+)
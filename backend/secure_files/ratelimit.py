@@ -0,0 +1,197 @@
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import redis
+except ImportError:  # Optional, only needed by RedisRateLimitBackend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend:
+    """
+    Generic cell rate algorithm (GCRA) limiter
+    Each key stores a single timestamp, the theoretical arrival time (TAT) of
+    the next request, so checking a limit is O(1) whatever its window.
+    ``limit`` requests per ``period`` seconds are spread evenly over the
+    period, with up to ``burst`` of them (default ``limit``) allowed back to
+    back.
+    """
+
+    def hit(self, key, limit, period, burst=None, cost=1):
+        """
+        Record ``cost`` units against ``key``
+        Returns ``(allowed, retry_after)``; a denied hit is not recorded and
+        ``retry_after`` is the number of seconds until it would be allowed.
+        """
+        interval = period / limit
+        tolerance = interval * (burst or limit)
+        return self._hit(key, interval * cost, tolerance)
+
+    def reserve(self, key, limit, period, burst=None, cost=1):
+        """
+        Record ``cost`` units against ``key`` unconditionally
+        Returns the number of seconds to wait before using them, which paces
+        callers to the rate instead of rejecting them.
+        """
+        interval = period / limit
+        tolerance = interval * (burst or limit)
+        return self._reserve(key, interval * cost, tolerance)
+
+    def _hit(self, key, increment, tolerance):
+        raise NotImplementedError
+
+    def _reserve(self, key, increment, tolerance):
+        raise NotImplementedError
+
+    def reset(self, key=None):
+        raise NotImplementedError
+
+
+def gcra(now, tat, increment, tolerance):
+    """Return ``(new_tat, retry_after)``; ``new_tat`` is None when the hit is denied"""
+    tat = max(tat or now, now)
+    new_tat = tat + increment
+    allow_at = new_tat - tolerance
+    if allow_at > now:
+        return None, allow_at - now
+    return new_tat, 0.0
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """
+    In-process limiter for development and single-process deployments
+    Limits are enforced per process; use RedisRateLimitBackend to share
+    them between workers.
+    """
+    prune_every = 1024
+
+    def __init__(self):
+        self._tats = {}
+        self._hits = 0
+        self._lock = threading.Lock()
+
+    def _hit(self, key, increment, tolerance):
+        now = time.monotonic()
+        with self._lock:
+            new_tat, retry_after = gcra(now, self._tats.get(key), increment, tolerance)
+            if new_tat is not None:
+                self._tats[key] = new_tat
+            self._hits += 1
+            if self._hits % self.prune_every == 0:
+                self._prune(now)
+        return new_tat is not None, retry_after
+
+    def _reserve(self, key, increment, tolerance):
+        now = time.monotonic()
+        with self._lock:
+            new_tat = max(self._tats.get(key) or now, now) + increment
+            self._tats[key] = new_tat
+            self._hits += 1
+            if self._hits % self.prune_every == 0:
+                self._prune(now)
+        return max(new_tat - tolerance - now, 0.0)
+
+    def _prune(self, now):
+        # Keys whose TAT has passed are equivalent to absent keys
+        for key in [key for key, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._tats.clear()
+            else:
+                self._tats.pop(key, None)
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Limiter shared by all workers through Redis
+    The GCRA update runs as a Lua script, so it is atomic across processes
+    and uses the Redis clock rather than each worker's. When Redis cannot be
+    reached the hit is checked against a per-process fallback instead of
+    failing the request.
+    """
+    SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+    if tat < now then tat = now end
+    local new_tat = tat + tonumber(ARGV[1])
+    local allow_at = new_tat - tonumber(ARGV[2])
+    if allow_at > now then
+        return {0, tostring(allow_at - now)}
+    end
+    redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+    return {1, '0'}
+    """
+    RESERVE_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+    if tat < now then tat = now end
+    local new_tat = tat + tonumber(ARGV[1])
+    redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+    return tostring(math.max(new_tat - tonumber(ARGV[2]) - now, 0))
+    """
+
+    def __init__(self):
+        if redis is None:
+            raise ImportError("RedisRateLimitBackend requires the redis package")
+        self.prefix = getattr(settings, 'RATE_LIMIT_KEY_PREFIX', 'ratelimit:')
+        self.client = redis.Redis.from_url(
+            getattr(settings, 'RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'),
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+        self.script = self.client.register_script(self.SCRIPT)
+        self.reserve_script = self.client.register_script(self.RESERVE_SCRIPT)
+        self.fallback = LocalRateLimitBackend()
+
+    def _hit(self, key, increment, tolerance):
+        try:
+            allowed, retry_after = self.script(keys=[self.prefix + key], args=[increment, tolerance])
+        except redis.RedisError as e:
+            logger.warning(f"Rate limit backend unavailable, limiting per process: {str(e)}")
+            return self.fallback._hit(key, increment, tolerance)
+        return bool(allowed), float(retry_after)
+
+    def _reserve(self, key, increment, tolerance):
+        try:
+            delay = self.reserve_script(keys=[self.prefix + key], args=[increment, tolerance])
+        except redis.RedisError as e:
+            logger.warning(f"Rate limit backend unavailable, limiting per process: {str(e)}")
+            return self.fallback._reserve(key, increment, tolerance)
+        return float(delay)
+
+    def reset(self, key=None):
+        self.fallback.reset(key)
+        if key is not None:
+            self.client.delete(self.prefix + key)
+        else:
+            for stale in self.client.scan_iter(match=self.prefix + '*'):
+                self.client.delete(stale)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide limiter configured by RATE_LIMIT_BACKEND"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                backend_class = import_string(getattr(
+                    settings, 'RATE_LIMIT_BACKEND',
+                    'secure_files.ratelimit.LocalRateLimitBackend'
+                ))
+                _limiter = backend_class()
+    return _limiter
@@ -43,7 +43,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'secure_files.middleware.IPRateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'secure_files.urls'
@@ -130,6 +129,23 @@ KEYCLOAK_URL = os.environ.get('KEYCLOAK_URL', 'http://keycloak:8080')
 KEYCLOAK_REALM = os.environ.get('KEYCLOAK_REALM', 'secure-files')
 KEYCLOAK_ADMIN_USER = os.environ.get('KEYCLOAK_ADMIN_USER', 'admin')
 KEYCLOAK_ADMIN_PASSWORD = os.environ.get('KEYCLOAK_ADMIN_PASSWORD', 'CDEWSXZAQ!#')
+KEYCLOAK_HTTP_CONNECT_TIMEOUT = 3  # Seconds
+KEYCLOAK_HTTP_READ_TIMEOUT = 10  # Seconds
+KEYCLOAK_HTTP_RETRIES = 2  # Extra attempts for idempotent calls, with jittered exponential backoff
+KEYCLOAK_HTTP_BACKOFF = 0.2  # Seconds, doubled per attempt
+KEYCLOAK_HTTP_POOL_SIZE = 20  # Keep-alive connections per process
+KEYCLOAK_BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failed calls before calls to Keycloak fail fast
+KEYCLOAK_BREAKER_RESET_TIMEOUT = 30  # Seconds the breaker stays open before a single probe call is let through
+KEYCLOAK_FETCH_CONCURRENCY = 8  # Keycloak calls run in parallel when resolving roles for many users
+KEYCLOAK_PAGE_SIZE = 500  # Users per page when reading the whole directory or role members
+KEYCLOAK_DIRECTORY_CACHE_TTL = 3600  # Seconds user lookups are kept to answer from while Keycloak is unavailable
+DIRECTORY_MAX_STALENESS = 900  # Seconds the local user directory may lag Keycloak; schedule sync_directory more often than this
+KEYCLOAK_JWKS_TTL = 300  # Seconds signing keys are fresh; after that they are refreshed in the background
+KEYCLOAK_JWKS_MAX_STALE = 3600  # Seconds stale keys may still be served while Keycloak is unreachable
+KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL = 10  # Seconds between refetches triggered by unknown key IDs
+KEYCLOAK_TOKEN_CACHE_SIZE = 4096  # Verified bearer tokens kept in memory per process
+KEYCLOAK_TOKEN_CACHE_TTL = 300  # Seconds, tokens expiring sooner are kept until they expire
+KEYCLOAK_TOKEN_REVOCATION_INTERVAL = 1  # Seconds between checks for users deleted by other processes
 
 # KEYCLOAK_CLIENT_ID = os.environ.get('KEYCLOAK_CLIENT_ID', 'secure-files-client')
 # KEYCLOAK_CLIENT_SECRET = os.environ.get('KEYCLOAK_CLIENT_SECRET', 'your-client-secret-here')
@@ -138,6 +154,9 @@ KEYCLOAK_ADMIN_PASSWORD = os.environ.get('KEYCLOAK_ADMIN_PASSWORD', 'CDEWSXZAQ!#
 
 USER_STORAGE_LIMIT = 2 * 1024 * 1024 * 1024  # 2GB per user
 SYSTEM_STORAGE_LIMIT = 1024 * 1024 * 1024 * 1024  # 1TB total system storage (adjust as needed)
+ADMIN_USER_PAGE_SIZE = 50  # Users per page in the admin user list
+ADMIN_USER_MAX_PAGE_SIZE = 500  # Largest page_size a client may ask for
+SHARE_SUGGESTIONS_LIMIT = 10  # Users suggested per share recipient autocomplete query
 
 # Rest Framework settings
 REST_FRAMEWORK = {
@@ -147,7 +166,10 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'secure_files.throttling.PolicyRateThrottle',
+    ],
 }
 
 # Logging Configuration
@@ -199,7 +221,94 @@ USER_STORAGE_LIMIT = 2 * 1024 * 1024 * 1024  # 2GB
 MAX_SHARE_LINKS = 100  # Maximum number of share links per user
 
 # Rate Limiting Settings
-IP_RATE_LIMIT = {
-    'DOWNLOAD_WINDOW': 60,  # 1 minute
-    'MAX_DOWNLOADS_PER_WINDOW': 2,
-}
\ No newline at end of file
+# Policies by URL name or '<viewset basename>.<action>'. Scopes are 'ip',
+# 'user' (Keycloak subject) and 'share_link' (link token), each 'N/period' or
+# {'rate': 'N/period', 'burst': M}. 'roles' overrides scopes for principals
+# holding a realm role, 'service-account' matching client credentials tokens;
+# None lifts a limit.
+RATE_LIMIT_POLICIES = {
+    'file-download-shared-file': {
+        'ip': '2/min',
+        'share_link': {'rate': '30/min', 'burst': 10},
+    },
+    'file-bulk-download': {
+        'user': '2/min',
+        'roles': {
+            'admin': {'user': '20/min'},
+            'service-account': {'user': {'rate': '60/min', 'burst': 20}},
+        },
+    },
+}
+# Download bandwidth caps in bytes per second by scope: 'global' (this
+# process, or every worker sharing the Redis backend), 'owner' (all downloads
+# of one owner's files, share links included), 'user' (Keycloak subject) and
+# 'share_link'. Each is a rate or {'rate': bytes/s, 'burst': bytes}; transfers
+# over a cap are slowed down, not refused. None lifts a cap.
+EGRESS_RATE_LIMITS = {
+    'global': None,
+    'owner': None,
+    'user': 50 * 1024 * 1024,
+    'share_link': 10 * 1024 * 1024,
+}
+EGRESS_RATE_LIMIT_ROLES = {  # Overrides by realm role, the first role held applies
+    'admin': {'user': None},
+}
+EGRESS_BURST = 8 * 1024 * 1024  # Bytes sent at full speed before pacing starts
+EGRESS_QUANTUM = 256 * 1024  # Bytes reserved per rate limit backend call
+RATE_LIMIT_BACKEND = os.environ.get(  # RedisRateLimitBackend shares limits between workers
+    'RATE_LIMIT_BACKEND', 'secure_files.ratelimit.LocalRateLimitBackend'
+)
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://redis:6379/0')
+RATE_LIMIT_KEY_PREFIX = 'ratelimit:'
+
+# File Encryption Settings
+FILE_ENCRYPTION_SEGMENT_SIZE = 64 * 1024  # 64KB plaintext per AES-GCM segment
+FILE_ENCRYPTION_WORKERS = int(os.environ.get('FILE_ENCRYPTION_WORKERS', os.cpu_count() or 1))  # Threads per process for segment crypto
+FILE_ENCRYPTION_BATCH_SIZE = 1024 * 1024  # 1MB of segments per thread pool task
+
+# Download Settings
+FILE_DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Largest plaintext chunk handed to the server per write
+FILE_DOWNLOAD_OFFLOAD = os.environ.get('FILE_DOWNLOAD_OFFLOAD', '0').lower() in ['true', 't', '1']  # Let nginx send ciphertext via X-Accel-Redirect
+FILE_DOWNLOAD_OFFLOAD_PREFIX = '/protected-media/'  # Internal nginx location aliasing MEDIA_ROOT
+BULK_DOWNLOAD_MAX_FILES = 1000  # Files per ZIP archive
+FILE_TRANSFER_THREADS = 32  # Threads reading and decrypting for async (ASGI) transfers, per process
+FILE_TRANSFER_BATCH_SIZE = 1024 * 1024  # Bytes pulled per thread hop
+
+# Envelope Encryption Settings
+FILE_KEY_PROVIDER = 'secure_files.apps.core.key_management.LocalKeyProvider'
+FILE_MASTER_KEY = os.environ.get('FILE_MASTER_KEY')  # Base64, overrides FILE_MASTER_KEY_PATH
+FILE_MASTER_KEY_PATH = os.environ.get('FILE_MASTER_KEY_PATH', str(BASE_DIR / 'keys' / 'master.key'))
+FILE_KEY_PER_USER = True  # Derive a separate KEK for every file owner
+FILE_KEY_CACHE_SIZE = 1024  # Unwrapped data keys kept in memory per process
+FILE_KEY_CACHE_TTL = 300  # Seconds
+
+# Deduplication Settings
+FILE_DEDUPLICATION = os.environ.get('FILE_DEDUPLICATION', '0').lower() in ['true', 't', '1']  # Share one encrypted blob between an owner's identical files
+
+# Compression Settings
+FILE_COMPRESSION = os.environ.get('FILE_COMPRESSION', '0').lower() in ['true', 't', '1']  # Compress before encrypting
+FILE_COMPRESSION_CODEC = 'zstd'  # Falls back to zlib when zstandard is not installed
+FILE_COMPRESSION_LEVEL = None  # Codec default
+# Already compressed formats (JPEG, MP4, ZIP and the ZIP based office
+# documents) are left out; compressing them again only costs CPU
+FILE_COMPRESSION_MIME_TYPES = [  # Glob patterns of compressible types, everything else is stored as is
+    'text/*',
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'application/javascript',
+    'application/x-yaml',
+    'application/sql',
+    'application/rtf',
+    'application/msword',
+    'application/vnd.ms-excel',
+    'application/vnd.ms-powerpoint',
+    'image/svg+xml',
+    'image/bmp',
+    'image/tiff',
+]
+
+# Resumable Upload Settings
+UPLOAD_SESSION_CHUNK_SIZE = 4 * 1024 * 1024  # 4MB, must be a multiple of FILE_ENCRYPTION_SEGMENT_SIZE
+UPLOAD_SESSION_MAX_SIZE = 10 * 1024 * 1024 * 1024  # 10GB
+UPLOAD_SESSION_TTL = 24 * 60 * 60  # Seconds of inactivity before a session expires
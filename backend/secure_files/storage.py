@@ -21,11 +21,9 @@ class SecureFileSystemStorage(FileSystemStorage):
 
     def has_quota_available(self, file_size):
         """Check if user has enough quota available"""
-        from secure_files.apps.files.models import File
-        used_storage = File.objects.filter(owner=self.request.user).aggregate(
-            total=models.Sum('file_size')
-        )['total'] or 0
-        return (used_storage + file_size) <= self.base_quota_bytes
+        from secure_files.apps.files.models import UserStorageUsage
+        usage = UserStorageUsage.for_user(self.request.user)
+        return (usage.used_bytes + usage.reserved_bytes + file_size) <= self.base_quota_bytes
 
 class S3Storage:
     def __init__(self):
@@ -0,0 +1,288 @@
+import time
+import asyncio
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from rest_framework.throttling import BaseThrottle
+
+from .ratelimit import get_rate_limiter
+
+SCOPES = ('ip', 'user', 'share_link')
+EGRESS_SCOPES = ('global', 'owner', 'user', 'share_link')
+SERVICE_ACCOUNT_ROLE = 'service-account'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Limit:
+    """``limit`` requests (or bytes) per ``period`` seconds, ``burst`` of them back to back"""
+
+    def __init__(self, limit, period, burst=None):
+        self.limit = limit
+        self.period = period
+        self.burst = burst or limit
+
+    @classmethod
+    def parse(cls, value):
+        """Build a Limit from 'N/period' or {'rate': 'N/period', 'burst': M}"""
+        if isinstance(value, dict):
+            rate, burst = value.get('rate'), value.get('burst')
+        else:
+            rate, burst = value, None
+        try:
+            num, period = str(rate).split('/')
+            limit = int(num)
+            duration = PERIODS[period.strip()[0].lower()]
+        except (ValueError, KeyError, IndexError):
+            raise ImproperlyConfigured(f"Invalid rate limit '{rate}', expected 'N/s', 'N/min', 'N/hour' or 'N/day'")
+        if limit <= 0 or (burst is not None and int(burst) <= 0):
+            raise ImproperlyConfigured(f"Rate limit '{rate}' must allow at least one request")
+        return cls(limit, duration, int(burst) if burst is not None else None)
+
+
+class Policy:
+    """Limits for one route by scope, with overrides for principals holding a role"""
+
+    def __init__(self, route, config):
+        unknown = set(config) - set(SCOPES) - {'roles'}
+        if unknown:
+            raise ImproperlyConfigured(f"Unknown rate limit scopes for '{route}': {', '.join(sorted(unknown))}")
+        self.route = route
+        self.limits = {scope: Limit.parse(config[scope]) for scope in SCOPES if config.get(scope)}
+        self.role_limits = []
+        for role, overrides in config.get('roles', {}).items():
+            unknown = set(overrides) - set(SCOPES)
+            if unknown:
+                raise ImproperlyConfigured(
+                    f"Unknown rate limit scopes for '{route}' role '{role}': {', '.join(sorted(unknown))}"
+                )
+            self.role_limits.append((role, {
+                scope: Limit.parse(value) if value else None for scope, value in overrides.items()
+            }))
+
+    def limits_for(self, roles):
+        """Effective limits; the first configured role the principal holds applies, None lifts a limit"""
+        for role, overrides in self.role_limits:
+            if role in roles:
+                limits = dict(self.limits, **overrides)
+                return {scope: limit for scope, limit in limits.items() if limit is not None}
+        return self.limits
+
+
+_policies = None
+_policies_lock = threading.Lock()
+
+
+def get_rate_limit_policies():
+    """Policies from RATE_LIMIT_POLICIES, compiled once per process"""
+    global _policies
+    if _policies is None:
+        with _policies_lock:
+            if _policies is None:
+                _policies = {
+                    route: Policy(route, config)
+                    for route, config in getattr(settings, 'RATE_LIMIT_POLICIES', {}).items()
+                }
+    return _policies
+
+
+def client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def principal(user):
+    """Stable identifier of an authenticated principal, the Keycloak subject where there is one"""
+    token = getattr(user, 'token', None)
+    if token and token.get('sub'):
+        return token['sub']
+    if user is not None and user.is_authenticated:
+        return f'local-{user.pk}'
+    return None
+
+
+def principal_roles(user):
+    """Realm roles of an authenticated Keycloak user, plus 'service-account' for client credentials"""
+    token = getattr(user, 'token', None) or {}
+    roles = set(token.get('realm_access', {}).get('roles', []))
+    if token.get('preferred_username', '').startswith('service-account-'):
+        roles.add(SERVICE_ACCOUNT_ROLE)
+    return roles
+
+
+class PolicyRateThrottle(BaseThrottle):
+    """
+    Applies the rate limit policy of the route being served
+    Routes are looked up by URL name, then by '<basename>.<action>', in the
+    table compiled from RATE_LIMIT_POLICIES; routes without a policy cost a
+    dict lookup. Every scope the policy limits is checked against its own
+    bucket: the client IP, the Keycloak subject and the share-link token.
+    """
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_policy(self, request, view):
+        policies = get_rate_limit_policies()
+        match = request.resolver_match
+        if match is not None and match.url_name in policies:
+            return policies[match.url_name]
+        return policies.get(f'{getattr(view, "basename", None)}.{getattr(view, "action", None)}')
+
+    def identities(self, request, view):
+        identities = {'ip': client_ip(request)}
+        user = principal(request.user)
+        if user is not None:
+            identities['user'] = user
+        if getattr(view, 'kwargs', {}).get('token'):
+            identities['share_link'] = view.kwargs['token']
+        return identities
+
+    def allow_request(self, request, view):
+        policy = self.get_policy(request, view)
+        if policy is None:
+            return True
+
+        limiter = get_rate_limiter()
+        identities = self.identities(request, view)
+        limits = policy.limits_for(principal_roles(request.user)) if 'user' in identities else policy.limits
+        for scope, limit in limits.items():
+            ident = identities.get(scope)
+            if ident is None:
+                continue
+            allowed, retry_after = limiter.hit(
+                f'{policy.route}:{scope}:{ident}', limit.limit, limit.period, limit.burst
+            )
+            if not allowed:
+                self.retry_after = retry_after
+                return False
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+def egress_limit(value, burst):
+    """Build a byte-rate Limit from bytes per second or {'rate': bytes/s, 'burst': bytes}"""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        value, burst = value.get('rate'), value.get('burst', burst)
+    try:
+        rate, burst = int(value), int(burst or value)
+    except (TypeError, ValueError):
+        raise ImproperlyConfigured(f"Invalid egress rate '{value}', expected bytes per second")
+    if rate <= 0 or burst <= 0:
+        raise ImproperlyConfigured(f"Egress rate '{value}' must be positive")
+    return Limit(rate, 1, burst)
+
+
+_egress_limits = None
+
+
+def get_egress_limits():
+    """Caps from EGRESS_RATE_LIMITS and EGRESS_RATE_LIMIT_ROLES, compiled once per process"""
+    global _egress_limits
+    if _egress_limits is None:
+        with _policies_lock:
+            if _egress_limits is None:
+                burst = getattr(settings, 'EGRESS_BURST', None)
+                config = dict(getattr(settings, 'EGRESS_RATE_LIMITS', {}))
+                unknown = set(config) - set(EGRESS_SCOPES)
+                roles = []
+                for role, overrides in getattr(settings, 'EGRESS_RATE_LIMIT_ROLES', {}).items():
+                    unknown |= set(overrides) - set(EGRESS_SCOPES)
+                    roles.append((role, {scope: egress_limit(value, burst) for scope, value in overrides.items()}))
+                if unknown:
+                    raise ImproperlyConfigured(f"Unknown egress scopes: {', '.join(sorted(unknown))}")
+                _egress_limits = (
+                    {scope: egress_limit(value, burst) for scope, value in config.items()},
+                    roles
+                )
+    return _egress_limits
+
+
+class EgressPacer:
+    """
+    Paces a transfer to the byte rates of the buckets it draws from
+    Each bucket is a GCRA in the rate limit backend, so concurrent transfers
+    of the same principal, owner or share link share one rate. Bytes are
+    reserved ``quantum`` at a time and the transfer sleeps off the returned
+    delay before sending them: large downloads are slowed down, never
+    refused.
+    """
+
+    def __init__(self, buckets, quantum=None):
+        self.buckets = buckets
+        self.quantum = quantum or getattr(settings, 'EGRESS_QUANTUM', 256 * 1024)
+        self.pending = 0
+
+    @classmethod
+    def for_request(cls, request, owner=None, share_link=None):
+        """Pacer for a download by the request's principal, or None when no cap applies"""
+        limits, roles = get_egress_limits()
+        user = principal(request.user)
+        if user is not None:
+            held = principal_roles(request.user)
+            for role, overrides in roles:
+                if role in held:
+                    limits = dict(limits, **overrides)
+                    break
+
+        identities = {'global': '', 'owner': owner, 'user': user, 'share_link': share_link}
+        buckets = [
+            (f'egress:{scope}:{identities[scope]}', limit)
+            for scope, limit in limits.items()
+            if limit is not None and identities[scope] is not None
+        ]
+        return cls(buckets) if buckets else None
+
+    def connection_rate(self):
+        """Slowest cap in bytes per second, for servers that can only limit one connection"""
+        return min(limit.limit for _, limit in self.buckets)
+
+    def consume(self, size):
+        """Account for ``size`` bytes about to be sent; returns the seconds to wait first"""
+        self.pending += size
+        if self.pending < self.quantum:
+            return 0
+        return self.settle()
+
+    def settle(self):
+        """Reserve the bytes accounted so far; returns the seconds to wait before sending them"""
+        if not self.pending:
+            return 0
+        cost, self.pending = self.pending, 0
+        limiter = get_rate_limiter()
+        return max(
+            limiter.reserve(key, limit.limit, limit.period, limit.burst, cost=cost)
+            for key, limit in self.buckets
+        )
+
+    def pace(self, chunks):
+        try:
+            for chunk in chunks:
+                delay = self.consume(len(chunk))
+                if delay:
+                    time.sleep(delay)
+                yield chunk
+            # The tail is already sent, it only counts against later transfers
+            self.settle()
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+    async def apace(self, chunks):
+        try:
+            async for chunk in chunks:
+                delay = self.consume(len(chunk))
+                if delay:
+                    await asyncio.sleep(delay)
+                yield chunk
+            self.settle()
+        finally:
+            await chunks.aclose()
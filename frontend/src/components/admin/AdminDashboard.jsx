@@ -11,6 +11,7 @@ import AddUserModal from './AddUserModal';
 import api from '../../services/api';
 import { formatStorageUsage, calculateStoragePercentage } from '../../utils/format';
 const USER_STORAGE_LIMIT = 2147483648; // 2 GB
+const USER_PAGE_SIZE = 50;
 
 
 const Card = ({ children, className = '' }) => (
@@ -24,6 +25,9 @@ const AdminDashboard = () => {
     const [isAdmin, setIsAdmin] = useState(false);
     const [systemStats, setSystemStats] = useState(null);
     const [users, setUsers] = useState([]);
+    const [userCount, setUserCount] = useState(0);
+    const [userPage, setUserPage] = useState(1);
+    const [userSearch, setUserSearch] = useState('');
     const [selectedUser, setSelectedUser] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
@@ -55,19 +59,42 @@ const AdminDashboard = () => {
         }
     };
 
+    const loadUsers = async (page = userPage, search = userSearch) => {
+        const usersResponse = await getUserManagement({ page, pageSize: USER_PAGE_SIZE, search });
+        setUsers(usersResponse.results);
+        setUserCount(usersResponse.count);
+        setUserPage(page);
+    };
+
+    const handleUserSearch = async (event) => {
+        event.preventDefault();
+        try {
+            await loadUsers(1, userSearch);
+        } catch (err) {
+            setError(err.response?.data?.error || 'Failed to load users');
+        }
+    };
+
+    const handleUserPage = async (page) => {
+        try {
+            await loadUsers(page);
+        } catch (err) {
+            setError(err.response?.data?.error || 'Failed to load users');
+        }
+    };
+
     const loadAdminData = async () => {
         try {
             const accessResponse = await checkAdminAccess();
             setIsAdmin(accessResponse.is_admin);
 
             if (accessResponse.is_admin) {
-                const [statsResponse, usersResponse] = await Promise.all([
+                const [statsResponse] = await Promise.all([
                     getSystemStats(),
-                    getUserManagement()
+                    loadUsers()
                 ]);
 
                 setSystemStats(statsResponse);
-                setUsers(usersResponse);
 
                 // Process activity data for chart
                 const activityStats = statsResponse.daily_stats || [];
@@ -266,7 +293,18 @@ const AdminDashboard = () => {
             {/* User Management */}
             <Card>
                 <div className="p-6">
-                    <h2 className="text-lg font-semibold mb-4">User Management</h2>
+                    <div className="flex justify-between items-center mb-4">
+                        <h2 className="text-lg font-semibold">User Management</h2>
+                        <form onSubmit={handleUserSearch}>
+                            <input
+                                type="search"
+                                value={userSearch}
+                                onChange={(e) => setUserSearch(e.target.value)}
+                                placeholder="Search users"
+                                className="px-3 py-1 border rounded text-sm"
+                            />
+                        </form>
+                    </div>
                     <div className="overflow-x-auto">
                         <table className="min-w-full divide-y divide-gray-200">
                             <thead>
@@ -350,6 +388,26 @@ const AdminDashboard = () => {
                             </tbody>
                         </table>
                     </div>
+                    <div className="flex justify-between items-center mt-4 text-sm text-gray-600">
+                        <span>{userCount} users</span>
+                        <div className="space-x-2">
+                            <button
+                                onClick={() => handleUserPage(userPage - 1)}
+                                disabled={userPage <= 1}
+                                className="px-3 py-1 border rounded disabled:opacity-50"
+                            >
+                                Previous
+                            </button>
+                            <span>Page {userPage} of {Math.max(Math.ceil(userCount / USER_PAGE_SIZE), 1)}</span>
+                            <button
+                                onClick={() => handleUserPage(userPage + 1)}
+                                disabled={userPage * USER_PAGE_SIZE >= userCount}
+                                className="px-3 py-1 border rounded disabled:opacity-50"
+                            >
+                                Next
+                            </button>
+                        </div>
+                    </div>
                 </div>
             </Card>
 
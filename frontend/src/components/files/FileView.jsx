@@ -2,7 +2,7 @@ import React, { useState, useEffect, useCallback } from 'react';
 import {
     Search, Filter, SortAsc, SortDesc, Grid, List, ChevronDown
 } from 'lucide-react';
-import api from '../../services/api';
+import api, { downloadFile } from '../../services/api';
 import FilePreviewModal from './modals/FilePreviewModal';
 import ShareFileModal from './modals/ShareFileModal';
 import FileListView from './FileListView';
@@ -64,10 +64,8 @@ const FileView = ({
 
     const handleDownload = async (file) => {
         try {
-            const response = await api.get(`/api/files/${file.id}/content/?download=true`, {
-                responseType: 'blob'
-            });
-            const url = window.URL.createObjectURL(new Blob([response.data]));
+            const blob = await downloadFile(file);
+            const url = window.URL.createObjectURL(blob);
             const link = document.createElement('a');
             link.href = url;
             link.setAttribute('download', file.name);
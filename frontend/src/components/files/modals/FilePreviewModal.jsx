@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { X, Download, Share2, FileText, Image, File } from 'lucide-react';
-import api from '../../../services/api';
+import api, { downloadFile } from '../../../services/api';
 import { decryptFile } from '../../../utils/encryption';
 
 const PDFPreview = ({ url }) => {
@@ -93,10 +93,8 @@ const FilePreviewModal = ({ file, onClose, onShare }) => {
 
     const handleDownload = async () => {
         try {
-            const response = await api.get(`/api/files/${file.id}/content/?download=true`, {
-                responseType: 'blob'
-            });
-            const url = window.URL.createObjectURL(new Blob([response.data]));
+            const blob = await downloadFile(file);
+            const url = window.URL.createObjectURL(blob);
             const link = document.createElement('a');
             link.href = url;
             link.setAttribute('download', file.name);
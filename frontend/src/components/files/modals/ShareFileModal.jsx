@@ -1,5 +1,6 @@
-import React, { useState } from 'react';
-import { shareFile, generateShareLink } from '../../../services/api';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
+import debounce from 'lodash/debounce';
+import { shareFile, generateShareLink, getShareSuggestions } from '../../../services/api';
 import {
     X, Link, Copy, Clock, Shield, Lock,
     User, CheckCircle, Share2, Eye, Download,
@@ -9,6 +10,7 @@ import {
 const ShareFileModal = ({ file, onClose, onShare }) => {
     const [activeTab, setActiveTab] = useState('user'); // 'user' or 'link'
     const [userId, setUserId] = useState('');
+    const [suggestions, setSuggestions] = useState([]);
     const [permissions, setPermissions] = useState('view');
     const [expirationHours, setExpirationHours] = useState(24);
     const [maxAccess, setMaxAccess] = useState('');
@@ -17,6 +19,7 @@ const ShareFileModal = ({ file, onClose, onShare }) => {
     const [error, setError] = useState(null);
     const [loading, setLoading] = useState(false);
     const [copied, setCopied] = useState(false);
+    const latestQuery = useRef('');
 
     const handleShareWithUser = async (e) => {
         e.preventDefault();
@@ -33,6 +36,37 @@ const ShareFileModal = ({ file, onClose, onShare }) => {
         }
     };
 
+    // Debounced suggestions; responses for anything but the current input are dropped
+    const fetchSuggestions = useMemo(
+        () => debounce(async (query) => {
+            try {
+                const results = await getShareSuggestions(query);
+                if (latestQuery.current === query) {
+                    setSuggestions(results);
+                }
+            } catch (err) {
+                if (latestQuery.current === query) {
+                    setSuggestions([]);
+                }
+            }
+        }, 300),
+        []
+    );
+
+    useEffect(() => () => fetchSuggestions.cancel(), [fetchSuggestions]);
+
+    const handleUserIdChange = (e) => {
+        const value = e.target.value;
+        setUserId(value);
+        latestQuery.current = value;
+        if (value.trim().length < 2) {
+            fetchSuggestions.cancel();
+            setSuggestions([]);
+            return;
+        }
+        fetchSuggestions(value);
+    };
+
     const handleGenerateLink = async () => {
         setLoading(true);
         setError(null);
@@ -119,11 +153,19 @@ const ShareFileModal = ({ file, onClose, onShare }) => {
                                 <input
                                     type="email"
                                     value={userId}
-                                    onChange={(e) => setUserId(e.target.value)}
+                                    onChange={handleUserIdChange}
                                     placeholder="Enter user's email"
                                     className="w-full p-2.5 border rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-blue-500"
+                                    list="share-suggestions"
                                     required
                                 />
+                                <datalist id="share-suggestions">
+                                    {suggestions.map((suggestion) => (
+                                        <option key={suggestion.email} value={suggestion.email}>
+                                            {suggestion.name}
+                                        </option>
+                                    ))}
+                                </datalist>
                             </div>
 
                             {/* <div>
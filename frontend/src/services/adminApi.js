@@ -11,8 +11,12 @@ export const getSystemStats = async () => {
     return response.data;
 };
 
-export const getUserManagement = async () => {
-    const response = await api.get('/api/admin/user-management/');
+export const getUserManagement = async ({ page = 1, pageSize = 50, search = '' } = {}) => {
+    const params = { page, page_size: pageSize };
+    if (search) {
+        params.search = search;
+    }
+    const response = await api.get('/api/admin/user-management/', { params });
     return response.data;
 };
 
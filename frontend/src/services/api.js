@@ -1,6 +1,7 @@
 // src/services/api.js
 import axios from 'axios';
 import keycloak from './keycloak';
+import { handleEncryptedDownload } from '../utils/encryption';
 
 const api = axios.create({
     baseURL: import.meta.env.VITE_API_URL,
@@ -96,6 +97,11 @@ export const shareFile = async (fileId, userId, permission = 'view') => {
     }
 };
 
+export const getShareSuggestions = async (query) => {
+    const response = await api.get('/api/files/share-suggestions/', { params: { q: query } });
+    return response.data;
+};
+
 export const generateShareLink = async (fileId, options = {}) => {
     const response = await api.post(`/api/files/${fileId}/share-link/`, {
         expires_in_hours: options.expiresInHours || 24,
@@ -131,6 +137,26 @@ export const downloadSharedFile = async (token, accessToken = null) => {
     return response.data;
 };
 
+// Fetches the stored ciphertext and decrypts it in the browser; compressed
+// files are only served decrypted, so those fall back to a plain download.
+export const downloadFile = async (file) => {
+    try {
+        const response = await api.get(`/api/files/${file.id}/content/?download=true&mode=encrypted`, {
+            responseType: 'blob',
+        });
+        return await handleEncryptedDownload(response, file);
+    } catch (error) {
+        if (error.response?.status !== 400) {
+            throw error;
+        }
+    }
+
+    const response = await api.get(`/api/files/${file.id}/content/?download=true`, {
+        responseType: 'blob',
+    });
+    return response.data;
+};
+
 // File management
 export const deleteFile = async (fileId) => {
     await api.delete(`/api/files/${fileId}/`);
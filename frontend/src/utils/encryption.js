@@ -184,25 +184,85 @@ export async function decryptFernetData(encryptedData, keyBase64) {
     }
 }
 
+const SEGMENT_MAGIC = [0x53, 0x46, 0x45, 0x47]; // "SFEG"
+const SEGMENT_HEADER_SIZE = 16;
+const SEGMENT_TAG_SIZE = 16;
+
+export const isSegmentedData = (data) =>
+    data.length >= SEGMENT_HEADER_SIZE && SEGMENT_MAGIC.every((byte, i) => data[i] === byte);
+
+// Decrypts the server's segmented AES-256-GCM format, as returned by
+// downloads with ?mode=encrypted. Layout: 16-byte header (magic, version,
+// segment size, 7-byte nonce prefix), then segments of ciphertext + tag.
+// Each nonce is prefix | segment index | final flag and the header is
+// authenticated with every segment.
+export async function decryptSegmentedData(encryptedData, keyBase64) {
+    const data = encryptedData instanceof Uint8Array ? encryptedData : new Uint8Array(encryptedData);
+    if (!isSegmentedData(data)) {
+        throw new Error('Not a segmented encrypted file');
+    }
+
+    const header = data.slice(0, SEGMENT_HEADER_SIZE);
+    const view = new DataView(header.buffer);
+    if (view.getUint8(4) !== 1) {
+        throw new Error(`Unsupported format version ${view.getUint8(4)}`);
+    }
+    const segmentSize = view.getUint32(5);
+    const noncePrefix = header.slice(9, 16);
+    const encryptedSegmentSize = segmentSize + SEGMENT_TAG_SIZE;
+
+    const key = await window.crypto.subtle.importKey(
+        "raw",
+        base64ToArrayBuffer(keyBase64),
+        { name: "AES-GCM", length: 256 },
+        false,
+        ["decrypt"]
+    );
+
+    const parts = [];
+    let index = 0;
+    for (let offset = SEGMENT_HEADER_SIZE; ; offset += encryptedSegmentSize, index++) {
+        const end = Math.min(offset + encryptedSegmentSize, data.length);
+        const final = end >= data.length;
+
+        const nonce = new Uint8Array(12);
+        nonce.set(noncePrefix, 0);
+        new DataView(nonce.buffer).setUint32(7, index);
+        nonce[11] = final ? 1 : 0;
+
+        parts.push(new Uint8Array(await window.crypto.subtle.decrypt(
+            { name: "AES-GCM", iv: nonce, additionalData: header, tagLength: 128 },
+            key,
+            data.slice(offset, end)
+        )));
+        if (final) {
+            break;
+        }
+    }
+
+    const plaintext = new Uint8Array(parts.reduce((size, part) => size + part.length, 0));
+    let position = 0;
+    for (const part of parts) {
+        plaintext.set(part, position);
+        position += part.length;
+    }
+    return plaintext;
+}
+
+// Turns a ?mode=encrypted download into a plaintext Blob. Segmented files
+// are recognised by their magic; anything else is a legacy Fernet token.
 export async function handleEncryptedDownload(response, file) {
     try {
-        // Get encryption key from headers
-        const encryptionKey = response.headers.get('x-encryption-key');
-        console.log('Encryption key from headers:', encryptionKey);
-
-        if (encryptionKey) {
-            console.log('No encryption key found, returning raw data');
+        const encryptionKey = response.headers['x-encryption-key'];
+        if (!encryptionKey) {
             return response.data;
         }
 
-        // Convert blob to array buffer
-        const encryptedBuffer = await response.data.arrayBuffer();
-        const encryptedArray = new Uint8Array(encryptedBuffer);
-
-        // Decrypt the data
-        const decryptedData = await decryptFernetData(encryptedArray, encryptionKey);
+        const encryptedArray = new Uint8Array(await response.data.arrayBuffer());
+        const decryptedData = isSegmentedData(encryptedArray)
+            ? await decryptSegmentedData(encryptedArray, encryptionKey)
+            : await decryptFernetData(encryptedArray, encryptionKey);
 
-        // Create a new blob with the decrypted data
         return new Blob([decryptedData], {
             type: file.mime_type || 'application/octet-stream'
         });
@@ -211,4 +271,4 @@ export async function handleEncryptedDownload(response, file) {
         console.error('Download processing error:', error);
         throw error;
     }
-}
\ No newline at end of file
+}